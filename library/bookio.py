@@ -0,0 +1,166 @@
+import csv
+import io
+import json
+import tempfile
+
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from library.cache import invalidate_catalog
+from library.models import Book
+from library.serializers import BookSerializer
+from rest_framework import serializers
+
+# Columns of the export, and what an import may set
+FIELDS = ("id", "title", "author", "cover", "inventory", "daily_fee")
+UPDATE_FIELDS = ("title", "author", "cover", "inventory", "daily_fee")
+FORMATS = ("csv", "ndjson")
+CONTENT_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+# Rejected rows reported in detail; the rest are only counted
+MAX_ERRORS = 100
+
+
+def read_rows(lines, file_format):
+    """(line number, row) pairs of a CSV or NDJSON text stream.
+
+    A line that is not valid JSON yields its error message instead of a row.
+    """
+    if file_format == "csv":
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield number, f"Invalid JSON: {error}"
+            continue
+        if not isinstance(row, dict):
+            yield number, "Expected a JSON object"
+            continue
+        yield number, row
+
+
+class BookImporter:
+    """Validate rows with BookSerializer and upsert them ``chunk_size`` at a
+    time. Rows with an ``id`` update that book or create it with that id,
+    rows without one (or with an empty one) create a new book; invalid rows
+    are skipped, the first ``max_errors`` of them reported by line number."""
+
+    id_field = serializers.IntegerField(min_value=1)
+
+    def __init__(self, chunk_size=1000, max_errors=MAX_ERRORS):
+        self.chunk_size = chunk_size
+        self.max_errors = max_errors
+        self.created = 0
+        self.updated = 0
+        self.rejected = 0
+        self.errors = []
+
+    def reject(self, number, errors):
+        self.rejected += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": number, "errors": errors})
+
+    def validate(self, number, row):
+        if isinstance(row, str):
+            self.reject(number, {"non_field_errors": [row]})
+            return None
+        serializer = BookSerializer(data=row)
+        book_id = row.get("id")
+        errors = {}
+        if book_id in (None, ""):
+            book_id = None
+        else:
+            try:
+                book_id = self.id_field.run_validation(book_id)
+            except serializers.ValidationError as error:
+                errors["id"] = error.detail
+        if not serializer.is_valid():
+            errors.update(serializer.errors)
+        if errors:
+            self.reject(number, errors)
+            return None
+        return Book(id=book_id, **serializer.validated_data)
+
+    def write(self, books):
+        # An upsert cannot touch one row twice, the last row of an id wins
+        with_ids = {book.id: book for book in books if book.id is not None}
+        books = [book for book in books if book.id is None] + list(with_ids.values())
+        with transaction.atomic():
+            existing = Book.objects.filter(id__in=with_ids).count() if with_ids else 0
+            Book.objects.bulk_create(
+                books,
+                update_conflicts=True,
+                unique_fields=["id"],
+                update_fields=UPDATE_FIELDS,
+            )
+        self.updated += existing
+        self.created += len(books) - existing
+
+    def run(self, lines, file_format) -> dict:
+        chunk, with_ids = [], False
+        for number, row in read_rows(lines, file_format):
+            book = self.validate(number, row)
+            if book is None:
+                continue
+            with_ids = with_ids or book.id is not None
+            chunk.append(book)
+            if len(chunk) == self.chunk_size:
+                self.write(chunk)
+                chunk = []
+        if chunk:
+            self.write(chunk)
+
+        if with_ids:
+            # Explicit ids do not move the sequence
+            with connection.cursor() as cursor:
+                for statement in connection.ops.sequence_reset_sql(no_style(), [Book]):
+                    cursor.execute(statement)
+        if self.created or self.updated:
+            invalidate_catalog()
+        return self.report()
+
+    def report(self) -> dict:
+        return {
+            "created": self.created,
+            "updated": self.updated,
+            "rejected": self.rejected,
+            "errors": self.errors,
+        }
+
+
+def export_rows(file_format, queryset=None, chunk_size=2000):
+    """The catalog as CSV or NDJSON text, one chunk of lines at a time,
+    read from the database with a server-side cursor"""
+    queryset = queryset if queryset is not None else Book.objects.order_by("id")
+    rows = queryset.values_list(*FIELDS).iterator(chunk_size=chunk_size)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if file_format == "csv":
+        writer.writerow(FIELDS)
+    for number, row in enumerate(rows, 1):
+        if file_format == "csv":
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(dict(zip(FIELDS, row)), cls=DjangoJSONEncoder))
+            buffer.write("\n")
+        if number % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_file(file_format, queryset=None, chunk_size=2000):
+    """The same export spooled to a temporary file, rewound for reading"""
+    file = tempfile.TemporaryFile()
+    for chunk in export_rows(file_format, queryset, chunk_size):
+        file.write(chunk.encode())
+    file.seek(0)
+    return file
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+NAMESPACES = {}
+
+
+class CacheNamespace:
+    """A group of cache keys sharing one version and hit/miss counters.
+
+    Keys are stored as ``<namespace>:<version>:<key>``; ``invalidate()``
+    starts a new version, which makes every key of the namespace
+    unreachable at once. A value can also be stored with tags, each with a
+    version of its own: ``invalidate_tags()`` makes only the values stored
+    with those tags stale. Lookups are counted in process and added to
+    shared counters every ``flush_every`` lookups, so ``stats()`` reports
+    the ratio over all workers.
+    """
+
+    flush_every = 100
+
+    def __init__(self, namespace, alias="default"):
+        self.namespace = namespace
+        self.alias = alias
+        self.version_key = f"{namespace}:version"
+        self.pending = Counter()
+        self.lock = threading.Lock()
+        NAMESPACES[namespace] = self
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def version(self) -> int:
+        """Nanosecond timestamp of the last invalidation"""
+        version = self.cache.get(self.version_key)
+        if version is None:
+            self.cache.add(self.version_key, time.time_ns(), None)
+            version = self.cache.get(self.version_key)
+        return version
+
+    def bump(self):
+        self.cache.set(self.version_key, time.time_ns(), None)
+
+    def invalidate(self):
+        """Start a new version now, and again once the current transaction
+        commits, so a reader that cached rows from before the commit under
+        the intermediate version is never served again"""
+        self.bump()
+        transaction.on_commit(self.bump)
+
+    def tag_key(self, tag) -> str:
+        return f"{self.namespace}:tag:{tag}"
+
+    def tag_versions(self, tags, missing=None) -> dict:
+        """The current version of each tag; a tag seen for the first time
+        (or evicted) starts at ``missing``, the current time by default"""
+        keys = {self.tag_key(tag): tag for tag in tags}
+        found = self.cache.get_many(keys)
+        if len(found) < len(keys):
+            start = time.time_ns() if missing is None else missing
+            for key in keys.keys() - found.keys():
+                self.cache.add(key, start, None)
+            found.update(self.cache.get_many(keys.keys() - found.keys()))
+        return {keys[key]: version for key, version in found.items()}
+
+    def invalidate_tags(self, tags):
+        """Like invalidate(), for the values stored with any of ``tags``"""
+
+        def bump():
+            now = time.time_ns()
+            self.cache.set_many({self.tag_key(tag): now for tag in tags}, None)
+
+        bump()
+        transaction.on_commit(bump)
+
+    def make_key(self, key, version=None) -> str:
+        if version is None:
+            version = self.version()
+        return f"{self.namespace}:{version}:{key}"
+
+    def get(self, key, version=None):
+        stored = self.cache.get(self.make_key(key, version))
+        if stored is not None and stored["tags"]:
+            if self.tag_versions(stored["tags"]) != stored["tags"]:
+                stored = None
+        self.record("misses" if stored is None else "hits")
+        return None if stored is None else stored["value"]
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, tags=None):
+        """``tags`` maps each tag to the version the value was built from"""
+        self.cache.set(
+            self.make_key(key, version), {"value": value, "tags": tags or {}}, timeout
+        )
+
+    def stats_key(self, outcome) -> str:
+        return f"{self.namespace}:stats:{outcome}"
+
+    def record(self, outcome):
+        with self.lock:
+            self.pending[outcome] += 1
+            full = sum(self.pending.values()) >= self.flush_every
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, Counter()
+        for outcome, count in pending.items():
+            self.cache.add(self.stats_key(outcome), 0, None)
+            self.cache.incr(self.stats_key(outcome), count)
+
+    def stats(self) -> dict:
+        self.flush()
+        hits = self.cache.get(self.stats_key("hits"), 0)
+        misses = self.cache.get(self.stats_key("misses"), 0)
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / lookups, 4) if lookups else None,
+        }
+
+    def reset_stats(self):
+        with self.lock:
+            self.pending = Counter()
+        self.cache.delete_many([self.stats_key("hits"), self.stats_key("misses")])
+
+
+catalog = CacheNamespace("catalog")
+
+
+def invalidate_catalog():
+    catalog.invalidate()
+
+
+def invalidate_books(*book_ids):
+    """Only the cached pages showing these books, after their stock changed"""
+    catalog.invalidate_tags([f"book:{book_id}" for book_id in book_ids] + ["stock"])
+
+
+def catalog_tags(request, data) -> list:
+    """The books a page shows; a page filtered by availability depends on
+    the stock of every book"""
+    books = data["results"] if "results" in data else [data]
+    tags = [f"book:{book['id']}" for book in books]
+    if "available" in request.query_params:
+        tags.append("stock")
+    return tags
+
+
+def catalog_key(request, view, **kwargs) -> str:
+    params = sorted(request.query_params.lists())
+    raw = json.dumps([request.get_host(), view, kwargs, params], sort_keys=True)
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def cached_catalog_response(request, view, handler, *args, **kwargs):
+    """Serve a catalog GET from the cache, answering conditional GETs with 304.
+
+    Entries live in the catalog namespace, so saving or deleting a Book
+    makes every cached page and detail unreachable at once. A checkout or
+    return only changes stock, and makes stale just the entries showing
+    that book (see invalidate_books).
+    """
+    version = catalog.version()
+    key = catalog_key(request, view, **kwargs)
+    entry = catalog.get(key, version)
+
+    if entry is None:
+        started = time.time_ns()
+        response = handler(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+        content = json.dumps(response.data, cls=DjangoJSONEncoder)
+        tags = catalog.tag_versions(
+            catalog_tags(request, response.data), missing=started
+        )
+        entry = {
+            "data": json.loads(content),
+            "etag": quote_etag(hashlib.md5(content.encode()).hexdigest()),
+            "last_modified": max([version, *tags.values()]) // 10**9,
+        }
+        # A book that changed while the page was read may be shown as it was
+        if all(tag_version <= started for tag_version in tags.values()):
+            catalog.set(key, entry, settings.CATALOG_CACHE_TIMEOUT, version, tags)
+
+    response = Response(entry["data"])
+    response["ETag"] = entry["etag"]
+    response["Last-Modified"] = http_date(entry["last_modified"])
+    return get_conditional_response(
+        request,
+        etag=entry["etag"],
+        last_modified=entry["last_modified"],
+        response=response,
+    )
@@ -0,0 +1,75 @@
+from django.db import transaction
+from django.db.models import (
+    Count,
+    F,
+    IntegerField,
+    Max,
+    Min,
+    OuterRef,
+    Q,
+    Subquery,
+)
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from library.cache import invalidate_catalog
+from library.models import Book, Borrowing
+
+COUNTERS = ("active_loans", "overdue_loans", "total_loans")
+
+
+def loan_counts(today, fields=COUNTERS) -> dict:
+    """Correlated COUNTs of a Book's borrowings, one expression per counter"""
+    borrowings = {
+        "active_loans": Borrowing.objects.filter(actual_return_date=None),
+        "overdue_loans": Borrowing.objects.filter(
+            actual_return_date=None, expected_return_date__lt=today
+        ),
+        "total_loans": Borrowing.objects.all(),
+    }
+    return {
+        field: Coalesce(
+            Subquery(
+                borrowings[field]
+                .filter(book=OuterRef("pk"))
+                .order_by()
+                .values("book")
+                .annotate(count=Count("id"))
+                .values("count"),
+                output_field=IntegerField(),
+            ),
+            0,
+        )
+        for field in fields
+    }
+
+
+def reconcile(fields=COUNTERS, batch_size=10000, dry_run=False, today=None) -> int:
+    """Recount the loan counters of all books, one id range at a time, and
+    repair the ones that drifted. Returns how many books had drifted."""
+    today = today or timezone.localdate()
+    bounds = Book.objects.aggregate(first=Min("id"), last=Max("id"))
+    if bounds["first"] is None:
+        return 0
+
+    counted = {
+        f"counted_{field}": expression
+        for field, expression in loan_counts(today, fields).items()
+    }
+    drift = Q()
+    for field in fields:
+        drift |= ~Q(**{field: F(f"counted_{field}")})
+
+    drifted = 0
+    for start in range(bounds["first"], bounds["last"] + 1, batch_size):
+        with transaction.atomic():
+            books = Book.objects.filter(id__gte=start, id__lt=start + batch_size)
+            ids = list(
+                books.alias(**counted).filter(drift).values_list("id", flat=True)
+            )
+            if ids and not dry_run:
+                Book.objects.filter(id__in=ids).update(**loan_counts(today, fields))
+            drifted += len(ids)
+
+    if drifted and not dry_run:
+        invalidate_catalog()
+    return drifted
@@ -0,0 +1,356 @@
+import datetime
+import io
+import random
+from collections import Counter
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from library.cache import invalidate_catalog
+from library.counters import reconcile
+from library.models import Book, Borrowing, Payment
+
+USER_COLUMNS = (
+    "id",
+    "password",
+    "last_login",
+    "is_superuser",
+    "username",
+    "first_name",
+    "last_name",
+    "email",
+    "is_staff",
+    "is_active",
+    "date_joined",
+)
+BOOK_COLUMNS = (
+    "id",
+    "title",
+    "author",
+    "cover",
+    "inventory",
+    "daily_fee",
+    "active_loans",
+    "overdue_loans",
+    "total_loans",
+)
+BORROWING_COLUMNS = (
+    "id",
+    "borrow_date",
+    "expected_return_date",
+    "actual_return_date",
+    "book_id",
+    "user_id",
+    "is_active",
+)
+PAYMENT_COLUMNS = (
+    "id",
+    "status",
+    "type",
+    "borrowing_id",
+    "session_url",
+    "session_id",
+    "money_to_pay",
+    "created_at",
+)
+
+
+def copy_value(value) -> str:
+    """Format a value for COPY ... FROM STDIN in text format"""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+class CopyWriter:
+    """Stream rows into PostgreSQL with COPY, the fastest way in."""
+
+    def write(self, model, columns, rows):
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write("\t".join(map(copy_value, row)))
+            buffer.write("\n")
+        buffer.seek(0)
+        quoted = ", ".join(connection.ops.quote_name(column) for column in columns)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {connection.ops.quote_name(model._meta.db_table)} "
+                f"({quoted}) FROM STDIN",
+                buffer,
+            )
+
+
+class InsertWriter:
+    """Multi-row INSERTs, as many rows per statement as the database takes."""
+
+    max_parameters = 65535
+
+    def write(self, model, columns, rows):
+        rows = list(rows)
+        batch_size = min(
+            connection.ops.bulk_batch_size(columns, rows),
+            self.max_parameters // len(columns),
+        )
+        table = connection.ops.quote_name(model._meta.db_table)
+        quoted = ", ".join(connection.ops.quote_name(column) for column in columns)
+        placeholder = "(" + ", ".join(["%s"] * len(columns)) + ")"
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start : start + batch_size]
+                cursor.execute(
+                    f"INSERT INTO {table} ({quoted}) VALUES "
+                    + ", ".join([placeholder] * len(batch)),
+                    [value for row in batch for value in row],
+                )
+
+
+WRITERS = {"copy": CopyWriter, "insert": InsertWriter}
+
+
+def next_id(model) -> int:
+    return (model.objects.aggregate(last=Max("id"))["last"] or 0) + 1
+
+
+class DataGenerator:
+    """Synthetic users, books, borrowings and payments for large-scale tests.
+
+    ``hot_share`` of all borrowings go to the first ``hot_books`` fraction
+    of the generated books; ``overdue_ratio`` and ``active_ratio`` of them
+    are still out, overdue or not, the rest were returned and have a
+    payment, ``paid_ratio`` of which are paid. Ids are allocated up front,
+    so rows are written without reading anything back, and the sequences
+    are moved past them at the end.
+
+    As through the API, a user has at most one loan out and a loan takes a
+    copy off the shelf: a loan that would break either rule becomes a past
+    one, and the inventory of the books is reduced by the loans still out.
+    """
+
+    history_days = 730
+
+    def __init__(
+        self,
+        writer,
+        batch_size=50_000,
+        overdue_ratio=0.05,
+        active_ratio=0.1,
+        hot_books=0.01,
+        hot_share=0.5,
+        paid_ratio=0.9,
+        seed=None,
+    ):
+        self.writer = writer
+        self.batch_size = batch_size
+        self.overdue_ratio = overdue_ratio
+        self.active_ratio = active_ratio
+        self.hot_books = hot_books
+        self.hot_share = hot_share
+        self.paid_ratio = paid_ratio
+        self.random = random.Random(seed)
+        self.today = datetime.date.today()
+
+    def write_batches(self, model, columns, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == self.batch_size:
+                with transaction.atomic():
+                    self.writer.write(model, columns, batch)
+                batch = []
+        if batch:
+            with transaction.atomic():
+                self.writer.write(model, columns, batch)
+
+    def user_rows(self, first_id, count):
+        password = make_password("password")
+        now = timezone.now()
+        for user_id in range(first_id, first_id + count):
+            email = f"user{user_id}@example.com"
+            yield (
+                user_id,
+                password,
+                None,
+                False,
+                email,
+                "",
+                "",
+                email,
+                False,
+                True,
+                now,
+            )
+
+    def book_rows(self, first_id, count):
+        for book_id in range(first_id, first_id + count):
+            yield (
+                book_id,
+                f"Book {book_id}",
+                f"Author {book_id % 1000}",
+                self.random.choice(Book.CoverChoices.values),
+                self.random.randint(1, 20),
+                Decimal(self.random.randint(10, 500)) / 1000,
+                0,
+                0,
+                0,
+            )
+
+    def pick(self, ids, hot=None):
+        if hot and self.random.random() < self.hot_share:
+            return ids[self.random.randrange(hot)]
+        return ids[self.random.randrange(len(ids))]
+
+    def borrowing_dates(self):
+        """borrow_date, expected_return_date and actual_return_date"""
+        roll = self.random.random()
+        if roll < self.overdue_ratio:
+            borrow_date = self.today - datetime.timedelta(self.random.randint(31, 90))
+            return (
+                borrow_date,
+                borrow_date + datetime.timedelta(self.random.randint(7, 30)),
+                None,
+            )
+        if roll < self.overdue_ratio + self.active_ratio:
+            return (
+                self.today - datetime.timedelta(self.random.randint(0, 6)),
+                self.today + datetime.timedelta(self.random.randint(1, 30)),
+                None,
+            )
+        return self.returned_dates()
+
+    def returned_dates(self):
+        borrow_date = self.today - datetime.timedelta(
+            self.random.randint(8, self.history_days)
+        )
+        returned = borrow_date + datetime.timedelta(self.random.randint(1, 40))
+        return (
+            borrow_date,
+            borrow_date + datetime.timedelta(self.random.randint(7, 30)),
+            min(returned, self.today),
+        )
+
+    def generate(self, users=0, books=0, borrowings=0, log=None) -> dict:
+        created = {"users": users, "books": books, "borrowings": 0, "payments": 0}
+        first_user = next_id(get_user_model())
+        first_book = next_id(Book)
+        self.write_batches(
+            get_user_model(), USER_COLUMNS, self.user_rows(first_user, users)
+        )
+        self.write_batches(Book, BOOK_COLUMNS, self.book_rows(first_book, books))
+        if log:
+            log(f"{users} users, {books} books")
+
+        if borrowings:
+            user_ids = self.ids(get_user_model(), first_user, users)
+            book_ids = self.ids(Book, first_book, books)
+            hot = max(int(len(book_ids) * self.hot_books), 1)
+            stock = dict(
+                Book.objects.filter(
+                    id__gte=book_ids[0], id__lte=book_ids[-1]
+                ).values_list("id", "inventory")
+            )
+            borrowers = set(
+                Borrowing.objects.filter(actual_return_date=None).values_list(
+                    "user_id", flat=True
+                )
+            )
+            taken = Counter()
+            borrowing_id = next_id(Borrowing)
+            payment_id = next_id(Payment)
+            for start in range(0, borrowings, self.batch_size):
+                borrowing_rows, payment_rows = [], []
+                for _ in range(min(self.batch_size, borrowings - start)):
+                    borrow_date, expected, actual = self.borrowing_dates()
+                    book_id = self.pick(book_ids, hot)
+                    user_id = self.pick(user_ids)
+                    if actual is None:
+                        if stock.get(book_id) and user_id not in borrowers:
+                            stock[book_id] -= 1
+                            taken[book_id] += 1
+                            borrowers.add(user_id)
+                        else:
+                            borrow_date, expected, actual = self.returned_dates()
+                    borrowing_rows.append(
+                        (
+                            borrowing_id,
+                            borrow_date,
+                            expected,
+                            actual,
+                            book_id,
+                            user_id,
+                            actual is None,
+                        )
+                    )
+                    if actual is not None:
+                        paid = self.random.random() < self.paid_ratio
+                        payment_rows.append(
+                            (
+                                payment_id,
+                                Payment.StatusChoices.PAID
+                                if paid
+                                else Payment.StatusChoices.PENDING,
+                                Payment.TypeChoices.PAYMENT
+                                if actual <= expected
+                                else Payment.TypeChoices.FINE,
+                                borrowing_id,
+                                None,
+                                f"cs_gen_{payment_id}",
+                                Decimal(self.random.randint(500, 99999)) / 1000,
+                                datetime.datetime.combine(
+                                    actual, datetime.time(), datetime.timezone.utc
+                                ),
+                            )
+                        )
+                        payment_id += 1
+                    borrowing_id += 1
+                with transaction.atomic():
+                    self.writer.write(Borrowing, BORROWING_COLUMNS, borrowing_rows)
+                    self.writer.write(Payment, PAYMENT_COLUMNS, payment_rows)
+                created["borrowings"] += len(borrowing_rows)
+                created["payments"] += len(payment_rows)
+                if log:
+                    log(f"{created['borrowings']} borrowings")
+            Book.objects.bulk_update(
+                [Book(id=book_id, inventory=stock[book_id]) for book_id in taken],
+                ["inventory"],
+                batch_size=self.batch_size,
+            )
+
+        self.reset_sequences()
+        if borrowings:
+            reconcile()
+        elif books:
+            invalidate_catalog()
+        return created
+
+    @staticmethod
+    def ids(model, first_id, count):
+        """The rows generated just now, or else all existing ones, in id order"""
+        if count:
+            return range(first_id, first_id + count)
+        ids = list(model.objects.order_by("id").values_list("id", flat=True))
+        if not ids:
+            raise ValueError(f"No {model._meta.verbose_name_plural} to borrow")
+        return ids
+
+    @staticmethod
+    def reset_sequences():
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), [get_user_model(), Book, Borrowing, Payment]
+        )
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
@@ -0,0 +1,52 @@
+import time
+
+from django.db import connection
+from django.db.models import BooleanField, ExpressionWrapper, Q
+from django.utils import timezone
+from library import metrics
+from library.fees import CurrentDate, fee_expression, fine_expression
+from library.models import BookDebt, DebtRefresh, UserDebt
+
+VIEWS = (UserDebt, BookDebt)
+
+
+def open_loan_fees(borrowings):
+    """SQL and params of what every open loan among ``borrowings`` owes
+    today, per user and book, from the same expressions as accrued_fees;
+    the library_open_loan_fee view is created from it"""
+    today = CurrentDate()
+    queryset = (
+        borrowings.filter(actual_return_date=None)
+        .values("user_id", "book_id")
+        .annotate(
+            overdue=ExpressionWrapper(
+                Q(expected_return_date__lt=today), output_field=BooleanField()
+            ),
+            accrued=fee_expression(today),
+            fine=fine_expression(today),
+        )
+        .order_by()
+    )
+    return queryset.query.sql_with_params()
+
+
+def refresh(concurrently=True):
+    """Recompute the debt views. CONCURRENTLY keeps them readable meanwhile
+    and only rewrites the rows that changed; the time of the refresh is
+    stored apart in DebtRefresh."""
+    for model in VIEWS:
+        start = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "REFRESH MATERIALIZED VIEW "
+                + ("CONCURRENTLY " if concurrently else "")
+                + connection.ops.quote_name(model._meta.db_table)
+            )
+        DebtRefresh.objects.update_or_create(
+            view=model._meta.db_table, defaults={"refreshed_at": timezone.now()}
+        )
+        metrics.emit(
+            "debts.refreshed",
+            view=model._meta.db_table,
+            ms=round((time.perf_counter() - start) * 1000),
+        )
@@ -0,0 +1,123 @@
+import datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import (
+    Case,
+    Count,
+    DateField,
+    DecimalField,
+    ExpressionWrapper,
+    F,
+    Func,
+    IntegerField,
+    Q,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce, Greatest
+
+# Nothing is ever charged less than this
+MINIMUM_CHARGE = Decimal("0.5")
+
+FEE_FIELD = DecimalField(max_digits=12, decimal_places=3)
+
+
+def fee(borrow_date, expected_return_date, return_date, daily_fee) -> Decimal:
+    """Daily fee for every day of the loan; the days past the expected
+    return date cost FINE_MULTIPLIER times as much"""
+    if expected_return_date < return_date:
+        days = (expected_return_date - borrow_date).days + (
+            return_date - expected_return_date
+        ).days * settings.FINE_MULTIPLIER
+    else:
+        days = (return_date - borrow_date).days
+    return max(days * daily_fee, MINIMUM_CHARGE)
+
+
+class DaysBetween(Func):
+    """Whole days from the second date to the first (PostgreSQL date - date)"""
+
+    arg_joiner = " - "
+    template = "(%(expressions)s)"
+    output_field = IntegerField()
+
+
+class CurrentDate(Func):
+    """Today's date as the database sees it, evaluated by each query"""
+
+    template = "CURRENT_DATE"
+    output_field = DateField()
+
+
+def returned_expression(return_date=None):
+    """When each borrowing was or is taken to be returned; ``return_date``
+    is a date or a date expression such as CurrentDate()"""
+    if return_date is None:
+        return F("actual_return_date")
+    if not hasattr(return_date, "resolve_expression"):
+        return_date = Value(return_date, output_field=DateField())
+    return Coalesce("actual_return_date", return_date)
+
+
+def fee_expression(return_date=None):
+    """fee() of each borrowing as a SQL expression.
+
+    ``return_date`` defaults to the actual return date; a date passed in
+    stands in for the open loans, e.g. today for what they would owe now.
+    """
+    returned = returned_expression(return_date)
+    days = Case(
+        When(
+            Q(expected_return_date__lt=returned),
+            then=DaysBetween("expected_return_date", "borrow_date")
+            + DaysBetween(returned, "expected_return_date")
+            * Value(settings.FINE_MULTIPLIER),
+        ),
+        default=DaysBetween(returned, "borrow_date"),
+        output_field=IntegerField(),
+    )
+    return Greatest(
+        ExpressionWrapper(days * F("book__daily_fee"), output_field=FEE_FIELD),
+        Value(MINIMUM_CHARGE, output_field=FEE_FIELD),
+        output_field=FEE_FIELD,
+    )
+
+
+def fine_expression(return_date=None):
+    """The part of fee_expression() charged for the late days, on top of
+    the daily fee"""
+    returned = returned_expression(return_date)
+    return Case(
+        When(
+            Q(expected_return_date__lt=returned),
+            then=ExpressionWrapper(
+                DaysBetween(returned, "expected_return_date")
+                * Value(settings.FINE_MULTIPLIER)
+                * F("book__daily_fee"),
+                output_field=FEE_FIELD,
+            ),
+        ),
+        default=Value(Decimal(0)),
+        output_field=FEE_FIELD,
+    )
+
+
+def accrued_fees(borrowings, on_date=None) -> dict:
+    """What the open loans among ``borrowings`` would owe on ``on_date``,
+    in one aggregate query"""
+    on_date = on_date or datetime.date.today()
+    open_loans = borrowings.filter(actual_return_date=None)
+    return open_loans.annotate(
+        fee=fee_expression(on_date), fine=fine_expression(on_date)
+    ).aggregate(
+        loans=Count("id"),
+        total=Coalesce(Sum("fee"), Value(Decimal(0)), output_field=FEE_FIELD),
+        fines=Coalesce(Sum("fine"), Value(Decimal(0)), output_field=FEE_FIELD),
+        overdue=Coalesce(
+            Sum("fee", filter=Q(expected_return_date__lt=on_date)),
+            Value(Decimal(0)),
+            output_field=FEE_FIELD,
+        ),
+    )
@@ -0,0 +1,292 @@
+import datetime
+import hashlib
+import hmac
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+
+import httpx
+
+BOOKS_PATH = "/api/library/books/"
+BORROWINGS_PATH = "/api/library/borrowings/"
+PAYMENTS_PATH = "/api/library/payments/"
+PAYMENT_SUCCESS_PATH = "/api/library/payments/success/"
+TOKEN_PATH = "/api/users/token/"
+WEBHOOK_PATH = "/api/library/stripe/webhook/"
+
+# Relative weight of each scenario in the default mix
+MIX = {"browse": 8, "loan": 2}
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(p / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def sign_payload(payload, secret, timestamp=None) -> str:
+    """A Stripe-Signature header for ``payload``, as Stripe computes it"""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signature = hmac.new(
+        secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256
+    ).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+class Recorder:
+    """Latencies and errors per request name, shared by all virtual users."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.lock = threading.Lock()
+
+    def record(self, name, seconds, ok=True):
+        with self.lock:
+            self.latencies[name].append(seconds)
+            if not ok:
+                self.errors[name] += 1
+
+    def report(self, elapsed) -> dict:
+        requests = {}
+        for name, latencies in sorted(self.latencies.items()):
+            requests[name] = {
+                "count": len(latencies),
+                "errors": self.errors[name],
+                "rps": round(len(latencies) / elapsed, 2),
+                **{
+                    f"p{p}_ms": round(percentile(latencies, p) * 1000, 2)
+                    for p in (50, 90, 95, 99)
+                },
+                "max_ms": round(max(latencies) * 1000, 2),
+            }
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        return {
+            "elapsed": round(elapsed, 3),
+            "requests": total,
+            "errors": sum(self.errors.values()),
+            "rps": round(total / elapsed, 2),
+            "scenarios": requests,
+        }
+
+
+class VirtualUser:
+    """One client session: logs in once, then runs scenarios from the mix."""
+
+    def __init__(self, load_test, email, password):
+        self.load_test = load_test
+        self.email = email
+        self.password = password
+        self.client = load_test.make_client()
+        self.pages = 1
+
+    def request(self, name, method, path, expected=(200,), **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.client.request(method, path, **kwargs)
+        except httpx.HTTPError:
+            self.load_test.recorder.record(name, time.perf_counter() - start, False)
+            return None
+        ok = response.status_code in expected
+        self.load_test.recorder.record(name, time.perf_counter() - start, ok)
+        return response if ok else None
+
+    def login(self):
+        response = self.request(
+            "token",
+            "POST",
+            TOKEN_PATH,
+            data={"email": self.email, "password": self.password},
+        )
+        if response is None:
+            return False
+        self.client.headers["Authorization"] = f"Bearer {response.json()['access']}"
+        return True
+
+    def browse(self):
+        response = self.request(
+            "browse", "GET", BOOKS_PATH, params={"page": random.randint(1, self.pages)}
+        )
+        if response is not None:
+            count = response.json()["count"]
+            self.pages = max(math.ceil(count / 10), 1)
+            return response.json()["results"]
+        return []
+
+    def loan(self):
+        """Borrow a book from the catalog, return it and pay for it"""
+        books = [book for book in self.browse() if book["inventory"] > 0]
+        if not books:
+            return
+        expected_return_date = datetime.date.today() + datetime.timedelta(days=7)
+        borrowing = self.request(
+            "checkout",
+            "POST",
+            BORROWINGS_PATH,
+            expected=(201,),
+            data={
+                "book": random.choice(books)["id"],
+                "expected_return_date": expected_return_date.isoformat(),
+            },
+        )
+        if borrowing is None:
+            return
+
+        payment = self.request(
+            "return",
+            "PUT",
+            f"{BORROWINGS_PATH}{borrowing.json()['id']}/",
+            expected=(200, 202),
+        )
+        if payment is None or "session_id" not in payment.json():
+            return
+
+        session_id = self.load_test.wait_for_session(self, payment.json()["id"])
+        if session_id and self.load_test.webhook_secret:
+            self.checkout_completed(session_id)
+        if session_id:
+            self.request(
+                "payment_success",
+                "GET",
+                PAYMENT_SUCCESS_PATH,
+                params={"session_id": session_id},
+            )
+
+    def checkout_completed(self, session_id):
+        """What Stripe sends once the session is paid"""
+        payload = json.dumps(
+            {
+                "id": f"evt_{uuid.uuid4().hex}",
+                "object": "event",
+                "type": "checkout.session.completed",
+                "data": {
+                    "object": {
+                        "id": session_id,
+                        "object": "checkout.session",
+                        "payment_status": "paid",
+                    }
+                },
+            }
+        )
+        self.request(
+            "webhook",
+            "POST",
+            WEBHOOK_PATH,
+            content=payload,
+            headers={
+                "Content-Type": "application/json",
+                "Stripe-Signature": sign_payload(
+                    payload, self.load_test.webhook_secret
+                ),
+            },
+        )
+
+    def run(self, deadline, iterations=None):
+        if not self.login():
+            return
+        scenarios, weights = zip(*self.load_test.mix.items())
+        done = 0
+        while time.monotonic() < deadline and (iterations is None or done < iterations):
+            getattr(self, random.choices(scenarios, weights)[0])()
+            done += 1
+
+
+class LoadTest:
+    """Drive a running server with ``concurrency`` virtual users.
+
+    Checkout sessions are created by the outbox relay, so payments are only
+    confirmed when Celery beat and a worker run next to the server; point
+    PAYMENT_GATEWAY_BACKEND and NOTIFICATION_TRANSPORT_BACKEND at the fake
+    backends to keep Stripe and Telegram out of the measurements. With
+    ``webhook_secret`` the virtual users also send the signed webhook that
+    confirms each payment, as Stripe would.
+    """
+
+    def __init__(
+        self,
+        base_url,
+        users,
+        concurrency=10,
+        duration=30.0,
+        iterations=None,
+        mix=None,
+        session_polls=10,
+        poll_interval=0.2,
+        transport=None,
+        webhook_secret=None,
+    ):
+        self.base_url = base_url
+        self.users = users
+        self.concurrency = concurrency
+        self.duration = duration
+        self.iterations = iterations
+        self.mix = mix or MIX
+        self.session_polls = session_polls
+        self.poll_interval = poll_interval
+        self.transport = transport
+        self.webhook_secret = webhook_secret
+        self.recorder = Recorder()
+
+    def make_client(self) -> httpx.Client:
+        return httpx.Client(
+            base_url=self.base_url, transport=self.transport, timeout=30.0
+        )
+
+    def wait_for_session(self, user, payment_id):
+        for _ in range(self.session_polls):
+            response = user.request("payment", "GET", f"{PAYMENTS_PATH}{payment_id}/")
+            if response is not None and response.json()["session_id"]:
+                return response.json()["session_id"]
+            time.sleep(self.poll_interval)
+        return None
+
+    def run(self) -> dict:
+        start = time.monotonic()
+        deadline = start + self.duration
+        virtual_users = [
+            VirtualUser(self, *self.users[i % len(self.users)])
+            for i in range(self.concurrency)
+        ]
+        if self.concurrency == 1:
+            virtual_users[0].run(deadline, self.iterations)
+        else:
+            threads = [
+                threading.Thread(target=user.run, args=(deadline, self.iterations))
+                for user in virtual_users
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        return self.recorder.report(time.monotonic() - start)
+
+
+def compare(report, baseline, tolerance=0.2) -> list:
+    """Regressions of ``report`` against ``baseline``: a p95 latency more
+    than ``tolerance`` above it, or a throughput more than ``tolerance`` below
+    it. Scenarios missing from either report are not compared."""
+    regressions = []
+    for name, stats in report["scenarios"].items():
+        base = baseline["scenarios"].get(name)
+        if base is None:
+            continue
+        if stats["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: p95 {stats['p95_ms']}ms, baseline {base['p95_ms']}ms"
+            )
+        if stats["errors"] > base["errors"]:
+            regressions.append(
+                f"{name}: {stats['errors']} errors, baseline {base['errors']}"
+            )
+    if report["rps"] < baseline["rps"] * (1 - tolerance):
+        regressions.append(
+            f"throughput {report['rps']} req/s, baseline {baseline['rps']} req/s"
+        )
+    return regressions
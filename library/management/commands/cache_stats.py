@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from library import metrics
+from library.cache import NAMESPACES
+
+
+class Command(BaseCommand):
+    """Print the hit/miss ratio of every cache namespace"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reset", action="store_true", help="Zero the counters afterwards"
+        )
+
+    def handle(self, *args, **options):
+        for name, namespace in sorted(NAMESPACES.items()):
+            stats = namespace.stats()
+            metrics.emit("cache.stats", namespace=name, **stats)
+            self.stdout.write(
+                f"{name}: hits={stats['hits']} misses={stats['misses']} "
+                f"hit_ratio={stats['hit_ratio']}"
+            )
+            if options["reset"]:
+                namespace.reset_stats()
@@ -0,0 +1,73 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from library.datagen import WRITERS, DataGenerator
+
+
+class Command(BaseCommand):
+    """Fill the database with synthetic users, books, borrowings and payments"""
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--books", type=int, default=1000)
+        parser.add_argument("--borrowings", type=int, default=10000)
+        parser.add_argument("--overdue-ratio", type=float, default=0.05)
+        parser.add_argument("--active-ratio", type=float, default=0.1)
+        parser.add_argument(
+            "--hot-books",
+            type=float,
+            default=0.01,
+            help="Fraction of the books that are hot titles",
+        )
+        parser.add_argument(
+            "--hot-share",
+            type=float,
+            default=0.5,
+            help="Fraction of the borrowings that go to hot titles",
+        )
+        parser.add_argument("--paid-ratio", type=float, default=0.9)
+        parser.add_argument("--batch-size", type=int, default=50_000)
+        parser.add_argument(
+            "--method",
+            choices=WRITERS,
+            help="copy (PostgreSQL only, the default there) or insert",
+        )
+        parser.add_argument("--seed", type=int)
+
+    def handle(self, *args, **options):
+        method = options["method"] or (
+            "copy" if connection.vendor == "postgresql" else "insert"
+        )
+        if method == "copy" and connection.vendor != "postgresql":
+            raise CommandError("COPY needs PostgreSQL, use --method insert")
+
+        generator = DataGenerator(
+            WRITERS[method](),
+            batch_size=options["batch_size"],
+            overdue_ratio=options["overdue_ratio"],
+            active_ratio=options["active_ratio"],
+            hot_books=options["hot_books"],
+            hot_share=options["hot_share"],
+            paid_ratio=options["paid_ratio"],
+            seed=options["seed"],
+        )
+        start = time.monotonic()
+        try:
+            created = generator.generate(
+                users=options["users"],
+                books=options["books"],
+                borrowings=options["borrowings"],
+                log=self.stdout.write,
+            )
+        except ValueError as exc:
+            raise CommandError(exc)
+        elapsed = time.monotonic() - start
+
+        rows = sum(created.values())
+        self.stdout.write(
+            self.style.SUCCESS(
+                ", ".join(f"{count} {name}" for name, count in created.items())
+                + f" in {elapsed:.1f}s ({rows / elapsed * 60:,.0f} rows/min)"
+            )
+        )
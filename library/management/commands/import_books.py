@@ -0,0 +1,32 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from library.bookio import FORMATS, BookImporter
+
+
+class Command(BaseCommand):
+    """Upsert books from a CSV or NDJSON file, one chunk at a time"""
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument(
+            "--format", choices=FORMATS, help="Taken from the file name by default"
+        )
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        file_format = options["format"] or options["path"].rsplit(".", 1)[-1].lower()
+        if file_format not in FORMATS:
+            raise CommandError(f"Unknown format, use --format {'/'.join(FORMATS)}")
+
+        with open(options["path"], encoding="utf-8-sig", newline="") as file:
+            report = BookImporter(options["chunk_size"]).run(file, file_format)
+
+        for error in report["errors"]:
+            self.stderr.write(f"line {error['line']}: {json.dumps(error['errors'])}")
+        self.stdout.write(
+            f"{report['created']} created, {report['updated']} updated, "
+            f"{report['rejected']} rejected"
+        )
+        if report["rejected"] > len(report["errors"]):
+            self.stderr.write(f"only the first {len(report['errors'])} are listed")
@@ -0,0 +1,93 @@
+import json
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from library.loadtest import MIX, LoadTest, compare
+
+PASSWORD = "loadtest-password"
+
+
+class Command(BaseCommand):
+    """Run the load-test scenarios against a running server and compare the
+    result with a stored baseline"""
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000")
+        parser.add_argument("--concurrency", type=int, default=10)
+        parser.add_argument("--duration", type=float, default=30.0)
+        parser.add_argument(
+            "--mix",
+            default=",".join(f"{name}={weight}" for name, weight in MIX.items()),
+            help="Scenario weights, e.g. browse=8,loan=2",
+        )
+        parser.add_argument("--report", help="Write the report to this JSON file")
+        parser.add_argument("--baseline", help="Fail on regression against it")
+        parser.add_argument(
+            "--save-baseline", help="Write the report as the new baseline"
+        )
+        parser.add_argument("--tolerance", type=float, default=0.2)
+        parser.add_argument(
+            "--webhook-secret",
+            default=settings.STRIPE_WEBHOOK_SECRET,
+            help="Confirm payments with signed webhooks; empty to skip",
+        )
+
+    def parse_mix(self, mix):
+        try:
+            weights = {
+                name: int(weight)
+                for name, weight in (item.split("=") for item in mix.split(","))
+            }
+        except ValueError:
+            raise CommandError(f"Invalid mix: {mix}")
+        unknown = set(weights) - set(MIX)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        return weights
+
+    def load_test_users(self, count):
+        """One account per virtual user, so loans never block each other"""
+        users = []
+        for i in range(count):
+            email = f"loadtest{i}@example.com"
+            user, created = get_user_model().objects.get_or_create(email=email)
+            if created:
+                user.set_password(PASSWORD)
+                user.save()
+            users.append((email, PASSWORD))
+        return users
+
+    def handle(self, *args, **options):
+        load_test = LoadTest(
+            options["url"],
+            self.load_test_users(options["concurrency"]),
+            concurrency=options["concurrency"],
+            duration=options["duration"],
+            mix=self.parse_mix(options["mix"]),
+            webhook_secret=options["webhook_secret"],
+        )
+        report = load_test.run()
+
+        self.stdout.write(
+            f"{report['requests']} requests in {report['elapsed']}s, "
+            f"{report['rps']} req/s, {report['errors']} errors"
+        )
+        for name, stats in report["scenarios"].items():
+            self.stdout.write(
+                f"{name:>16} {stats['count']:>7} {stats['rps']:>8} req/s "
+                f"p50 {stats['p50_ms']}ms p95 {stats['p95_ms']}ms "
+                f"p99 {stats['p99_ms']}ms errors {stats['errors']}"
+            )
+
+        for path in (options["report"], options["save_baseline"]):
+            if path:
+                with open(path, "w") as file:
+                    json.dump(report, file, indent=2)
+
+        if options["baseline"]:
+            with open(options["baseline"]) as file:
+                regressions = compare(report, json.load(file), options["tolerance"])
+            if regressions:
+                raise CommandError("Regressions:\n" + "\n".join(regressions))
+            self.stdout.write(self.style.SUCCESS("No regressions"))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from library import metrics
+from library.counters import COUNTERS, reconcile
+
+
+class Command(BaseCommand):
+    """Recount active, overdue and total loans of every book and repair drift"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Only report drifted books"
+        )
+        parser.add_argument("--batch-size", type=int, default=10000)
+        parser.add_argument("--field", action="append", choices=COUNTERS, dest="fields")
+
+    def handle(self, *args, **options):
+        fields = options["fields"] or COUNTERS
+        drifted = reconcile(
+            fields, batch_size=options["batch_size"], dry_run=options["dry_run"]
+        )
+        metrics.emit("books.reconciled", drifted=drifted, dry_run=options["dry_run"])
+        action = "drifted" if options["dry_run"] else "repaired"
+        self.stdout.write(f"{drifted} books {action}")
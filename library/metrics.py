@@ -0,0 +1,9 @@
+import logging
+
+logger = logging.getLogger("library.metrics")
+
+
+def emit(name, **values):
+    """Log a metric as a single key=value line for the log shipper to pick up"""
+    fields = " ".join(f"{key}={value}" for key, value in values.items())
+    logger.info("%s %s", name, fields)
@@ -0,0 +1,97 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:13
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.deletion
+
+# The foreign key index created by 0001_initial
+DROP_USER_INDEX = """
+DROP INDEX CONCURRENTLY IF EXISTS "library_borrowing_user_id_b9b4ca75";
+"""
+CREATE_USER_INDEX = """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "library_borrowing_user_id_b9b4ca75"
+ON "library_borrowing" ("user_id");
+"""
+
+CREATE_SESSION_INDEX = """
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "library_payment_session_id_fe3f43ee_uniq"
+ON "library_payment" ("session_id");
+"""
+ADD_SESSION_CONSTRAINT = """
+ALTER TABLE "library_payment" ADD CONSTRAINT "library_payment_session_id_fe3f43ee_uniq"
+UNIQUE USING INDEX "library_payment_session_id_fe3f43ee_uniq";
+"""
+DROP_SESSION_CONSTRAINT = """
+ALTER TABLE "library_payment"
+DROP CONSTRAINT IF EXISTS "library_payment_session_id_fe3f43ee_uniq";
+"""
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("library", "0001_initial"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="borrowing",
+            index=models.Index(
+                condition=models.Q(("actual_return_date__isnull", True)),
+                fields=["expected_return_date"],
+                name="borrowing_overdue_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="borrowing",
+            index=models.Index(
+                fields=["user", "is_active"], name="borrowing_user_active_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="borrowing",
+            index=models.Index(
+                fields=["user", "-borrow_date", "-id"],
+                name="borrowing_user_history_idx",
+            ),
+        ),
+        # Both composites start with user_id. AlterField would also drop and
+        # re-add the foreign key, checking every borrowing under the lock
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name="borrowing",
+                    name="user",
+                    field=models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(DROP_USER_INDEX, CREATE_USER_INDEX),
+            ],
+        ),
+        # The unique index is built without blocking writes, then attached as
+        # the constraint AlterField would have added; session ids are never
+        # searched with LIKE, so there is no _like index
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name="payment",
+                    name="session_id",
+                    field=models.CharField(
+                        blank=True, max_length=256, null=True, unique=True
+                    ),
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(CREATE_SESSION_INDEX, migrations.RunSQL.noop),
+                migrations.RunSQL(ADD_SESSION_CONSTRAINT, DROP_SESSION_CONSTRAINT),
+            ],
+        ),
+    ]
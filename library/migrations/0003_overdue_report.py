@@ -0,0 +1,39 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("library", "0002_borrowing_payment_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OverdueReport",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("first_id", models.BigIntegerField()),
+                ("last_id", models.BigIntegerField()),
+                ("notified_up_to", models.BigIntegerField(default=0)),
+                ("overdue", models.PositiveIntegerField(default=0)),
+                ("finished", models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="overduereport",
+            constraint=models.UniqueConstraint(
+                fields=("day", "first_id", "last_id"),
+                name="unique_overdue_report_range",
+            ),
+        ),
+    ]
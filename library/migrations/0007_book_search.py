@@ -0,0 +1,60 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:33
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+CREATE_TRIGGER = """
+CREATE TRIGGER book_search_vector_update
+BEFORE INSERT OR UPDATE OF title, author ON library_book
+FOR EACH ROW EXECUTE FUNCTION
+tsvector_update_trigger(search_vector, 'pg_catalog.english', title, author);
+UPDATE library_book
+SET search_vector = to_tsvector('pg_catalog.english', title || ' ' || author);
+"""
+
+DROP_TRIGGER = "DROP TRIGGER IF EXISTS book_search_vector_update ON library_book;"
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("library", "0006_borrowing_history_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+        AddIndexConcurrently(
+            model_name="book",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="book_search_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="book",
+            index=models.Index(
+                fields=["cover", "daily_fee"], name="book_cover_fee_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="book",
+            index=models.Index(fields=["daily_fee"], name="book_daily_fee_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="book",
+            index=models.Index(
+                condition=models.Q(("inventory__gt", 0)),
+                fields=["id"],
+                name="book_available_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:36
+
+from django.db import migrations, models
+
+BACKFILL = """
+UPDATE library_book
+SET active_loans = counts.active,
+    overdue_loans = counts.overdue,
+    total_loans = counts.total
+FROM (
+    SELECT book_id,
+           COUNT(*) FILTER (WHERE actual_return_date IS NULL) AS active,
+           COUNT(*) FILTER (
+               WHERE actual_return_date IS NULL
+               AND expected_return_date < CURRENT_DATE
+           ) AS overdue,
+           COUNT(*) AS total
+    FROM library_borrowing
+    GROUP BY book_id
+) AS counts
+WHERE library_book.id = counts.book_id;
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("library", "0007_book_search"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="active_loans",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="overdue_loans",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="total_loans",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(BACKFILL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:37
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("library", "0008_book_loan_counters"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="outbox",
+            name="topic",
+            field=models.CharField(
+                choices=[
+                    ("borrowing.created", "Borrowing Created"),
+                    ("borrowings.created", "Borrowings Created"),
+                    ("payment.requested", "Payment Requested"),
+                ],
+                max_length=64,
+            ),
+        ),
+        # Build the plain index before the unique one goes away
+        AddIndexConcurrently(
+            model_name="payment",
+            index=models.Index(fields=["session_id"], name="payment_session_idx"),
+        ),
+        migrations.AlterField(
+            model_name="payment",
+            name="session_id",
+            field=models.CharField(blank=True, max_length=256, null=True),
+        ),
+    ]
@@ -0,0 +1,120 @@
+# Generated by Django 4.1.7 on 2026-10-18 11:03
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# The fee formula of library.fees, for every open loan as of today;
+# FINE_MULTIPLIER is read when the migration runs
+OPEN_LOAN_FEES = """
+CREATE VIEW library_open_loan_fee AS
+SELECT borrowing.user_id,
+       borrowing.book_id,
+       borrowing.expected_return_date < CURRENT_DATE AS overdue,
+       GREATEST(
+           CASE
+               WHEN borrowing.expected_return_date < CURRENT_DATE
+               THEN (borrowing.expected_return_date - borrowing.borrow_date)
+                    + (CURRENT_DATE - borrowing.expected_return_date) * %(multiplier)s
+               ELSE CURRENT_DATE - borrowing.borrow_date
+           END * book.daily_fee,
+           0.5
+       ) AS accrued,
+       CASE
+           WHEN borrowing.expected_return_date < CURRENT_DATE
+           THEN (CURRENT_DATE - borrowing.expected_return_date)
+                * %(multiplier)s * book.daily_fee
+           ELSE 0
+       END AS fine
+FROM library_borrowing borrowing
+JOIN library_book book ON book.id = borrowing.book_id
+WHERE borrowing.actual_return_date IS NULL;
+""" % {
+    "multiplier": int(settings.FINE_MULTIPLIER)
+}
+
+# A unique index lets REFRESH MATERIALIZED VIEW CONCURRENTLY run without
+# blocking readers
+DEBT_VIEW = """
+CREATE MATERIALIZED VIEW library_%(name)s_debt AS
+SELECT %(name)s_id,
+       COUNT(*) AS open_loans,
+       COUNT(*) FILTER (WHERE overdue) AS overdue_loans,
+       SUM(accrued) AS accrued,
+       SUM(fine) AS fines,
+       now() AS refreshed_at
+FROM library_open_loan_fee
+GROUP BY %(name)s_id;
+CREATE UNIQUE INDEX library_%(name)s_debt_pk ON library_%(name)s_debt (%(name)s_id);
+CREATE INDEX library_%(name)s_debt_accrued ON library_%(name)s_debt (accrued DESC);
+"""
+
+DROP_VIEWS = """
+DROP MATERIALIZED VIEW IF EXISTS library_book_debt;
+DROP MATERIALIZED VIEW IF EXISTS library_user_debt;
+DROP VIEW IF EXISTS library_open_loan_fee;
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("library", "0009_bulk_borrowings"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            OPEN_LOAN_FEES
+            + DEBT_VIEW % {"name": "user"}
+            + DEBT_VIEW % {"name": "book"},
+            DROP_VIEWS,
+        ),
+        migrations.CreateModel(
+            name="BookDebt",
+            fields=[
+                (
+                    "book",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        primary_key=True,
+                        related_name="debt",
+                        serialize=False,
+                        to="library.book",
+                    ),
+                ),
+                ("open_loans", models.PositiveIntegerField()),
+                ("overdue_loans", models.PositiveIntegerField()),
+                ("accrued", models.DecimalField(decimal_places=3, max_digits=12)),
+                ("fines", models.DecimalField(decimal_places=3, max_digits=12)),
+                ("refreshed_at", models.DateTimeField()),
+            ],
+            options={
+                "db_table": "library_book_debt",
+                "managed": False,
+            },
+        ),
+        migrations.CreateModel(
+            name="UserDebt",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        primary_key=True,
+                        related_name="debt",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("open_loans", models.PositiveIntegerField()),
+                ("overdue_loans", models.PositiveIntegerField()),
+                ("accrued", models.DecimalField(decimal_places=3, max_digits=12)),
+                ("fines", models.DecimalField(decimal_places=3, max_digits=12)),
+                ("refreshed_at", models.DateTimeField()),
+            ],
+            options={
+                "db_table": "library_user_debt",
+                "managed": False,
+            },
+        ),
+    ]
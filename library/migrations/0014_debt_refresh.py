@@ -0,0 +1,65 @@
+# Generated by Django 4.1.7 on 2026-10-18 11:48
+
+from importlib import import_module
+
+from django.db import migrations, models
+from django.utils import timezone
+from library.debts import open_loan_fees
+
+debts_0010 = import_module("library.migrations.0010_debts")
+
+# As in 0010_debts, without the refresh time in every row
+DEBT_VIEW = """
+CREATE MATERIALIZED VIEW library_%(name)s_debt AS
+SELECT %(name)s_id,
+       COUNT(*) AS open_loans,
+       COUNT(*) FILTER (WHERE overdue) AS overdue_loans,
+       SUM(accrued) AS accrued,
+       SUM(fine) AS fines
+FROM library_open_loan_fee
+GROUP BY %(name)s_id;
+CREATE UNIQUE INDEX library_%(name)s_debt_pk ON library_%(name)s_debt (%(name)s_id);
+CREATE INDEX library_%(name)s_debt_accrued ON library_%(name)s_debt (accrued DESC);
+"""
+
+
+def create_views(apps, schema_editor):
+    """Rebuild the fee view from the fee engine; FINE_MULTIPLIER is still
+    read when the migration runs"""
+    sql, params = open_loan_fees(apps.get_model("library", "Borrowing").objects.all())
+    schema_editor.execute(debts_0010.DROP_VIEWS)
+    schema_editor.execute("CREATE VIEW library_open_loan_fee AS " + sql, params)
+    for name in ("user", "book"):
+        schema_editor.execute(DEBT_VIEW % {"name": name})
+        apps.get_model("library", "DebtRefresh").objects.update_or_create(
+            view=f"library_{name}_debt", defaults={"refreshed_at": timezone.now()}
+        )
+
+
+def restore_views(apps, schema_editor):
+    schema_editor.execute(
+        debts_0010.DROP_VIEWS
+        + debts_0010.OPEN_LOAN_FEES
+        + debts_0010.DEBT_VIEW % {"name": "user"}
+        + debts_0010.DEBT_VIEW % {"name": "book"}
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("library", "0013_notification_claimed_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DebtRefresh",
+            fields=[
+                (
+                    "view",
+                    models.CharField(max_length=63, primary_key=True, serialize=False),
+                ),
+                ("refreshed_at", models.DateTimeField()),
+            ],
+        ),
+        migrations.RunPython(create_views, restore_views),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.1.7 on 2026-10-18 11:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("library", "0014_debt_refresh"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RateLimit",
+            fields=[
+                (
+                    "key",
+                    models.CharField(max_length=255, primary_key=True, serialize=False),
+                ),
+                ("tokens", models.FloatField()),
+                ("refilled_at", models.FloatField()),
+            ],
+        ),
+    ]
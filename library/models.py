@@ -1,8 +1,16 @@
 import datetime
 
 from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db.models import F, Q, Subquery
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from library.cache import invalidate_books
+from library.fees import fee
 
 
 class Book(models.Model):
@@ -15,6 +23,24 @@ class Book(models.Model):
     cover = models.CharField(max_length=10, choices=CoverChoices.choices)
     inventory = models.PositiveIntegerField()
     daily_fee = models.DecimalField(max_digits=6, decimal_places=3)
+    # Title and author, filled in by a database trigger on every insert or
+    # title/author change, so bulk loads are indexed too
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Kept up to date by reserve() and release(); overdue_loans also by the
+    # nightly refresh. reconcile_book_counters repairs any drift
+    active_loans = models.PositiveIntegerField(default=0, editable=False)
+    overdue_loans = models.PositiveIntegerField(default=0, editable=False)
+    total_loans = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=["search_vector"], name="book_search_idx"),
+            models.Index(fields=["cover", "daily_fee"], name="book_cover_fee_idx"),
+            models.Index(fields=["daily_fee"], name="book_daily_fee_idx"),
+            models.Index(
+                fields=["id"], condition=Q(inventory__gt=0), name="book_available_idx"
+            ),
+        ]
 
     @staticmethod
     def validate(inventory: int, error_to_raise):
@@ -24,6 +50,35 @@ class Book(models.Model):
     def clean(self):
         Book.validate(self.inventory, ValidationError)
 
+    @staticmethod
+    def reserve(book_id, copies=1) -> bool:
+        """Take copies off the shelf in a single conditional UPDATE.
+
+        Returns False when the book does not exist or has fewer copies left.
+        """
+        reserved = bool(
+            Book.objects.filter(pk=book_id, inventory__gte=copies).update(
+                inventory=F("inventory") - copies,
+                active_loans=F("active_loans") + copies,
+                total_loans=F("total_loans") + copies,
+            )
+        )
+        if reserved:
+            invalidate_books(book_id)
+        return reserved
+
+    @staticmethod
+    def release(book_id, copies=1, overdue=0) -> None:
+        """Put returned copies back on the shelf; ``overdue`` of them were
+        returned late."""
+        counters = {"active_loans": Greatest(F("active_loans") - copies, 0)}
+        if overdue:
+            counters["overdue_loans"] = Greatest(F("overdue_loans") - overdue, 0)
+        Book.objects.filter(pk=book_id).update(
+            inventory=F("inventory") + copies, **counters
+        )
+        invalidate_books(book_id)
+
     def __str__(self):
         return str(self.title)
 
@@ -33,9 +88,28 @@ class Borrowing(models.Model):
     expected_return_date = models.DateField(auto_now=False)
     actual_return_date = models.DateField(auto_now=False, null=True, blank=True)
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="borrowings")
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False
+    )
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["expected_return_date"],
+                condition=Q(actual_return_date__isnull=True),
+                name="borrowing_overdue_idx",
+            ),
+            models.Index(
+                fields=["user", "is_active"], name="borrowing_user_active_idx"
+            ),
+            models.Index(
+                fields=["user", "-borrow_date", "-id"],
+                name="borrowing_user_history_idx",
+            ),
+            models.Index(fields=["-borrow_date", "-id"], name="borrowing_history_idx"),
+        ]
+
     def save(
         self,
         force_insert=False,
@@ -43,31 +117,34 @@ class Borrowing(models.Model):
         using=None,
         update_fields=None,
     ):
-        self.full_clean()
+        # Related objects assigned as instances were fetched already; the
+        # foreign key constraints still guard them, without a query each
+        loaded = [
+            field.name
+            for field in self._meta.concrete_fields
+            if field.is_relation and field.is_cached(self)
+        ]
+        self.full_clean(exclude=loaded)
         return super(Borrowing, self).save(
             force_insert, force_update, using, update_fields
         )
 
     def pay_money(self):
-
+        """Return the borrowing today and calculate what it costs"""
         self.actual_return_date = datetime.date.today()
-        number_of_days = (self.actual_return_date - self.borrow_date).days
-        if self.expected_return_date < self.actual_return_date:
-            money = (
-                (self.expected_return_date - self.borrow_date).days
-                + (self.actual_return_date - self.expected_return_date).days
-                * settings.FINE_MULTIPLIER
-            ) * self.book.daily_fee
-        else:
-            money = number_of_days * self.book.daily_fee
-
-        return money if money >= 0.5 else 0.5
+        return fee(
+            self.borrow_date,
+            self.expected_return_date,
+            self.actual_return_date,
+            self.book.daily_fee,
+        )
 
 
 class Payment(models.Model):
     class StatusChoices(models.TextChoices):
         PENDING = "PENDING"
         PAID = "PAID"
+        EXPIRED = "EXPIRED"
 
     class TypeChoices(models.TextChoices):
         PAYMENT = "PAYMENT"
@@ -80,5 +157,170 @@ class Payment(models.Model):
         on_delete=models.CASCADE,
     )
     session_url = models.URLField(max_length=1024, null=True, blank=True)
+    # Shared by all payments of one bulk return
     session_id = models.CharField(max_length=256, null=True, blank=True)
     money_to_pay = models.DecimalField(max_digits=6, decimal_places=3, default=5.00)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["id"],
+                condition=Q(status="PENDING"),
+                name="payment_pending_idx",
+            ),
+            models.Index(fields=["session_id"], name="payment_session_idx"),
+        ]
+
+
+class OverdueReport(models.Model):
+    """Progress of one day's overdue notifications for a range of borrowing ids"""
+
+    day = models.DateField()
+    first_id = models.BigIntegerField()
+    last_id = models.BigIntegerField()
+    notified_up_to = models.BigIntegerField(default=0)
+    overdue = models.PositiveIntegerField(default=0)
+    finished = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["day", "first_id", "last_id"],
+                name="unique_overdue_report_range",
+            )
+        ]
+
+
+class Notification(models.Model):
+    chat_id = models.CharField(max_length=64)
+    text = models.TextField()
+    parse_mode = models.CharField(max_length=10, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Set while a dispatcher is sending it
+    claimed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["id"],
+                condition=Q(sent_at__isnull=True),
+                name="notification_pending_idx",
+            ),
+        ]
+
+
+class RateLimit(models.Model):
+    """A token bucket of library.notifications.RateLimiter"""
+
+    key = models.CharField(max_length=255, primary_key=True)
+    tokens = models.FloatField()
+    # Unix time of the last refill
+    refilled_at = models.FloatField()
+
+
+class Outbox(models.Model):
+    """Domain events written in the same transaction as the change they
+    describe and relayed to their side effects by library.outbox"""
+
+    class TopicChoices(models.TextChoices):
+        BORROWING_CREATED = "borrowing.created"
+        BORROWINGS_CREATED = "borrowings.created"
+        PAYMENT_REQUESTED = "payment.requested"
+
+    topic = models.CharField(max_length=64, choices=TopicChoices.choices)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["id"],
+                condition=Q(processed_at__isnull=True),
+                name="outbox_pending_idx",
+            ),
+        ]
+
+
+class WebhookEvent(models.Model):
+    """Stripe events as received, once per event id, until a worker applies
+    them (library.stripe.WebhookProcessor)"""
+
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=64)
+    # The event's data.object, e.g. the checkout session
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["id"],
+                condition=Q(processed_at__isnull=True),
+                name="webhook_event_pending_idx",
+            ),
+        ]
+
+
+class DebtRefresh(models.Model):
+    """When each debt view was last refreshed. Kept out of the view rows, so
+    a concurrent refresh only rewrites the rows whose numbers changed"""
+
+    view = models.CharField(max_length=63, primary_key=True)
+    refreshed_at = models.DateTimeField()
+
+
+class DebtManager(models.Manager):
+    def get_queryset(self):
+        refreshed_at = DebtRefresh.objects.filter(
+            view=self.model._meta.db_table
+        ).values("refreshed_at")
+        return super().get_queryset().annotate(refreshed_at=Subquery(refreshed_at))
+
+
+class UserDebt(models.Model):
+    """What each user's open loans have accrued, from the library_user_debt
+    materialized view; refreshed by library.tasks.refresh_debts"""
+
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        related_name="debt",
+    )
+    open_loans = models.PositiveIntegerField()
+    overdue_loans = models.PositiveIntegerField()
+    accrued = models.DecimalField(max_digits=12, decimal_places=3)
+    fines = models.DecimalField(max_digits=12, decimal_places=3)
+
+    objects = DebtManager()
+
+    class Meta:
+        managed = False
+        db_table = "library_user_debt"
+
+
+class BookDebt(models.Model):
+    """The same per book, from the library_book_debt materialized view"""
+
+    book = models.OneToOneField(
+        Book,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        related_name="debt",
+    )
+    open_loans = models.PositiveIntegerField()
+    overdue_loans = models.PositiveIntegerField()
+    accrued = models.DecimalField(max_digits=12, decimal_places=3)
+    fines = models.DecimalField(max_digits=12, decimal_places=3)
+
+    objects = DebtManager()
+
+    class Meta:
+        managed = False
+        db_table = "library_book_debt"
@@ -1,14 +1,32 @@
-import os
+import datetime
+import functools
+import time
 
-import telebot
-from library_service.settings import BOT_NUMBER, API_KEY
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Greatest, Least
+from django.db.models.lookups import GreaterThanOrEqual
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from library.models import Notification, RateLimit
 
-bot = telebot.TeleBot(token=API_KEY)
+TELEGRAM_API_URL = "https://api.telegram.org"
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+def notify(text, parse_mode=""):
+    """Queue a message; dispatch_notifications delivers it in the background"""
+    return Notification.objects.create(
+        chat_id=settings.BOT_NUMBER, text=text, parse_mode=parse_mode
+    )
 
 
 def new_borrowing(borrowing_id, user_id, book_id, title, expected_return_date):
-    bot.send_message(
-        BOT_NUMBER,
+    notify(
         f"New borrowing:{borrowing_id}, user_id - {user_id},\n"
         f" book_id {book_id} , {title},\n"
         f" expected_return_date - {expected_return_date}",
@@ -16,14 +34,280 @@ def new_borrowing(borrowing_id, user_id, book_id, title, expected_return_date):
     )
 
 
+def new_borrowings(borrowings):
+    lines = [
+        f"{borrowing['borrowing_id']}, user_id - {borrowing['user_id']}, "
+        f"book_id {borrowing['book_id']} , {borrowing['title']}, "
+        f"expected_return_date - {borrowing['expected_return_date']}"
+        for borrowing in borrowings
+    ]
+    notify(
+        f"New borrowings ({len(borrowings)}):\n" + "\n".join(lines),
+        parse_mode="html",
+    )
+
+
 def overdue_borrowing(id, book_id, title, expected_return_date):
-    bot.send_message(
-        BOT_NUMBER,
+    notify(
         f"Overdue borrowing: id -{id}, \n"
         f"book_id {book_id} ,{title},\n"
         f"expected_return_date - {expected_return_date}",
     )
 
 
+def overdue_digest(borrowings):
+    lines = [
+        f"id -{borrowing['id']}, book_id {borrowing['book_id']} ,"
+        f"{borrowing['book__title']}, "
+        f"expected_return_date - {borrowing['expected_return_date']}"
+        for borrowing in borrowings
+    ]
+    notify(f"Overdue borrowings ({len(borrowings)}):\n" + "\n".join(lines))
+
+
 def not_overdue():
-    bot.send_message(BOT_NUMBER, "No borrowings overdue today!")
+    notify("No borrowings overdue today!")
+
+
+class Transport:
+    """Deliver one message to one chat."""
+
+    def __init__(self, **options):
+        self.options = options
+
+    def send(self, chat_id, text, parse_mode=""):
+        raise NotImplementedError
+
+
+class TelegramTransport(Transport):
+    """Bot API sendMessage over one keep-alive requests session."""
+
+    def __init__(self, token=None, base_url=TELEGRAM_API_URL, timeout=10, **options):
+        super().__init__(**options)
+        self.url = f"{base_url}/bot{token}/sendMessage"
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def send(self, chat_id, text, parse_mode=""):
+        data = {"chat_id": chat_id, "text": text}
+        if parse_mode:
+            data["parse_mode"] = parse_mode
+        response = self.session.post(self.url, data=data, timeout=self.timeout)
+        response.raise_for_status()
+
+
+class FakeTransport(Transport):
+    """Keep messages in memory, for tests and offline benchmarks.
+
+    ``latency`` (seconds) simulates the round trip to Telegram.
+    """
+
+    def __init__(self, latency=0, **options):
+        super().__init__(**options)
+        self.latency = latency
+        self.sent = []
+
+    def send(self, chat_id, text, parse_mode=""):
+        if self.latency:
+            time.sleep(self.latency)
+        self.sent.append((chat_id, text, parse_mode))
+
+
+class RateLimiter:
+    """A token bucket of ``capacity`` tokens refilled at ``rate`` per second,
+    kept in a RateLimit row so the limit holds across every worker process.
+
+    Refilling the bucket and taking a token is a single conditional UPDATE;
+    a call that finds the bucket empty sleeps until the next token is due.
+    """
+
+    def __init__(self, key, rate, capacity, clock=time.time, sleep=time.sleep):
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+
+    def available(self, now):
+        """The tokens in the bucket at ``now``, as a SQL expression"""
+        elapsed = Greatest(Value(now) - F("refilled_at"), Value(0.0))
+        return Least(Value(float(self.capacity)), F("tokens") + elapsed * self.rate)
+
+    def acquire(self):
+        while True:
+            now = self.clock()
+            available = self.available(now)
+            if (
+                RateLimit.objects.filter(key=self.key)
+                .filter(GreaterThanOrEqual(available, 1))
+                .update(tokens=available - 1, refilled_at=now)
+            ):
+                return
+            bucket = RateLimit.objects.filter(key=self.key).first()
+            if bucket is None:
+                RateLimit.objects.get_or_create(
+                    key=self.key,
+                    defaults={"tokens": self.capacity, "refilled_at": now},
+                )
+                continue
+            tokens = bucket.tokens + max(now - bucket.refilled_at, 0) * self.rate
+            # Another worker may have refilled it since the UPDATE
+            self.sleep(max((1 - min(tokens, self.capacity)) / self.rate, 0))
+
+
+def split_text(text, limit=TELEGRAM_MESSAGE_LIMIT) -> list:
+    """Cut ``text`` into parts of at most ``limit`` characters, at line
+    breaks where there are any"""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit + 1)
+        if cut > 0:
+            parts.append(text[:cut])
+            text = text[cut + 1 :]
+        else:
+            parts.append(text[:limit])
+            text = text[limit:]
+    parts.append(text)
+    return parts
+
+
+def coalesce(notifications, limit=TELEGRAM_MESSAGE_LIMIT):
+    """Join queued notifications for the same chat into as few messages as
+    fit into Telegram's message size limit, keeping their order. A longer
+    notification is split into several messages; ``sent`` lists the
+    notifications a message completes."""
+    messages = []
+    open_messages = {}
+
+    for notification in notifications:
+        parts = split_text(notification.text, limit)
+        for number, text in enumerate(parts, 1):
+            sent = [notification.id] if number == len(parts) else []
+            key = (notification.chat_id, notification.parse_mode)
+            message = open_messages.get(key)
+            if message and len(message["text"]) + 2 + len(text) <= limit:
+                message["text"] += "\n\n" + text
+                message["ids"].append(notification.id)
+                message["sent"] += sent
+                continue
+
+            message = {
+                "chat_id": notification.chat_id,
+                "parse_mode": notification.parse_mode,
+                "text": text,
+                "ids": [notification.id],
+                "sent": sent,
+            }
+            open_messages[key] = message
+            messages.append(message)
+
+    return messages
+
+
+class NotificationDispatcher:
+    """Drain the notification queue in batches.
+
+    Several dispatchers can run at once: a batch is claimed in a short
+    transaction (SELECT ... FOR UPDATE SKIP LOCKED, then a lease in
+    claimed_at) and sent with no transaction open; each message is marked
+    sent as soon as Telegram accepted it. A claim left by a dispatcher that
+    died is taken over once ``lease`` seconds have passed.
+
+    Sending respects a global and a per-chat rate limit shared by all
+    dispatchers. A message that keeps failing is given up after
+    ``max_attempts`` so it cannot block the queue.
+    """
+
+    def __init__(
+        self,
+        transport,
+        batch_size=100,
+        rate=25,
+        burst=5,
+        chat_rate=1,
+        chat_burst=1,
+        max_attempts=5,
+        lease=300,
+    ):
+        self.transport = transport
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.lease = datetime.timedelta(seconds=lease)
+        self.limiter = RateLimiter("notifications:rate", rate, burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+
+    def throttle(self, chat_id):
+        self.limiter.acquire()
+        RateLimiter(
+            f"notifications:rate:{chat_id}", self.chat_rate, self.chat_burst
+        ).acquire()
+
+    def claim(self) -> list:
+        now = timezone.now()
+        with transaction.atomic():
+            batch = list(
+                Notification.objects.filter(
+                    Q(claimed_at=None) | Q(claimed_at__lt=now - self.lease),
+                    sent_at=None,
+                    attempts__lt=self.max_attempts,
+                )
+                .select_for_update(skip_locked=True)
+                .order_by("id")[: self.batch_size]
+            )
+            Notification.objects.filter(
+                id__in=[notification.id for notification in batch]
+            ).update(claimed_at=now)
+        return batch
+
+    def dispatch_batch(self) -> int:
+        batch = self.claim()
+        unsent = {notification.id for notification in batch}
+        try:
+            for message in coalesce(batch):
+                self.throttle(message["chat_id"])
+                try:
+                    self.transport.send(
+                        message["chat_id"], message["text"], message["parse_mode"]
+                    )
+                except Exception:
+                    Notification.objects.filter(id__in=message["ids"]).update(
+                        attempts=F("attempts") + 1
+                    )
+                    raise
+                if message["sent"]:
+                    Notification.objects.filter(id__in=message["sent"]).update(
+                        sent_at=timezone.now(), claimed_at=None
+                    )
+                    unsent.difference_update(message["sent"])
+        finally:
+            # Hand back what was not sent, for the next run to retry
+            Notification.objects.filter(id__in=unsent).update(claimed_at=None)
+        return len(batch)
+
+    def dispatch(self) -> int:
+        dispatched = 0
+        while True:
+            count = self.dispatch_batch()
+            dispatched += count
+            if count < self.batch_size:
+                return dispatched
+
+
+@functools.lru_cache(maxsize=None)
+def get_transport() -> Transport:
+    config = settings.NOTIFICATION_TRANSPORT
+    transport_class = import_string(config["BACKEND"])
+    return transport_class(**config.get("OPTIONS", {}))
+
+
+@functools.lru_cache(maxsize=None)
+def get_dispatcher() -> NotificationDispatcher:
+    return NotificationDispatcher(get_transport(), **settings.NOTIFICATION_DISPATCHER)
+
+
+@receiver(setting_changed)
+def reset_transport(setting, **kwargs):
+    if setting in ("NOTIFICATION_TRANSPORT", "NOTIFICATION_DISPATCHER"):
+        get_transport.cache_clear()
+        get_dispatcher.cache_clear()
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from library.models import Outbox, Payment
+from library.notifications import new_borrowing, new_borrowings
+from library.payments import get_gateway
+
+logger = logging.getLogger(__name__)
+
+
+def publish(topic, **payload):
+    """Record an event; call inside the transaction that makes the change"""
+    return Outbox.objects.create(topic=topic, payload=payload)
+
+
+def notify_new_borrowing(payload):
+    new_borrowing(
+        payload["borrowing_id"],
+        payload["user_id"],
+        payload["book_id"],
+        payload["title"],
+        payload["expected_return_date"],
+    )
+
+
+def notify_new_borrowings(payload):
+    new_borrowings(payload["borrowings"])
+
+
+@sync_to_async
+@transaction.atomic
+def save_payment_session(payment_ids, session):
+    Payment.objects.filter(pk__in=payment_ids).update(
+        session_id=session.id, session_url=session.url
+    )
+
+
+async def create_payment_session(payload):
+    """One session for ``payment_id``, or shared by all ``payment_ids``.
+
+    The key is derived from the payments, so an event relayed again after
+    Stripe answered gets the same session back instead of a second one.
+    """
+    payment_ids = payload.get("payment_ids") or [payload["payment_id"]]
+    session = await get_gateway().acreate_session(
+        payload["amount"],
+        payload["name"],
+        payload["success_url"],
+        payload["cancel_url"],
+        idempotency_key=f"checkout-payment-{min(payment_ids)}",
+    )
+    await save_payment_session(payment_ids, session)
+
+
+HANDLERS = {
+    Outbox.TopicChoices.BORROWING_CREATED: notify_new_borrowing,
+    Outbox.TopicChoices.BORROWINGS_CREATED: notify_new_borrowings,
+    Outbox.TopicChoices.PAYMENT_REQUESTED: create_payment_session,
+}
+
+
+class OutboxRelay:
+    """Hand pending events to their handlers in id order.
+
+    Events are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so relays
+    running side by side never process the same event. A failing event is
+    retried on the next run until it has used up ``max_attempts``.
+
+    Coroutine handlers run after the others, up to ``concurrency`` at a
+    time, so the external calls of a batch are in flight together. Their
+    database writes still run in this thread and transaction (asgiref's
+    thread-sensitive sync_to_async).
+    """
+
+    def __init__(
+        self, handlers=None, batch_size=100, max_attempts=10, concurrency=None
+    ):
+        self.handlers = HANDLERS if handlers is None else handlers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.concurrency = concurrency or settings.OUTBOX_CONCURRENCY
+
+    async def handle_concurrently(self, events) -> list:
+        """The exception each event raised, or None"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def handle(event):
+            async with semaphore:
+                await self.handlers[event.topic](event.payload)
+
+        # Every batch runs on a new event loop, so connections do not outlive it
+        async with get_gateway().connection():
+            return await asyncio.gather(
+                *(handle(event) for event in events), return_exceptions=True
+            )
+
+    def relay_batch(self) -> int:
+        with transaction.atomic():
+            events = list(
+                Outbox.objects.filter(processed_at=None, attempts__lt=self.max_attempts)
+                .select_for_update(skip_locked=True)
+                .order_by("id")[: self.batch_size]
+            )
+            processed, failed, concurrent = [], [], []
+            for event in events:
+                if asyncio.iscoroutinefunction(self.handlers[event.topic]):
+                    concurrent.append(event)
+                    continue
+                try:
+                    with transaction.atomic():
+                        self.handlers[event.topic](event.payload)
+                except Exception:
+                    logger.exception(
+                        "Outbox event %s (%s) failed", event.id, event.topic
+                    )
+                    failed.append(event.id)
+                else:
+                    processed.append(event.id)
+
+            if concurrent:
+                errors = async_to_sync(self.handle_concurrently)(concurrent)
+                for event, error in zip(concurrent, errors):
+                    if error is not None:
+                        logger.error(
+                            "Outbox event %s (%s) failed",
+                            event.id,
+                            event.topic,
+                            exc_info=error,
+                        )
+                        failed.append(event.id)
+                    else:
+                        processed.append(event.id)
+
+            Outbox.objects.filter(id__in=processed).update(processed_at=timezone.now())
+            Outbox.objects.filter(id__in=failed).update(attempts=F("attempts") + 1)
+
+        return len(processed)
+
+    def relay(self) -> int:
+        relayed = 0
+        while True:
+            count = self.relay_batch()
+            relayed += count
+            if count < self.batch_size:
+                return relayed
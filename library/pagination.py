@@ -1,7 +1,269 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, models
+from django.db.models import F, Func, Value
+from django.db.models.lookups import GreaterThan, LessThan
+from django.utils.functional import cached_property
+from library.cache import CacheNamespace
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+counts = CacheNamespace("counts")
 
 
 class LibraryListPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = "page_size"
     max_page_size = 100
+
+
+class EstimatedCountPaginator(Paginator):
+    """Count rows without scanning the whole table on every page.
+
+    An unfiltered listing of a table with more than
+    ``PAGINATION_ESTIMATE_THRESHOLD`` rows is counted from the planner's
+    ``pg_class.reltuples``, any other listing with an exact COUNT; either
+    is kept for ``PAGINATION_COUNT_CACHE_TIMEOUT`` seconds per filter set.
+    """
+
+    count_is_estimate = False
+
+    def estimate(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != "postgresql" or queryset.query.where:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        if row and row[0] > settings.PAGINATION_ESTIMATE_THRESHOLD:
+            return row[0]
+        return None
+
+    @cached_property
+    def count(self):
+        if not hasattr(self.object_list, "query"):
+            return super().count
+        sql, params = self.object_list.query.sql_with_params()
+        key = hashlib.md5(repr((sql, params)).encode()).hexdigest()
+        cached = counts.get(key)
+        if cached is None:
+            estimate = self.estimate()
+            if estimate is not None:
+                cached = (estimate, True)
+            else:
+                cached = (self.object_list.count(), False)
+            counts.set(key, cached, settings.PAGINATION_COUNT_CACHE_TIMEOUT)
+        count, self.count_is_estimate = cached
+        return count
+
+
+class EstimatedCountPagination(LibraryListPagination):
+    """Page numbers with an estimated or cached count, flagged in the
+    response as ``count_is_estimate``"""
+
+    django_paginator_class = EstimatedCountPaginator
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        response.data["count_is_estimate"] = self.page.paginator.count_is_estimate
+        return response
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema["properties"]["count_is_estimate"] = {"type": "boolean"}
+        return response_schema
+
+
+class Row(Func):
+    function = "ROW"
+    output_field = models.Field()
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination by a unique ``ordering`` without COUNT or OFFSET.
+
+    The cursor holds the ordering values of the last row on the page and the
+    next page starts right after them with a row comparison,
+    ``(borrow_date, id) < (%s, %s)``, which an index on the same columns
+    answers directly, so every page costs the same however deep it is.
+    All ordering fields have to sort in the same direction.
+    """
+
+    page_size = LibraryListPagination.page_size
+    page_size_query_param = LibraryListPagination.page_size_query_param
+    max_page_size = LibraryListPagination.max_page_size
+    cursor_query_param = "cursor"
+    ordering = ("-id",)
+    invalid_cursor_message = "Invalid cursor"
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    @property
+    def fields(self):
+        return [name.lstrip("-") for name in self.ordering]
+
+    def encode_cursor(self, row) -> str:
+        values = [getattr(row, field) for field in self.fields]
+        raw = json.dumps(values, cls=DjangoJSONEncoder)
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, cursor, model) -> list:
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(values) != len(self.fields):
+                raise ValueError
+            return [
+                model._meta.get_field(field).to_python(value)
+                for field, value in zip(self.fields, values)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            values = self.decode_cursor(cursor, queryset.model)
+            after = LessThan if self.ordering[0].startswith("-") else GreaterThan
+            if len(values) == 1:
+                queryset = queryset.filter(after(F(self.fields[0]), values[0]))
+            else:
+                queryset = queryset.filter(
+                    after(
+                        Row(*[F(field) for field in self.fields]),
+                        Row(*[Value(value) for value in values]),
+                    )
+                )
+
+        rows = list(queryset[: self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[: self.page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.page[-1])
+        )
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "The pagination cursor value.",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.page_size_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Number of results to return per page.",
+                "schema": {"type": "integer"},
+            },
+        ]
+
+
+class SelectablePagination(BasePagination):
+    """Page numbers or keyset cursors, chosen per request.
+
+    ``?pagination=cursor`` (or any ``?cursor=``) switches to keyset pages,
+    ``?pagination=page`` back to numbered ones; a viewset picks its own
+    default with ``default_mode``.
+    """
+
+    mode_query_param = "pagination"
+    default_mode = "page"
+    ordering = KeysetPagination.ordering
+    page_class = EstimatedCountPagination
+    cursor_class = KeysetPagination
+
+    def get_mode(self, request) -> str:
+        mode = request.query_params.get(self.mode_query_param)
+        if mode in ("page", "cursor"):
+            return mode
+        if KeysetPagination.cursor_query_param in request.query_params:
+            return "cursor"
+        return self.default_mode
+
+    def get_paginator(self, mode):
+        if mode == "cursor":
+            paginator = self.cursor_class()
+            paginator.ordering = self.ordering
+            return paginator
+        return self.page_class()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.paginator = self.get_paginator(self.get_mode(request))
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.get_paginator(self.default_mode).get_paginated_response_schema(
+            schema
+        )
+
+    def get_schema_operation_parameters(self, view):
+        parameters = [
+            {
+                "name": self.mode_query_param,
+                "required": False,
+                "in": "query",
+                "description": "page (default) or cursor.",
+                "schema": {"type": "string", "enum": ["page", "cursor"]},
+            }
+        ]
+        seen = set()
+        for mode in ("page", "cursor"):
+            for parameter in self.get_paginator(mode).get_schema_operation_parameters(
+                view
+            ):
+                if parameter["name"] not in seen:
+                    seen.add(parameter["name"])
+                    parameters.append(parameter)
+        return parameters
+
+
+class BorrowingPagination(SelectablePagination):
+    ordering = ("-borrow_date", "-id")
+
+
+class PaymentPagination(SelectablePagination):
+    ordering = ("-id",)
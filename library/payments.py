@@ -0,0 +1,359 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import time
+import uuid
+from dataclasses import dataclass
+from decimal import Decimal
+
+import httpx
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+STRIPE_API_URL = "https://api.stripe.com"
+
+
+@dataclass(frozen=True)
+class CheckoutSession:
+    id: str
+    url: str
+
+
+@dataclass(frozen=True)
+class SessionState:
+    """``status`` is open, complete or expired; ``payment_status`` is paid,
+    unpaid or no_payment_required"""
+
+    id: str
+    status: str
+    payment_status: str
+
+
+def checkout_params(amount, name, success_url, cancel_url) -> dict:
+    """Convert the amount from dollars to cents"""
+    amount_cents = int(Decimal(str(amount)) * 100)
+
+    return {
+        "payment_method_types": ["card"],
+        "line_items": [
+            {
+                "price_data": {
+                    "currency": "usd",
+                    "product_data": {
+                        "name": name,
+                    },
+                    "unit_amount": amount_cents,
+                },
+                "quantity": 1,
+            }
+        ],
+        "mode": "payment",
+        "success_url": success_url,
+        "cancel_url": cancel_url,
+    }
+
+
+class PaymentGateway:
+    """Create checkout sessions for the amount a user has to pay.
+
+    Calls with the same ``idempotency_key`` create one session, so a retried
+    request never charges twice; Stripe remembers keys for 24 hours.
+    """
+
+    def __init__(self, **options):
+        self.options = options
+
+    def create_session(
+        self, amount, name, success_url, cancel_url, idempotency_key=None
+    ) -> CheckoutSession:
+        raise NotImplementedError
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        """Share connections between the async calls made inside it; they
+        belong to the running event loop and are closed on exit"""
+        yield
+
+    async def acreate_session(
+        self, amount, name, success_url, cancel_url, idempotency_key=None
+    ) -> CheckoutSession:
+        return await sync_to_async(self.create_session, thread_sensitive=False)(
+            amount, name, success_url, cancel_url, idempotency_key
+        )
+
+    def retrieve_session(self, session_id) -> SessionState:
+        raise NotImplementedError
+
+    def expire_session(self, session_id) -> SessionState:
+        """Close an open session so it can no longer be paid"""
+        raise NotImplementedError
+
+
+class StripeGateway(PaymentGateway):
+    """Blocking calls through the official stripe library."""
+
+    def __init__(self, api_key=None, **options):
+        super().__init__(**options)
+        self.api_key = api_key
+
+    def create_session(
+        self, amount, name, success_url, cancel_url, idempotency_key=None
+    ) -> CheckoutSession:
+        session = stripe.checkout.Session.create(
+            api_key=self.api_key,
+            idempotency_key=idempotency_key,
+            **checkout_params(amount, name, success_url, cancel_url),
+        )
+        return CheckoutSession(id=session.id, url=session.url)
+
+    @staticmethod
+    def _state(session) -> SessionState:
+        return SessionState(
+            id=session.id, status=session.status, payment_status=session.payment_status
+        )
+
+    def retrieve_session(self, session_id) -> SessionState:
+        return self._state(
+            stripe.checkout.Session.retrieve(session_id, api_key=self.api_key)
+        )
+
+    def expire_session(self, session_id) -> SessionState:
+        return self._state(
+            stripe.checkout.Session.expire(session_id, api_key=self.api_key)
+        )
+
+
+class FakeGateway(PaymentGateway):
+    """In-process stand-in for Stripe, for tests and offline benchmarks.
+
+    ``latency`` (seconds) simulates the round trip to Stripe.
+    """
+
+    def __init__(self, latency=0, **options):
+        super().__init__(**options)
+        self.latency = latency
+        self.sessions = {}
+        self.idempotency_keys = {}
+
+    def _new_session(
+        self, amount, name, success_url, cancel_url, idempotency_key
+    ) -> CheckoutSession:
+        if idempotency_key in self.idempotency_keys:
+            session = self.sessions[self.idempotency_keys[idempotency_key]]
+            return CheckoutSession(id=session["id"], url=session["url"])
+        session_id = f"cs_fake_{uuid.uuid4().hex}"
+        session = CheckoutSession(
+            id=session_id, url=f"https://checkout.stripe.test/pay/{session_id}"
+        )
+        self.sessions[session_id] = {
+            **checkout_params(amount, name, success_url, cancel_url),
+            "id": session.id,
+            "url": session.url,
+            "status": "open",
+            "payment_status": "unpaid",
+        }
+        if idempotency_key is not None:
+            self.idempotency_keys[idempotency_key] = session_id
+        return session
+
+    def create_session(
+        self, amount, name, success_url, cancel_url, idempotency_key=None
+    ) -> CheckoutSession:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._new_session(amount, name, success_url, cancel_url, idempotency_key)
+
+    async def acreate_session(
+        self, amount, name, success_url, cancel_url, idempotency_key=None
+    ) -> CheckoutSession:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._new_session(amount, name, success_url, cancel_url, idempotency_key)
+
+    def _state(self, session_id) -> SessionState:
+        session = self.sessions[session_id]
+        return SessionState(
+            id=session_id,
+            status=session["status"],
+            payment_status=session["payment_status"],
+        )
+
+    def retrieve_session(self, session_id) -> SessionState:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._state(session_id)
+
+    def expire_session(self, session_id) -> SessionState:
+        if self.latency:
+            time.sleep(self.latency)
+        if self.sessions[session_id]["status"] != "open":
+            raise ValueError(f"Session {session_id} is not open")
+        self.sessions[session_id]["status"] = "expired"
+        return self._state(session_id)
+
+    def pay(self, session_id):
+        """What the customer paying at checkout does to the session"""
+        self.sessions[session_id].update(status="complete", payment_status="paid")
+
+
+def encode_params(params, prefix="") -> list:
+    """Flatten nested params into Stripe's form encoding (a[b][0]=c)."""
+    if isinstance(params, dict):
+        items = params.items()
+    elif isinstance(params, (list, tuple)):
+        items = enumerate(params)
+    else:
+        return [(prefix, params)]
+
+    pairs = []
+    for key, value in items:
+        pairs += encode_params(value, f"{prefix}[{key}]" if prefix else str(key))
+    return pairs
+
+
+class HttpxStripeGateway(PaymentGateway):
+    """Talk to the Stripe API directly over pooled httpx connections.
+
+    Connection errors are retried by the transport; 429 and 5xx answers are
+    retried with backoff under the same Idempotency-Key (a random one when
+    the caller passes none), so a retry never creates a second session.
+    """
+
+    retry_statuses = (409, 429, 500, 502, 503, 504)
+
+    def __init__(
+        self,
+        api_key=None,
+        base_url=STRIPE_API_URL,
+        timeout=10.0,
+        connect_timeout=3.0,
+        retries=2,
+        backoff=0.2,
+        max_connections=20,
+        transport=None,
+        async_transport=None,
+        **options,
+    ):
+        super().__init__(**options)
+        self.retries = retries
+        self.backoff = backoff
+        self.client_options = {
+            "base_url": base_url,
+            "auth": (api_key or "", ""),
+            "timeout": httpx.Timeout(timeout, connect=connect_timeout),
+            "limits": httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+        }
+        self.client = httpx.Client(
+            transport=transport or httpx.HTTPTransport(retries=retries),
+            **self.client_options,
+        )
+        self._async_transport = async_transport
+        self._async_client = contextvars.ContextVar("async_client", default=None)
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        async with httpx.AsyncClient(
+            transport=self._async_transport
+            or httpx.AsyncHTTPTransport(retries=self.retries),
+            **self.client_options,
+        ) as client:
+            token = self._async_client.set(client)
+            try:
+                yield
+            finally:
+                self._async_client.reset(token)
+
+    def _request_kwargs(
+        self, amount, name, success_url, cancel_url, idempotency_key
+    ) -> dict:
+        return {
+            "data": dict(
+                encode_params(checkout_params(amount, name, success_url, cancel_url))
+            ),
+            "headers": {"Idempotency-Key": idempotency_key or uuid.uuid4().hex},
+        }
+
+    @staticmethod
+    def _session(response) -> CheckoutSession:
+        response.raise_for_status()
+        data = response.json()
+        return CheckoutSession(id=data["id"], url=data["url"])
+
+    def _send(self, method, url, **kwargs) -> httpx.Response:
+        for attempt in range(self.retries + 1):
+            response = self.client.request(method, url, **kwargs)
+            if response.status_code not in self.retry_statuses:
+                break
+            if attempt < self.retries:
+                time.sleep(self.backoff * 2**attempt)
+        return response
+
+    def create_session(
+        self, amount, name, success_url, cancel_url, idempotency_key=None
+    ) -> CheckoutSession:
+        kwargs = self._request_kwargs(
+            amount, name, success_url, cancel_url, idempotency_key
+        )
+        return self._session(self._send("POST", "/v1/checkout/sessions", **kwargs))
+
+    async def acreate_session(
+        self, amount, name, success_url, cancel_url, idempotency_key=None
+    ) -> CheckoutSession:
+        client = self._async_client.get()
+        if client is None:
+            async with self.connection():
+                return await self.acreate_session(
+                    amount, name, success_url, cancel_url, idempotency_key
+                )
+
+        kwargs = self._request_kwargs(
+            amount, name, success_url, cancel_url, idempotency_key
+        )
+        for attempt in range(self.retries + 1):
+            response = await client.post("/v1/checkout/sessions", **kwargs)
+            if response.status_code not in self.retry_statuses:
+                break
+            if attempt < self.retries:
+                await asyncio.sleep(self.backoff * 2**attempt)
+        return self._session(response)
+
+    @staticmethod
+    def _state(response) -> SessionState:
+        response.raise_for_status()
+        data = response.json()
+        return SessionState(
+            id=data["id"], status=data["status"], payment_status=data["payment_status"]
+        )
+
+    def retrieve_session(self, session_id) -> SessionState:
+        return self._state(self._send("GET", f"/v1/checkout/sessions/{session_id}"))
+
+    def expire_session(self, session_id) -> SessionState:
+        return self._state(
+            self._send(
+                "POST",
+                f"/v1/checkout/sessions/{session_id}/expire",
+                headers={"Idempotency-Key": uuid.uuid4().hex},
+            )
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def get_gateway() -> PaymentGateway:
+    config = settings.PAYMENT_GATEWAY
+    gateway_class = import_string(config["BACKEND"])
+    return gateway_class(**config.get("OPTIONS", {}))
+
+
+@receiver(setting_changed)
+def reset_gateway(setting, **kwargs):
+    if setting == "PAYMENT_GATEWAY":
+        get_gateway.cache_clear()
@@ -0,0 +1,136 @@
+import datetime
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from library import metrics
+from library.models import Payment
+from library.payments import get_gateway
+
+logger = logging.getLogger(__name__)
+
+
+class PaymentReconciler:
+    """Bring pending payments in line with their Stripe checkout sessions.
+
+    Pending payments are read ``chunk_size`` at a time in id order, the
+    sessions of a chunk are looked up ``workers`` at a time, and open
+    sessions older than ``max_age`` are expired. Payments whose session
+    was paid become PAID, expired ones EXPIRED, in one bulk_update per
+    chunk. A session that cannot be looked up is counted as an error and
+    left for the next run.
+    """
+
+    def __init__(self, gateway=None, workers=None, chunk_size=None, max_age=None):
+        self.gateway = gateway or get_gateway()
+        self.workers = workers or settings.PAYMENT_RECONCILE_WORKERS
+        self.chunk_size = chunk_size or settings.PAYMENT_RECONCILE_CHUNK_SIZE
+        self.max_age = max_age or datetime.timedelta(
+            seconds=settings.PAYMENT_SESSION_MAX_AGE
+        )
+        self.counts = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counts[name] += n
+
+    def pending_chunks(self):
+        queryset = (
+            Payment.objects.filter(
+                status=Payment.StatusChoices.PENDING, session_id__isnull=False
+            )
+            .order_by("id")
+            .values_list("id", "session_id", "created_at")
+        )
+        after_id = 0
+        while True:
+            chunk = list(queryset.filter(id__gt=after_id)[: self.chunk_size])
+            if not chunk:
+                return
+            yield chunk
+            after_id = chunk[-1][0]
+
+    def check_session(self, session_id, stale):
+        """The status the session's payments should have, or None"""
+        try:
+            state = self.gateway.retrieve_session(session_id)
+            if state.payment_status == "paid":
+                return Payment.StatusChoices.PAID
+            if state.status == "open" and stale:
+                state = self.gateway.expire_session(session_id)
+                self.count("sessions_expired")
+            if state.status == "expired":
+                return Payment.StatusChoices.EXPIRED
+        except Exception:
+            logger.exception("Checkout session %s could not be reconciled", session_id)
+            self.count("errors")
+        return None
+
+    def reconcile_chunk(self, chunk, pool) -> int:
+        cutoff = timezone.now() - self.max_age
+        payments = defaultdict(list)
+        stale = defaultdict(lambda: True)
+        for payment_id, session_id, created_at in chunk:
+            payments[session_id].append(payment_id)
+            # A bulk return shares one session between its payments
+            stale[session_id] = stale[session_id] and created_at < cutoff
+        sessions = list(payments)
+        statuses = dict(
+            zip(
+                sessions,
+                pool.map(
+                    lambda session_id: self.check_session(
+                        session_id, stale[session_id]
+                    ),
+                    sessions,
+                ),
+            )
+        )
+        new_status = {
+            payment_id: statuses[session_id]
+            for session_id, payment_ids in payments.items()
+            if statuses[session_id]
+            for payment_id in payment_ids
+        }
+        self.count("checked", len(chunk))
+        if not new_status:
+            return 0
+
+        with transaction.atomic():
+            # Skip payments a webhook settled meanwhile
+            changed = list(
+                Payment.objects.filter(
+                    id__in=new_status, status=Payment.StatusChoices.PENDING
+                )
+                .select_for_update(skip_locked=True)
+                .only("id", "status")
+            )
+            for payment in changed:
+                payment.status = new_status[payment.id]
+                self.count(payment.status.lower())
+            Payment.objects.bulk_update(changed, ["status"])
+        return len(changed)
+
+    def run(self) -> dict:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for chunk in self.pending_chunks():
+                self.reconcile_chunk(chunk, pool)
+        elapsed = time.perf_counter() - start
+        report = {
+            "checked": self.counts["checked"],
+            "paid": self.counts["paid"],
+            "expired": self.counts["expired"],
+            "sessions_expired": self.counts["sessions_expired"],
+            "errors": self.counts["errors"],
+            "seconds": round(elapsed, 3),
+            "per_second": round(self.counts["checked"] / elapsed, 1) if elapsed else 0,
+        }
+        metrics.emit("payments.reconciled", **report)
+        return report
@@ -1,6 +1,8 @@
 import datetime
+from collections import Counter
 
-from library.models import Book, Borrowing, Payment
+from django.contrib.auth import get_user_model
+from library.models import Book, BookDebt, Borrowing, Payment, UserDebt
 from rest_framework import serializers
 
 
@@ -14,7 +16,18 @@ class BookSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Book
-        fields = ("id", "title", "cover", "author", "daily_fee", "inventory")
+        fields = (
+            "id",
+            "title",
+            "cover",
+            "author",
+            "daily_fee",
+            "inventory",
+            "active_loans",
+            "overdue_loans",
+            "total_loans",
+        )
+        read_only_fields = ("active_loans", "overdue_loans", "total_loans")
 
 
 class BorrowingListSerializer(serializers.ModelSerializer):
@@ -55,19 +68,93 @@ class BorrowingCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("This book is unavailable")
         return attrs
 
-    def validate_user(self, attrs):
-        if attrs.borrowing_set.filter(actual_return_date=None).exists():
-            raise serializers.ValidationError("Please pay back your previous loans")
+    def validate(self, attrs):
+        """The borrowing is always created for the requesting user"""
+        user = self.context["request"].user
+        if Borrowing.objects.filter(user=user, actual_return_date=None).exists():
+            raise serializers.ValidationError(
+                {"user": ["Please pay back your previous loans"]}
+            )
         return attrs
 
     class Meta:
         model = Borrowing
         fields = [
+            "id",
             "user",
             "book",
             "borrow_date",
             "expected_return_date",
         ]
+        read_only_fields = ("user",)
+
+
+BULK_LIMIT = 500
+
+
+class BulkBorrowingItemSerializer(serializers.Serializer):
+    user = serializers.IntegerField()
+    book = serializers.IntegerField()
+    expected_return_date = serializers.DateField()
+
+    def validate_expected_return_date(self, attrs):
+        if datetime.date.today() > attrs:
+            raise serializers.ValidationError("Please, enter a correct date")
+        return attrs
+
+
+class BulkBorrowingSerializer(serializers.Serializer):
+    """Check all borrowings of a batch at once, with one query per table"""
+
+    borrowings = BulkBorrowingItemSerializer(
+        many=True, allow_empty=False, max_length=BULK_LIMIT
+    )
+
+    def validate_borrowings(self, attrs):
+        user_ids = Counter(item["user"] for item in attrs)
+        copies = Counter(item["book"] for item in attrs)
+        errors = []
+
+        users = get_user_model().objects.in_bulk(user_ids)
+        books = Book.objects.only("id", "title", "inventory").in_bulk(copies)
+        errors += [
+            f"User {user_id} does not exist" for user_id in set(user_ids) - set(users)
+        ]
+        errors += [
+            f"Book {book_id} does not exist" for book_id in set(copies) - set(books)
+        ]
+        errors += [
+            f"User {user_id} is in the batch more than once"
+            for user_id, count in user_ids.items()
+            if count > 1
+        ]
+        errors += [
+            f"User {user_id}: please pay back your previous loans"
+            for user_id in Borrowing.objects.filter(
+                user_id__in=user_ids, actual_return_date=None
+            )
+            .values_list("user_id", flat=True)
+            .distinct()
+        ]
+        errors += [
+            f"Book {book_id}: {books[book_id].inventory} copies left, "
+            f"{count} requested"
+            for book_id, count in copies.items()
+            if book_id in books and books[book_id].inventory < count
+        ]
+        if errors:
+            raise serializers.ValidationError(errors)
+
+        for item in attrs:
+            item["user"] = users[item["user"]]
+            item["book"] = books[item["book"]]
+        return attrs
+
+
+class BulkReturnSerializer(serializers.Serializer):
+    borrowings = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False, max_length=BULK_LIMIT
+    )
 
 
 class PaymentSerializer(serializers.ModelSerializer):
@@ -82,3 +169,23 @@ class PaymentSerializer(serializers.ModelSerializer):
             "session_id",
             "money_to_pay",
         )
+
+
+DEBT_FIELDS = ("open_loans", "overdue_loans", "accrued", "fines", "refreshed_at")
+
+
+class UserDebtSerializer(serializers.ModelSerializer):
+    # Annotated from DebtRefresh by the model's manager
+    refreshed_at = serializers.DateTimeField(read_only=True)
+
+    class Meta:
+        model = UserDebt
+        fields = ("user",) + DEBT_FIELDS
+
+
+class BookDebtSerializer(serializers.ModelSerializer):
+    refreshed_at = serializers.DateTimeField(read_only=True)
+
+    class Meta:
+        model = BookDebt
+        fields = ("book",) + DEBT_FIELDS
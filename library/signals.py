@@ -0,0 +1,9 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from library.cache import invalidate_catalog
+from library.models import Book
+
+
+@receiver([post_save, post_delete], sender=Book)
+def book_changed(sender, **kwargs):
+    invalidate_catalog()
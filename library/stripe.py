@@ -1,13 +1,90 @@
-import os
-
 import stripe
-from django.http import HttpResponse
-from rest_framework.decorators import api_view
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from library import metrics
+from library.models import Payment, WebhookEvent
+
+# Checkout sessions that have been paid for; an asynchronous payment method
+# completes the session unpaid and succeeds later
+PAID_EVENTS = (
+    "checkout.session.completed",
+    "checkout.session.async_payment_succeeded",
+)
+
+
+@csrf_exempt
+@require_POST
+def stripe_webhook(request):
+    """Verify the signature locally, store the event once and acknowledge;
+    payments are updated by the process_webhook_events task"""
+    try:
+        event = stripe.Webhook.construct_event(
+            request.body.decode(),
+            request.headers.get("Stripe-Signature", ""),
+            settings.STRIPE_WEBHOOK_SECRET,
+            tolerance=settings.STRIPE_WEBHOOK_TOLERANCE,
+        )
+    except (ValueError, stripe.error.SignatureVerificationError):
+        return HttpResponseBadRequest("Invalid payload or signature")
+
+    if event["type"] in PAID_EVENTS:
+        # A redelivered event is already there and is ignored
+        WebhookEvent.objects.bulk_create(
+            [
+                WebhookEvent(
+                    event_id=event["id"],
+                    type=event["type"],
+                    payload=event["data"]["object"].to_dict_recursive(),
+                )
+            ],
+            ignore_conflicts=True,
+        )
+    return HttpResponse(status=200)
+
+
+class WebhookProcessor:
+    """Apply stored events a batch at a time: one UPDATE marks the payments
+    of every paid checkout session in the batch.
+
+    Events are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so workers
+    running side by side never process the same event.
+    """
+
+    def __init__(self, batch_size=500):
+        self.batch_size = batch_size
 
+    def process_batch(self) -> int:
+        with transaction.atomic():
+            events = list(
+                WebhookEvent.objects.filter(processed_at=None)
+                .select_for_update(skip_locked=True)
+                .order_by("id")[: self.batch_size]
+            )
+            paid_sessions = {
+                event.payload["id"]
+                for event in events
+                if event.type in PAID_EVENTS
+                and event.payload.get("payment_status") == "paid"
+            }
+            paid = Payment.objects.filter(
+                session_id__in=paid_sessions, status=Payment.StatusChoices.PENDING
+            ).update(status=Payment.StatusChoices.PAID)
+            WebhookEvent.objects.filter(id__in=[event.id for event in events]).update(
+                processed_at=timezone.now()
+            )
 
-@api_view(["GET"])
-def order_success(*args, **kwargs):
-    session = stripe.checkout.Session.retrieve(request.GET.get("session_id"))
-    customer = stripe.Customer.retrieve(session.customer)
+        if events:
+            metrics.emit("webhooks.processed", events=len(events), paid=paid)
+        return len(events)
 
-    return HttpResponse("Success")
+    def process(self) -> int:
+        processed = 0
+        while True:
+            count = self.process_batch()
+            processed += count
+            if count < self.batch_size:
+                return processed
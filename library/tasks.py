@@ -1,17 +1,130 @@
 import datetime
 
-from celery import shared_task
-from library.models import Borrowing
-from library.notifications import overdue_borrowing, not_overdue
+from celery import chord, shared_task
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+from library import debts, metrics
+from library.counters import reconcile
+from library.models import Borrowing, OverdueReport
+from library.notifications import get_dispatcher, overdue_digest, not_overdue
+from library.outbox import OutboxRelay
+from library.reconciliation import PaymentReconciler
+from library.stripe import WebhookProcessor
+
+
+def overdue_borrowings(today):
+    return Borrowing.objects.filter(
+        expected_return_date__lt=today, actual_return_date=None
+    )
+
+
+def overdue_chunks(today, chunk_size, after_id=0, last_id=None):
+    """Yield overdue borrowings as lists of dicts, one keyset page at a time"""
+    queryset = overdue_borrowings(today).order_by("id")
+    if last_id is not None:
+        queryset = queryset.filter(id__lte=last_id)
+
+    while True:
+        chunk = list(
+            queryset.filter(id__gt=after_id).values(
+                "id", "book_id", "book__title", "expected_return_date"
+            )[:chunk_size]
+        )
+        if not chunk:
+            return
+        yield chunk
+        after_id = chunk[-1]["id"]
 
 
 @shared_task
-def run_sync_with_api() -> list:
-    overdue = Borrowing.objects.filter(
-        expected_return_date__lt=datetime.date.today()
-    ).filter(actual_return_date=None)
-    if overdue:
-        for over in overdue:
-            overdue_borrowing(over.id, over.book.id, over.book.title, over.expected_return_date)
-    else:
+def run_sync_with_api() -> int:
+    """Split today's overdue borrowings into id ranges, one task per range"""
+    today = datetime.date.today()
+    bounds = overdue_borrowings(today).aggregate(first=Min("id"), last=Max("id"))
+
+    if bounds["first"] is None:
         not_overdue()
+        metrics.emit("overdue.summary", day=today, overdue=0, ranges=0)
+        return 0
+
+    # Ranges start at multiples of the span, so a re-run the same day finds
+    # the progress of the first run whichever loans were returned meanwhile
+    span = settings.OVERDUE_RANGE_SIZE
+    ranges = [
+        notify_overdue_range.s(first_id, first_id + span - 1, str(today))
+        for first_id in range(bounds["first"] // span * span, bounds["last"] + 1, span)
+    ]
+    chord(ranges)(summarize_overdue.s(str(today)))
+    return len(ranges)
+
+
+@shared_task(autoretry_for=(Exception,), retry_backoff=True, max_retries=3)
+def notify_overdue_range(first_id, last_id, day) -> int:
+    """Queue digests for one id range; a retry resumes after the last digest"""
+    report, _ = OverdueReport.objects.get_or_create(
+        day=day, first_id=first_id, last_id=last_id
+    )
+    if report.finished:
+        return report.overdue
+
+    digest_size = settings.OVERDUE_DIGEST_SIZE
+    chunks = overdue_chunks(
+        datetime.date.fromisoformat(day),
+        settings.OVERDUE_CHUNK_SIZE,
+        after_id=max(first_id - 1, report.notified_up_to),
+        last_id=last_id,
+    )
+    for chunk in chunks:
+        for start in range(0, len(chunk), digest_size):
+            digest = chunk[start : start + digest_size]
+            with transaction.atomic():
+                overdue_digest(digest)
+                report.notified_up_to = digest[-1]["id"]
+                report.overdue += len(digest)
+                report.save(update_fields=["notified_up_to", "overdue"])
+
+    report.finished = True
+    report.save(update_fields=["finished"])
+    return report.overdue
+
+
+@shared_task
+def summarize_overdue(results, day) -> int:
+    overdue = sum(results)
+    metrics.emit("overdue.summary", day=day, overdue=overdue, ranges=len(results))
+    return overdue
+
+
+@shared_task
+def dispatch_notifications() -> int:
+    return get_dispatcher().dispatch()
+
+
+@shared_task
+def relay_outbox() -> int:
+    return OutboxRelay().relay()
+
+
+@shared_task
+def process_webhook_events() -> int:
+    return WebhookProcessor().process()
+
+
+@shared_task
+def refresh_overdue_loans() -> int:
+    """Loans turn overdue at midnight without any write to count them"""
+    drifted = reconcile(fields=("overdue_loans",), today=timezone.localdate())
+    metrics.emit("books.overdue_refreshed", drifted=drifted)
+    return drifted
+
+
+@shared_task
+def refresh_debts():
+    debts.refresh()
+
+
+@shared_task
+def reconcile_payments() -> dict:
+    return PaymentReconciler().run()
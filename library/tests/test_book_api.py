@@ -9,16 +9,18 @@ from datetime import timedelta
 import stripe
 from django.contrib.auth import get_user_model
 from django.test import RequestFactory
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
-from library.models import Book, Borrowing, Payment
-from library.notifications import new_borrowing, overdue_borrowing
+from library.models import Book, Borrowing, Notification, Outbox, Payment
+from library.outbox import OutboxRelay
+from library.notifications import new_borrowing, overdue_borrowing, overdue_digest
 from library.tasks import run_sync_with_api
 from library.serializers import (
     BookSerializer,
     BorrowingListSerializer,
     PaymentSerializer,
 )
+from library.tests.utils import sample_book
 from rest_framework import status
 from rest_framework.test import APIClient
 
@@ -33,18 +35,6 @@ def detail_url(model, object_id):
     return reverse(f"library:{model._meta.model_name}-detail", args=[object_id])
 
 
-def sample_book(**kwargs):
-    defaults = {
-        "author": "Jerome K. Jerome",
-        "title": "Three men in a boat",
-        "cover": "SOFT",
-        "daily_fee": 0.15,
-        "inventory": 20,
-    }
-    defaults.update(kwargs)
-    return Book.objects.create(**defaults)
-
-
 def sample_borrowing(**kwargs):
     defaults = {
         "borrow_date": datetime.date.today(),
@@ -417,6 +407,111 @@ class PaymentTest(TestCase):
         self.assertEqual(round(self.borrowing.pay_money(), 1), 2.4)
 
 
+class CreateBorrowingTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email="123@test.com",
+            password="123test",
+        )
+        self.client.force_authenticate(self.user)
+        self.book = sample_book(inventory=3)
+        self.payload = {
+            "book": self.book.id,
+            "expected_return_date": date.today() + timedelta(days=7),
+        }
+
+    def test_create_borrowing(self):
+        with self.assertNumQueries(7):
+            res = self.client.post(BORROWING_URL, self.payload)
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data["user"], self.user.id)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 2)
+        self.assertEqual(
+            Outbox.objects.get().topic, Outbox.TopicChoices.BORROWING_CREATED
+        )
+
+    def test_user_comes_from_request(self):
+        other = get_user_model().objects.create_user(
+            email="other@test.com", password="123test"
+        )
+
+        res = self.client.post(BORROWING_URL, {**self.payload, "user": other.id})
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Borrowing.objects.get().user, self.user)
+
+    def test_unpaid_loan_blocks_borrowing(self):
+        Borrowing.objects.create(
+            expected_return_date=date.today() + timedelta(days=7),
+            book=self.book,
+            user=self.user,
+        )
+
+        res = self.client.post(BORROWING_URL, self.payload)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("user", res.data)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 3)
+
+
+class ReturnBorrowingTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email="123@test.com",
+            password="123test",
+        )
+        self.client.force_authenticate(self.user)
+
+        self.book = sample_book(inventory=3)
+        self.borrowing = Borrowing.objects.create(
+            expected_return_date=date.today() + timedelta(days=7),
+            book=self.book,
+            user=self.user,
+        )
+
+    @override_settings(PAYMENT_GATEWAY={"BACKEND": "library.payments.FakeGateway"})
+    def test_return_borrowing(self):
+        with self.assertNumQueries(7):
+            res = self.client.put(detail_url(Borrowing, self.borrowing.id))
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+
+        self.borrowing.refresh_from_db()
+        self.book.refresh_from_db()
+        payment = Payment.objects.get(borrowing=self.borrowing)
+        self.assertEqual(res.data["id"], payment.id)
+        self.assertEqual(self.borrowing.actual_return_date, date.today())
+        self.assertFalse(self.borrowing.is_active)
+        self.assertEqual(self.book.inventory, 4)
+        self.assertEqual(payment.status, Payment.StatusChoices.PENDING)
+        self.assertIsNone(payment.session_id)
+
+        self.assertEqual(OutboxRelay().relay(), 1)
+
+        payment.refresh_from_db()
+        self.assertTrue(payment.session_id.startswith("cs_fake_"))
+        self.assertIn(payment.session_id, payment.session_url)
+
+    def test_return_borrowing_twice(self):
+        self.client.put(detail_url(Borrowing, self.borrowing.id))
+        res = self.client.put(detail_url(Borrowing, self.borrowing.id))
+
+        self.book.refresh_from_db()
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["actual_return_date"], str(date.today()))
+        self.assertEqual(self.book.inventory, 4)
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(
+            Outbox.objects.filter(topic=Outbox.TopicChoices.PAYMENT_REQUESTED).count(),
+            1,
+        )
+
+
 class NotificationsTest(TestCase):
     def setUp(self):
         self.user = get_user_model().objects.create_user(
@@ -432,8 +527,8 @@ class NotificationsTest(TestCase):
             user=self.user,
         )
 
-    @patch("library.notifications.bot.send_message")
-    def test_new_borrowing_notification(self, send_message_mock):
+    @patch("library.notifications.notify")
+    def test_new_borrowing_notification(self, notify_mock):
         new_borrowing(
             self.borrowing.id,
             self.user.id,
@@ -442,16 +537,15 @@ class NotificationsTest(TestCase):
             self.borrowing.expected_return_date,
         )
 
-        send_message_mock.assert_called_once_with(
-            str(BOT_NUMBER),
+        notify_mock.assert_called_once_with(
             f"New borrowing:{self.borrowing.id}, user_id - {self.user.id},\n"
             f" book_id {self.borrowing.book.id} , {self.borrowing.book.title},\n"
             f" expected_return_date - {self.borrowing.expected_return_date}",
             parse_mode="html",
         )
 
-    @patch("library.notifications.bot.send_message")
-    def test_overdue_borrowings_notification(self, send_message_mock):
+    @patch("library.notifications.notify")
+    def test_overdue_borrowings_notification(self, notify_mock):
         self.borrowing.expected_return_date = date.today() - timedelta(days=1)
         overdue_borrowing(
             self.borrowing.id,
@@ -460,15 +554,14 @@ class NotificationsTest(TestCase):
             self.borrowing.expected_return_date,
         )
 
-        send_message_mock.assert_called_once_with(
-            str(BOT_NUMBER),
+        notify_mock.assert_called_once_with(
             f"Overdue borrowing: id -{self.borrowing.id}, \n"
             f"book_id {self.borrowing.book.id} ,{self.borrowing.book.title},\n"
             f"expected_return_date - {self.borrowing.expected_return_date}",
         )
 
-    @patch("library.notifications.bot.send_message")
-    def test_not_overdue_borrowings_notification(self, send_message_mock):
+    @patch("library.notifications.notify")
+    def test_not_overdue_borrowings_notification(self, notify_mock):
         self.borrowing.expected_return_date = date.today() + timedelta(days=10)
         overdue_borrowing(
             self.borrowing.id,
@@ -479,4 +572,38 @@ class NotificationsTest(TestCase):
 
         run_sync_with_api()
 
-        send_message_mock.assert_not_called()
+        notify_mock.assert_not_called()
+
+    @patch("library.notifications.notify")
+    def test_overdue_digest_notification(self, notify_mock):
+        overdue_digest(
+            [
+                {
+                    "id": self.borrowing.id,
+                    "book_id": self.borrowing.book.id,
+                    "book__title": self.borrowing.book.title,
+                    "expected_return_date": self.borrowing.expected_return_date,
+                }
+            ]
+        )
+
+        notify_mock.assert_called_once_with(
+            "Overdue borrowings (1):\n"
+            f"id -{self.borrowing.id}, book_id {self.borrowing.book.id} ,"
+            f"{self.borrowing.book.title}, "
+            f"expected_return_date - {self.borrowing.expected_return_date}",
+        )
+
+    def test_notification_is_queued(self):
+        new_borrowing(
+            self.borrowing.id,
+            self.user.id,
+            self.borrowing.book.id,
+            self.borrowing.book.title,
+            self.borrowing.expected_return_date,
+        )
+
+        notification = Notification.objects.get()
+        self.assertEqual(notification.chat_id, str(BOT_NUMBER))
+        self.assertEqual(notification.parse_mode, "html")
+        self.assertIsNone(notification.sent_at)
@@ -0,0 +1,175 @@
+import csv
+import io
+import json
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import AsyncClient, TestCase
+from django.urls import reverse
+from library.bookio import BookImporter, export_rows
+from library.models import Book
+from library.tests.utils import sample_book
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+IMPORT_URL = reverse("library:book-import-books")
+EXPORT_URL = reverse("library:book-export-books")
+
+CSV = """id,title,author,cover,inventory,daily_fee
+,Three men in a boat,Jerome K. Jerome,SOFT,3,0.150
+,Idle thoughts,Jerome K. Jerome,PAPER,3,0.150
+,Diary of a pilgrimage,Jerome K. Jerome,HARD,0,0.100
+"""
+
+
+class BookImporterTest(TestCase):
+    def test_reports_invalid_rows(self):
+        report = BookImporter().run(io.StringIO(CSV), "csv")
+
+        self.assertEqual((report["created"], report["updated"]), (1, 0))
+        self.assertEqual([error["line"] for error in report["errors"]], [3, 4])
+        self.assertIn("cover", report["errors"][0]["errors"])
+        self.assertIn("inventory", report["errors"][1]["errors"])
+        self.assertEqual(Book.objects.get().title, "Three men in a boat")
+
+    def test_upserts_by_id(self):
+        book = sample_book(active_loans=2, total_loans=5)
+        row = {"author": "A", "inventory": 4, "daily_fee": "0.2"}
+        lines = [
+            json.dumps({**row, "id": book.id, "title": "Old", "cover": "SOFT"}),
+            json.dumps({**row, "id": book.id, "title": "New", "cover": "HARD"}),
+            "",
+            "not json",
+            json.dumps({**row, "id": book.id + 100, "title": "Fresh", "cover": "SOFT"}),
+        ]
+
+        report = BookImporter(chunk_size=2).run(io.StringIO("\n".join(lines)), "ndjson")
+
+        self.assertEqual((report["created"], report["updated"]), (1, 1))
+        self.assertEqual(report["errors"][0]["line"], 4)
+        book.refresh_from_db()
+        self.assertEqual((book.title, book.cover, book.inventory), ("New", "HARD", 4))
+        self.assertEqual((book.active_loans, book.total_loans), (2, 5))
+        # The sequence was moved past the imported ids
+        self.assertGreater(sample_book().id, book.id + 100)
+
+    def test_rejects_ids_that_are_not_positive_integers(self):
+        row = {"title": "A", "author": "A", "cover": "SOFT", "inventory": 1}
+        lines = [
+            json.dumps({**row, "id": book_id, "daily_fee": "0.1"})
+            for book_id in (0, -3, "x", 1.5, "")
+        ]
+
+        report = BookImporter().run(io.StringIO("\n".join(lines)), "ndjson")
+
+        self.assertEqual((report["created"], report["rejected"]), (1, 4))
+        self.assertEqual([error["line"] for error in report["errors"]], [1, 2, 3, 4])
+        self.assertTrue(all("id" in error["errors"] for error in report["errors"]))
+
+    def test_caps_reported_errors(self):
+        lines = ["not json"] * 5
+
+        report = BookImporter(max_errors=2).run(io.StringIO("\n".join(lines)), "ndjson")
+
+        self.assertEqual(report["rejected"], 5)
+        self.assertEqual([error["line"] for error in report["errors"]], [1, 2])
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as file:
+            file.write(CSV)
+            file.flush()
+            out, err = io.StringIO(), io.StringIO()
+
+            call_command("import_books", file.name, stdout=out, stderr=err)
+
+        self.assertIn("1 created, 0 updated, 2 rejected", out.getvalue())
+        self.assertIn("line 3", err.getvalue())
+
+
+class BookImportExportApiTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = get_user_model().objects.create_superuser(
+            email="admin@test.com", password="123test"
+        )
+        self.client.force_authenticate(self.admin)
+
+    def test_import(self):
+        upload = SimpleUploadedFile("books.csv", CSV.encode(), "text/csv")
+
+        res = self.client.post(IMPORT_URL, {"file": upload}, format="multipart")
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["created"], 1)
+        self.assertEqual(len(res.data["errors"]), 2)
+        self.assertEqual(res.data["rejected"], 2)
+
+    def test_import_unknown_format(self):
+        upload = SimpleUploadedFile("books.xls", b"", "application/vnd.ms-excel")
+
+        res = self.client.post(IMPORT_URL, {"file": upload}, format="multipart")
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_requires_admin(self):
+        user = get_user_model().objects.create_user(
+            email="123@test.com", password="123test"
+        )
+        self.client.force_authenticate(user)
+
+        self.assertEqual(
+            self.client.get(EXPORT_URL).status_code, status.HTTP_403_FORBIDDEN
+        )
+
+    def test_export_round_trip(self):
+        books = [sample_book(title=f"Book {i}") for i in range(5)]
+
+        res = self.client.get(EXPORT_URL)
+
+        self.assertTrue(res.streaming)
+        self.assertEqual(res["Content-Type"], "text/csv")
+        content = b"".join(res.streaming_content).decode()
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual([int(row["id"]) for row in rows], [book.id for book in books])
+        self.assertEqual(rows[0]["daily_fee"], "0.150")
+
+        report = BookImporter().run(io.StringIO(content), "csv")
+
+        self.assertEqual((report["created"], report["updated"]), (0, 5))
+
+    async def test_export_under_asgi(self):
+        book = await Book.objects.acreate(
+            title="Three men in a boat",
+            author="Jerome K. Jerome",
+            cover="SOFT",
+            daily_fee=0.15,
+            inventory=20,
+        )
+        res = await AsyncClient().get(
+            EXPORT_URL,
+            {"file_format": "ndjson"},
+            authorization=f"Bearer {AccessToken.for_user(self.admin)}",
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res["Content-Type"], "application/x-ndjson")
+        self.assertEqual(
+            res["Content-Disposition"], 'attachment; filename="books.ndjson"'
+        )
+        rows = b"".join(res.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(row)["id"] for row in rows], [book.id])
+
+    def test_export_ndjson_in_chunks(self):
+        for i in range(5):
+            sample_book(title=f"Book {i}")
+
+        chunks = list(export_rows("ndjson", chunk_size=2))
+
+        self.assertEqual(len(chunks), 3)
+        rows = [json.loads(line) for line in "".join(chunks).splitlines()]
+        self.assertEqual(
+            [row["title"] for row in rows], [f"Book {i}" for i in range(5)]
+        )
@@ -0,0 +1,203 @@
+import datetime
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from library.models import Book, Borrowing, Notification, Payment, WebhookEvent
+from library.outbox import OutboxRelay
+from library.stripe import WebhookProcessor
+from library.tests.utils import sample_book
+from rest_framework import status
+from rest_framework.test import APIClient
+
+BULK_BORROW_URL = reverse("library:borrowing-bulk-borrow")
+BULK_RETURN_URL = reverse("library:borrowing-bulk-return")
+PAYMENT_SUCCESS_URL = reverse("library:payment-success")
+FAKE_GATEWAY = {"BACKEND": "library.payments.FakeGateway"}
+
+
+class BulkBorrowingTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = get_user_model().objects.create_superuser(
+            email="admin@test.com", password="123test"
+        )
+        self.client.force_authenticate(self.admin)
+        self.users = [
+            get_user_model().objects.create_user(
+                email=f"user{i}@test.com", password="123test"
+            )
+            for i in range(4)
+        ]
+        self.book = sample_book(inventory=3)
+        self.other_book = sample_book(title="Idle thoughts of an idle fellow")
+        self.return_date = datetime.date.today() + datetime.timedelta(days=7)
+
+    def items(self, users, book=None):
+        return [
+            {
+                "user": user.id,
+                "book": (book or self.book).id,
+                "expected_return_date": self.return_date,
+            }
+            for user in users
+        ]
+
+    def test_requires_admin(self):
+        self.client.force_authenticate(self.users[0])
+
+        res = self.client.post(
+            BULK_BORROW_URL, {"borrowings": self.items(self.users[:1])}, format="json"
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_bulk_borrow(self):
+        res = self.client.post(
+            BULK_BORROW_URL,
+            {
+                "borrowings": self.items(self.users[:2])
+                + self.items(self.users[2:3], self.other_book)
+            },
+            format="json",
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data), 3)
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.inventory, self.book.active_loans), (1, 2))
+        self.assertEqual(Borrowing.objects.count(), 3)
+
+        self.assertEqual(OutboxRelay().relay(), 1)
+        notification = Notification.objects.get()
+        self.assertTrue(notification.text.startswith("New borrowings (3):"))
+
+    def test_books_are_locked_in_id_order(self):
+        with patch.object(Book, "reserve", return_value=True) as reserve:
+            self.client.post(
+                BULK_BORROW_URL,
+                {
+                    "borrowings": self.items(self.users[:1], self.other_book)
+                    + self.items(self.users[1:2])
+                },
+                format="json",
+            )
+
+        self.assertEqual(
+            [call.args[0] for call in reserve.call_args_list],
+            [self.book.id, self.other_book.id],
+        )
+
+    def test_queries_do_not_grow_with_the_batch(self):
+        with self.assertNumQueries(8):
+            self.client.post(
+                BULK_BORROW_URL,
+                {"borrowings": self.items(self.users[:1])},
+                format="json",
+            )
+        Borrowing.objects.all().delete()
+        with self.assertNumQueries(8):
+            self.client.post(
+                BULK_BORROW_URL,
+                {"borrowings": self.items(self.users[1:4], self.other_book)},
+                format="json",
+            )
+
+    def test_batch_is_checked_as_a_whole(self):
+        Borrowing.objects.create(
+            user=self.users[0],
+            book=self.other_book,
+            expected_return_date=self.return_date,
+        )
+        items = self.items(self.users) + self.items(self.users[1:2])
+        items[0]["book"] = 0
+
+        res = self.client.post(BULK_BORROW_URL, {"borrowings": items}, format="json")
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            res.data["borrowings"],
+            [
+                "Book 0 does not exist",
+                f"User {self.users[1].id} is in the batch more than once",
+                f"User {self.users[0].id}: please pay back your previous loans",
+                f"Book {self.book.id}: 3 copies left, 4 requested",
+            ],
+        )
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 3)
+        self.assertEqual(Borrowing.objects.count(), 1)
+
+
+@override_settings(PAYMENT_GATEWAY=FAKE_GATEWAY)
+class BulkReturnTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = get_user_model().objects.create_superuser(
+            email="admin@test.com", password="123test"
+        )
+        self.client.force_authenticate(self.admin)
+        self.user = get_user_model().objects.create_user(
+            email="123@test.com", password="123test"
+        )
+        self.other_user = get_user_model().objects.create_user(
+            email="456@test.com", password="123test"
+        )
+        self.book = sample_book(inventory=2, active_loans=3, total_loans=3)
+        return_date = datetime.date.today() + datetime.timedelta(days=7)
+        self.borrowings = [
+            Borrowing.objects.create(
+                user=user, book=self.book, expected_return_date=return_date
+            )
+            for user in (self.user, self.user, self.other_user)
+        ]
+
+    def test_bulk_return(self):
+        ids = [borrowing.id for borrowing in self.borrowings]
+
+        res = self.client.post(
+            BULK_RETURN_URL, {"borrowings": ids + [0]}, format="json"
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(len(res.data["payments"]), 3)
+        self.assertEqual(res.data["skipped"], [0])
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.inventory, self.book.active_loans), (5, 0))
+        self.assertFalse(Borrowing.objects.filter(is_active=True).exists())
+
+        # One checkout session per user
+        self.assertEqual(OutboxRelay().relay(), 2)
+        sessions = {
+            payment.borrowing.user_id: payment.session_id
+            for payment in Payment.objects.select_related("borrowing")
+        }
+        self.assertEqual(len(set(sessions.values())), 2)
+
+        WebhookEvent.objects.create(
+            event_id="evt_1",
+            type="checkout.session.completed",
+            payload={"id": sessions[self.user.id], "payment_status": "paid"},
+        )
+        WebhookProcessor().process()
+
+        self.assertEqual(
+            Payment.objects.filter(status=Payment.StatusChoices.PAID).count(), 2
+        )
+
+    def test_returned_borrowings_are_skipped(self):
+        ids = [borrowing.id for borrowing in self.borrowings]
+        self.client.post(BULK_RETURN_URL, {"borrowings": ids[:1]}, format="json")
+
+        res = self.client.post(BULK_RETURN_URL, {"borrowings": ids}, format="json")
+
+        self.assertEqual(res.data["skipped"], ids[:1])
+        self.assertEqual(Payment.objects.count(), 3)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 5)
+
+    def test_unknown_session(self):
+        res = self.client.get(PAYMENT_SUCCESS_URL, {"session_id": "cs_unknown"})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,72 @@
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from library.cache import CacheNamespace
+
+
+class CacheNamespaceTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.namespace = CacheNamespace("test")
+
+    def test_keys_are_versioned(self):
+        self.namespace.set("key", "value")
+
+        self.assertEqual(self.namespace.get("key"), "value")
+        self.assertTrue(self.namespace.make_key("key").startswith("test:"))
+
+    def test_invalidate_hides_old_keys(self):
+        self.namespace.set("key", "value")
+
+        self.namespace.invalidate()
+
+        self.assertIsNone(self.namespace.get("key"))
+
+    def test_namespaces_are_independent(self):
+        other = CacheNamespace("other")
+        self.namespace.set("key", "value")
+        other.set("key", "other value")
+
+        other.invalidate()
+
+        self.assertEqual(self.namespace.get("key"), "value")
+        self.assertIsNone(other.get("key"))
+
+    def test_invalidate_tags_hides_tagged_keys(self):
+        tags = self.namespace.tag_versions(["a"])
+        self.namespace.set("tagged", "value", tags=tags)
+        self.namespace.set("other", "value", tags=self.namespace.tag_versions(["b"]))
+
+        self.namespace.invalidate_tags(["a"])
+
+        self.assertIsNone(self.namespace.get("tagged"))
+        self.assertEqual(self.namespace.get("other"), "value")
+
+    def test_stats(self):
+        self.namespace.set("key", "value")
+        self.namespace.get("key")
+        self.namespace.get("key")
+        self.namespace.get("missing")
+
+        self.assertEqual(
+            self.namespace.stats(), {"hits": 2, "misses": 1, "hit_ratio": 0.6667}
+        )
+
+    def test_counters_are_shared(self):
+        same = CacheNamespace("test")
+        self.namespace.get("missing")
+        same.get("missing")
+        same.flush()
+
+        self.assertEqual(self.namespace.stats()["misses"], 2)
+
+    def test_cache_stats_command(self):
+        self.namespace.get("missing")
+        out = StringIO()
+
+        call_command("cache_stats", "--reset", stdout=out)
+
+        self.assertIn("test: hits=0 misses=1 hit_ratio=0.0", out.getvalue())
+        self.assertEqual(self.namespace.stats()["misses"], 0)
@@ -0,0 +1,103 @@
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from library.models import Book
+from library.tests.utils import sample_book
+from rest_framework import status
+from rest_framework.test import APIClient
+
+BOOK_URL = reverse("library:book-list")
+
+
+class CatalogCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.book = sample_book()
+
+    def test_list_is_served_from_cache(self):
+        first = self.client.get(BOOK_URL)
+
+        with self.assertNumQueries(0):
+            second = self.client.get(BOOK_URL)
+
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first["ETag"], second["ETag"])
+        self.assertIn("Last-Modified", second)
+
+    def test_pages_are_cached_separately(self):
+        sample_book(title="Idle thoughts of an idle fellow")
+
+        first_page = self.client.get(BOOK_URL, {"page_size": 1})
+        second_page = self.client.get(BOOK_URL, {"page_size": 1, "page": 2})
+
+        self.assertNotEqual(
+            first_page.data["results"][0]["id"], second_page.data["results"][0]["id"]
+        )
+
+    def test_conditional_get_not_modified(self):
+        etag = self.client.get(BOOK_URL)["ETag"]
+
+        res = self.client.get(BOOK_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res["ETag"], etag)
+
+    def test_detail_is_cached(self):
+        url = reverse("library:book-detail", args=[self.book.id])
+        self.client.get(url)
+
+        with self.assertNumQueries(0):
+            res = self.client.get(url)
+
+        self.assertEqual(res.data["title"], self.book.title)
+
+    def test_book_save_invalidates(self):
+        etag = self.client.get(BOOK_URL)["ETag"]
+
+        self.book.title = "Three men on the bummel"
+        self.book.save()
+        res = self.client.get(BOOK_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["results"][0]["title"], "Three men on the bummel")
+
+    def test_inventory_change_invalidates(self):
+        self.client.get(BOOK_URL)
+
+        Book.reserve(self.book.id)
+        res = self.client.get(BOOK_URL)
+
+        self.assertEqual(res.data["results"][0]["inventory"], 19)
+
+    def test_checkout_keeps_other_books_cached(self):
+        other = sample_book(title="Idle thoughts of an idle fellow")
+        other_url = reverse("library:book-detail", args=[other.id])
+        url = reverse("library:book-detail", args=[self.book.id])
+        for path in (other_url, url, BOOK_URL):
+            self.client.get(path)
+        self.client.get(BOOK_URL, {"page_size": 1, "page": 2})
+        self.client.get(BOOK_URL, {"available": "true"})
+
+        Book.reserve(self.book.id)
+
+        with self.assertNumQueries(0):
+            self.client.get(other_url)
+            self.client.get(BOOK_URL, {"page_size": 1, "page": 2})
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).data["inventory"], 19)
+        with self.assertNumQueries(2):
+            self.client.get(BOOK_URL)
+        with self.assertNumQueries(2):
+            self.client.get(BOOK_URL, {"available": "true"})
+
+    def test_missing_book_is_not_cached(self):
+        url = reverse("library:book-detail", args=[0])
+
+        self.client.get(url)
+
+        with self.assertNumQueries(1):
+            res = self.client.get(url)
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
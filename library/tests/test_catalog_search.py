@@ -0,0 +1,61 @@
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from library.tests.utils import sample_book
+from rest_framework import status
+from rest_framework.test import APIClient
+
+BOOK_URL = reverse("library:book-list")
+
+
+class CatalogSearchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.boat = sample_book()
+        self.fellow = sample_book(
+            title="Idle thoughts of an idle fellow", cover="HARD", daily_fee=0.5
+        )
+        self.tolstoy = sample_book(
+            title="War and peace", author="Leo Tolstoy", daily_fee=1, inventory=0
+        )
+
+    def titles(self, **params):
+        res = self.client.get(BOOK_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [book["title"] for book in res.data["results"]]
+
+    def test_search_title_and_author(self):
+        self.assertEqual(self.titles(search="boats"), [self.boat.title])
+        self.assertEqual(self.titles(search="tolstoy"), [self.tolstoy.title])
+        self.assertEqual(self.titles(search="jerome -boat"), [self.fellow.title])
+
+    def test_search_follows_title_changes(self):
+        self.boat.title = "Three men on the bummel"
+        self.boat.save()
+
+        self.assertEqual(self.titles(search="bummel"), [self.boat.title])
+        self.assertEqual(self.titles(search="boat"), [])
+
+    def test_search_ranks_best_match_first(self):
+        idle = sample_book(title="Idle hours of the idle", author="Idle Press")
+
+        self.assertEqual(self.titles(search="idle")[0], idle.title)
+
+    def test_filter_cover(self):
+        self.assertEqual(self.titles(cover="hard"), [self.fellow.title])
+
+    def test_filter_available(self):
+        self.assertEqual(
+            self.titles(available="true"), [self.boat.title, self.fellow.title]
+        )
+        self.assertEqual(self.titles(available="false"), [self.tolstoy.title])
+
+    def test_filter_daily_fee_range(self):
+        self.assertEqual(self.titles(min_fee="0.2", max_fee="0.9"), [self.fellow.title])
+        self.assertEqual(self.titles(min_fee="0.5", cover="SOFT"), [self.tolstoy.title])
+
+    def test_invalid_fee(self):
+        res = self.client.get(BOOK_URL, {"min_fee": "cheap"})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
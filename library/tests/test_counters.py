@@ -0,0 +1,110 @@
+import datetime
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from library.counters import reconcile
+from library.models import Book, Borrowing
+from library.tasks import refresh_overdue_loans
+from library.tests.utils import sample_book
+from rest_framework.test import APIClient
+
+
+class LoanCountersTest(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email="123@test.com", password="123test"
+        )
+        self.book = sample_book()
+        self.today = datetime.date.today()
+
+    def borrow(self, expected_return_date, returned=False):
+        return Borrowing.objects.create(
+            book=self.book,
+            user=self.user,
+            expected_return_date=expected_return_date,
+            actual_return_date=self.today if returned else None,
+        )
+
+    def assertCounters(self, active, overdue, total):
+        self.book.refresh_from_db()
+        self.assertEqual(
+            (self.book.active_loans, self.book.overdue_loans, self.book.total_loans),
+            (active, overdue, total),
+        )
+
+    def test_reserve_and_release(self):
+        Book.reserve(self.book.id)
+        Book.reserve(self.book.id)
+        self.assertCounters(2, 0, 2)
+
+        Book.release(self.book.id)
+        self.assertCounters(1, 0, 2)
+
+    def test_release_overdue(self):
+        Book.objects.filter(pk=self.book.pk).update(active_loans=1, overdue_loans=1)
+
+        Book.release(self.book.id, overdue=1)
+
+        self.assertCounters(0, 0, 0)
+
+    def test_release_never_goes_negative(self):
+        Book.release(self.book.id, overdue=1)
+
+        self.assertCounters(0, 0, 0)
+        self.assertEqual(Book.objects.get().inventory, 21)
+
+    def test_return_overdue_borrowing(self):
+        Book.reserve(self.book.id)
+        borrowing = self.borrow(self.today + datetime.timedelta(days=7))
+        Borrowing.objects.filter(pk=borrowing.pk).update(
+            expected_return_date=self.today - datetime.timedelta(days=1)
+        )
+        refresh_overdue_loans()
+        self.assertCounters(1, 1, 1)
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        client.put(f"/api/library/borrowings/{borrowing.id}/")
+
+        self.assertCounters(0, 0, 1)
+
+    def test_reconcile_repairs_drift(self):
+        self.borrow(self.today + datetime.timedelta(days=7))
+        self.borrow(self.today - datetime.timedelta(days=1))
+        self.borrow(self.today, returned=True)
+        other = sample_book(title="Idle thoughts of an idle fellow")
+
+        self.assertEqual(reconcile(dry_run=True), 1)
+        self.assertCounters(0, 0, 0)
+
+        self.assertEqual(reconcile(batch_size=1), 1)
+        self.assertCounters(2, 1, 3)
+        other.refresh_from_db()
+        self.assertEqual(other.total_loans, 0)
+        self.assertEqual(reconcile(), 0)
+
+    def test_refresh_overdue_only(self):
+        self.borrow(self.today - datetime.timedelta(days=1))
+
+        self.assertEqual(refresh_overdue_loans(), 1)
+
+        self.assertCounters(0, 1, 0)
+
+    def test_command(self):
+        self.borrow(self.today + datetime.timedelta(days=7))
+        out = StringIO()
+
+        call_command("reconcile_book_counters", "--dry-run", stdout=out)
+        call_command("reconcile_book_counters", stdout=out)
+
+        self.assertEqual(out.getvalue(), "1 books drifted\n1 books repaired\n")
+        self.assertCounters(1, 0, 1)
+
+    def test_refresh_runs_at_midnight_of_time_zone(self):
+        schedule = settings.CELERY_BEAT_SCHEDULE["refresh-overdue-loans"]["schedule"]
+
+        self.assertEqual(str(schedule.tz), settings.TIME_ZONE)
+        self.assertEqual((schedule.hour, schedule.minute), ({0}, {5}))
@@ -0,0 +1,114 @@
+import datetime
+import unittest
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count, F, Sum
+from django.test import TestCase
+from library.datagen import CopyWriter, DataGenerator, InsertWriter, copy_value
+from library.models import Book, Borrowing, Payment
+
+
+class DataGeneratorTest(TestCase):
+    def generate(self, writer):
+        generator = DataGenerator(
+            writer, batch_size=70, overdue_ratio=0.2, active_ratio=0.2, seed=1
+        )
+        return generator.generate(users=100, books=30, borrowings=200)
+
+    def assertGenerated(self, created):
+        self.assertEqual(get_user_model().objects.count(), 100)
+        self.assertEqual(Book.objects.count(), 30)
+        self.assertEqual(Borrowing.objects.count(), 200)
+        returned = Borrowing.objects.filter(actual_return_date__isnull=False)
+        self.assertEqual(Payment.objects.count(), returned.count())
+        self.assertEqual(created["payments"], returned.count())
+
+        overdue = Borrowing.objects.filter(
+            actual_return_date=None, expected_return_date__lt=datetime.date.today()
+        ).count()
+        self.assertTrue(10 < overdue < 80, overdue)
+        self.assertFalse(returned.filter(is_active=True).exists())
+        self.assertEqual(Book.objects.aggregate(total=Sum("total_loans"))["total"], 200)
+        self.assertOpenLoansAllowed()
+
+        # the sequences moved past the generated ids
+        Book.objects.create(
+            title="Three men in a boat",
+            author="Jerome K. Jerome",
+            cover="SOFT",
+            inventory=20,
+            daily_fee=0.15,
+        )
+
+    def assertOpenLoansAllowed(self):
+        """At most one loan out per user, and the copies out came off the
+        inventory generated for each book (1 to 20)"""
+        self.assertFalse(
+            Borrowing.objects.filter(actual_return_date=None)
+            .values("user")
+            .annotate(loans=Count("id"))
+            .filter(loans__gt=1)
+            .exists()
+        )
+        self.assertFalse(
+            Book.objects.annotate(owned=F("inventory") + F("active_loans"))
+            .exclude(owned__range=(1, 20))
+            .exists()
+        )
+
+    def test_insert(self):
+        self.assertGenerated(self.generate(InsertWriter()))
+
+    @unittest.skipUnless(connection.vendor == "postgresql", "COPY is PostgreSQL")
+    def test_copy(self):
+        self.assertGenerated(self.generate(CopyWriter()))
+
+    def test_borrowings_of_existing_rows(self):
+        self.generate(InsertWriter())
+
+        DataGenerator(InsertWriter(), seed=2).generate(borrowings=50)
+
+        self.assertEqual(Borrowing.objects.count(), 250)
+        self.assertOpenLoansAllowed()
+
+    def test_existing_ids_in_order(self):
+        self.generate(InsertWriter())
+        # An updated row moves to the end of the table
+        first = Book.objects.order_by("id").first()
+        Book.objects.filter(pk=first.pk).update(title="Moved")
+
+        ids = DataGenerator.ids(Book, None, 0)
+
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(ids[0], first.id)
+
+    def test_hot_books(self):
+        generator = DataGenerator(InsertWriter(), hot_books=0.1, hot_share=0.8, seed=1)
+        generator.generate(users=5, books=100, borrowings=500)
+
+        hot = Book.objects.order_by("id")[:10]
+        self.assertGreater(Borrowing.objects.filter(book__in=hot).count(), 350)
+
+    def test_copy_value(self):
+        self.assertEqual(copy_value(None), "\\N")
+        self.assertEqual(copy_value(True), "t")
+        self.assertEqual(copy_value(datetime.date(2023, 5, 1)), "2023-05-01")
+        self.assertEqual(copy_value("a\tb\\"), "a\\tb\\\\")
+
+    def test_command(self):
+        out = StringIO()
+
+        call_command(
+            "generate_data",
+            "--users=3",
+            "--books=3",
+            "--borrowings=10",
+            "--seed=1",
+            stdout=out,
+        )
+
+        self.assertIn("10 borrowings", out.getvalue())
+        self.assertEqual(Borrowing.objects.count(), 10)
@@ -0,0 +1,149 @@
+import datetime
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.urls import reverse
+from library.fees import accrued_fees
+from library.models import BookDebt, Borrowing, UserDebt
+from library.tasks import refresh_debts
+from library.tests.utils import sample_book
+from rest_framework import status
+from rest_framework.test import APIClient
+
+USER_DEBTS_URL = reverse("library:userdebt-list")
+
+TODAY = datetime.date.today()
+
+
+class DebtViewTest(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email="123@test.com", password="123test"
+        )
+        self.other_user = get_user_model().objects.create_user(
+            email="456@test.com", password="123test"
+        )
+        self.book = sample_book(daily_fee=Decimal("1"))
+        self.other_book = sample_book(daily_fee=Decimal("0.25"))
+        self.loan(self.user, self.book, borrowed=10, expected=5)
+        self.loan(self.user, self.other_book, borrowed=3, expected=-4)
+        self.loan(self.other_user, self.other_book, borrowed=1, expected=-6)
+        self.loan(self.other_user, self.book, borrowed=30, expected=20, returned=True)
+
+    def loan(self, user, book, borrowed, expected, returned=False):
+        """Borrowed ``borrowed`` days ago, expected back ``expected`` days ago"""
+        borrowing = Borrowing.objects.create(
+            user=user, book=book, expected_return_date=TODAY
+        )
+        Borrowing.objects.filter(pk=borrowing.pk).update(
+            borrow_date=TODAY - datetime.timedelta(borrowed),
+            expected_return_date=TODAY - datetime.timedelta(expected),
+            actual_return_date=TODAY if returned else None,
+        )
+
+    def assertDebt(self, debt, open_loans, overdue_loans, accrued, fines):
+        self.assertEqual(
+            (debt.open_loans, debt.overdue_loans, debt.accrued, debt.fines),
+            (open_loans, overdue_loans, Decimal(accrued), Decimal(fines)),
+        )
+
+    def test_debts(self):
+        refresh_debts()
+
+        # 5 days, then 5 late days at twice the fee; and 3 days at 0.25
+        self.assertDebt(UserDebt.objects.get(user=self.user), 2, 1, "15.75", "10")
+        # The minimum charge; the returned loan is paid for already
+        self.assertDebt(UserDebt.objects.get(user=self.other_user), 1, 0, "0.5", "0")
+        self.assertDebt(BookDebt.objects.get(book=self.book), 1, 1, "15", "10")
+        self.assertDebt(BookDebt.objects.get(book=self.other_book), 2, 0, "1.25", "0")
+
+    def test_matches_fee_engine(self):
+        refresh_debts()
+
+        for user in (self.user, self.other_user):
+            debt = UserDebt.objects.get(user=user)
+            fees = accrued_fees(Borrowing.objects.filter(user=user))
+            self.assertEqual((debt.accrued, debt.fines), (fees["total"], fees["fines"]))
+        for book in (self.book, self.other_book):
+            debt = BookDebt.objects.get(book=book)
+            fees = accrued_fees(Borrowing.objects.filter(book=book))
+            self.assertEqual((debt.accrued, debt.fines), (fees["total"], fees["fines"]))
+
+    def test_refresh(self):
+        refresh_debts()
+        Borrowing.objects.filter(user=self.other_user).update(actual_return_date=TODAY)
+
+        self.assertTrue(UserDebt.objects.filter(user=self.other_user).exists())
+
+        refresh_debts()
+
+        self.assertFalse(UserDebt.objects.filter(user=self.other_user).exists())
+
+    def test_refresh_keeps_unchanged_rows(self):
+        refresh_debts()
+        refreshed_at = UserDebt.objects.get(user=self.user).refreshed_at
+
+        rows = self.row_locations()
+        refresh_debts()
+
+        self.assertEqual(self.row_locations(), rows)
+        self.assertGreater(
+            UserDebt.objects.get(user=self.user).refreshed_at, refreshed_at
+        )
+
+    def row_locations(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT user_id, ctid FROM library_user_debt ORDER BY 1")
+            return cursor.fetchall()
+
+
+class DebtApiTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = get_user_model().objects.create_superuser(
+            email="admin@test.com", password="123test"
+        )
+        self.client.force_authenticate(self.admin)
+        self.users = [
+            get_user_model().objects.create_user(
+                email=f"{i}@test.com", password="123test"
+            )
+            for i in range(3)
+        ]
+        book = sample_book(daily_fee=Decimal("1"))
+        for days, user in enumerate(self.users, 1):
+            borrowing = Borrowing.objects.create(
+                user=user, book=book, expected_return_date=TODAY
+            )
+            Borrowing.objects.filter(pk=borrowing.pk).update(
+                borrow_date=TODAY - datetime.timedelta(days)
+            )
+        refresh_debts()
+
+    def test_list_by_debt(self):
+        res = self.client.get(USER_DEBTS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [debt["user"] for debt in res.data["results"]],
+            [user.id for user in reversed(self.users)],
+        )
+
+    def test_lookup(self):
+        with self.assertNumQueries(1):
+            res = self.client.get(
+                reverse("library:userdebt-detail", args=[self.users[1].id])
+            )
+
+        self.assertEqual(res.data["accrued"], "2.000")
+        self.assertEqual(res.data["open_loans"], 1)
+        self.assertIsNotNone(res.data["refreshed_at"])
+
+    def test_requires_admin(self):
+        self.client.force_authenticate(self.users[0])
+
+        res = self.client.get(USER_DEBTS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
@@ -0,0 +1,146 @@
+import datetime
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from hypothesis import given, settings, strategies as st
+from hypothesis.extra.django import TestCase as HypothesisTestCase
+from library.fees import MINIMUM_CHARGE, accrued_fees, fee, fee_expression
+from library.models import Borrowing
+from library.tests.utils import sample_book
+
+TODAY = datetime.date.today()
+
+daily_fees = st.decimals(
+    min_value=Decimal("0.001"), max_value=Decimal("999.999"), places=3
+)
+loans = st.tuples(
+    st.integers(min_value=0, max_value=400),  # days since borrowed
+    st.integers(min_value=0, max_value=60),  # days the loan was for
+    daily_fees,
+)
+
+
+class FeeTest(TestCase):
+    def test_fee(self):
+        borrow_date = datetime.date(2023, 7, 1)
+        expected = datetime.date(2023, 7, 5)
+
+        self.assertEqual(
+            fee(borrow_date, expected, datetime.date(2023, 7, 4), Decimal("0.5")),
+            Decimal("1.5"),
+        )
+        # 4 days, then 2 late days at twice the fee
+        self.assertEqual(
+            fee(borrow_date, expected, datetime.date(2023, 7, 7), Decimal("0.5")),
+            Decimal("4"),
+        )
+        self.assertEqual(
+            fee(borrow_date, expected, borrow_date, Decimal("0.5")), MINIMUM_CHARGE
+        )
+
+    @override_settings(FINE_MULTIPLIER=3)
+    def test_fine_multiplier_setting(self):
+        self.assertEqual(
+            fee(
+                datetime.date(2023, 7, 1),
+                datetime.date(2023, 7, 2),
+                datetime.date(2023, 7, 3),
+                Decimal("1"),
+            ),
+            Decimal("4"),
+        )
+
+    def test_accrued_fees(self):
+        user = get_user_model().objects.create_user(
+            email="123@test.com", password="123test"
+        )
+        book = sample_book(daily_fee=Decimal("1"))
+        borrowings = [
+            Borrowing.objects.create(
+                user=user, book=book, expected_return_date=TODAY + delta
+            )
+            for delta in (datetime.timedelta(1), datetime.timedelta(1))
+        ]
+        Borrowing.objects.filter(pk=borrowings[0].pk).update(
+            borrow_date=TODAY - datetime.timedelta(10),
+            expected_return_date=TODAY - datetime.timedelta(5),
+        )
+        Borrowing.objects.filter(pk=borrowings[1].pk).update(actual_return_date=TODAY)
+
+        with self.assertNumQueries(1):
+            totals = accrued_fees(Borrowing.objects.all())
+
+        # 5 days, then 5 late days at twice the fee
+        self.assertEqual(
+            totals,
+            {
+                "loans": 1,
+                "total": Decimal("15"),
+                "fines": Decimal("10"),
+                "overdue": Decimal("15"),
+            },
+        )
+
+
+class FeeExpressionPropertyTest(HypothesisTestCase):
+    """The SQL expression charges exactly what pay_money() does"""
+
+    def create_loans(self, loans, returned_after=None):
+        user = get_user_model().objects.create(email="123@test.com")
+        borrowings = []
+        for borrowed_days_ago, loan_days, daily_fee in loans:
+            borrow_date = TODAY - datetime.timedelta(borrowed_days_ago)
+            borrowing = Borrowing.objects.create(
+                user=user,
+                book=sample_book(daily_fee=daily_fee),
+                expected_return_date=TODAY,
+            )
+            borrowing.borrow_date = borrow_date
+            borrowing.expected_return_date = borrow_date + datetime.timedelta(loan_days)
+            if returned_after is not None:
+                borrowing.actual_return_date = borrow_date + datetime.timedelta(
+                    returned_after
+                )
+            borrowings.append(borrowing)
+        Borrowing.objects.bulk_update(
+            borrowings, ["borrow_date", "expected_return_date", "actual_return_date"]
+        )
+        return borrowings
+
+    @settings(max_examples=50, deadline=None)
+    @given(st.lists(loans, min_size=1, max_size=10))
+    def test_open_loans_match_pay_money(self, loans):
+        self.create_loans(loans)
+
+        charged = dict(
+            Borrowing.objects.annotate(fee=fee_expression(TODAY)).values_list(
+                "id", "fee"
+            )
+        )
+
+        for borrowing in Borrowing.objects.select_related("book"):
+            self.assertEqual(charged[borrowing.id], borrowing.pay_money())
+
+    @settings(max_examples=50, deadline=None)
+    @given(
+        st.lists(loans, min_size=1, max_size=10),
+        st.integers(min_value=0, max_value=120),
+    )
+    def test_returned_loans_match_fee(self, loans, returned_after):
+        borrowings = self.create_loans(loans, returned_after)
+
+        charged = dict(
+            Borrowing.objects.annotate(fee=fee_expression()).values_list("id", "fee")
+        )
+
+        for borrowing in borrowings:
+            self.assertEqual(
+                charged[borrowing.id],
+                fee(
+                    borrowing.borrow_date,
+                    borrowing.expected_return_date,
+                    borrowing.actual_return_date,
+                    borrowing.book.daily_fee,
+                ),
+            )
@@ -0,0 +1,144 @@
+import datetime
+import unittest
+
+from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchQuery
+from django.db import connection
+from django.db.models import F, Value
+from django.db.models.lookups import LessThan
+from django.test import TestCase
+from library.models import Book, Borrowing, Payment
+from library.pagination import BorrowingPagination, Row
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "EXPLAIN output is PostgreSQL")
+class IndexUsageTest(TestCase):
+    """The tables are tiny in tests, so sequential scans are switched off
+    to see which index the planner picks for each hot query."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            email="123@test.com", password="123test"
+        )
+        book = Book.objects.create(
+            title="Three men in a boat",
+            author="Jerome K. Jerome",
+            cover="SOFT",
+            inventory=20,
+            daily_fee=0.15,
+        )
+        borrowing = Borrowing.objects.create(
+            expected_return_date=datetime.date.today() + datetime.timedelta(days=7),
+            book=book,
+            user=cls.user,
+        )
+        Payment.objects.create(
+            status=Payment.StatusChoices.PENDING,
+            type=Payment.TypeChoices.PAYMENT,
+            borrowing=borrowing,
+            session_id="cs_test_1",
+        )
+
+        # Enough other rows, analyzed, that the planner does not pick between
+        # indexes by chance, whatever statistics other tests left behind
+        other_user = get_user_model().objects.create_user(
+            email="456@test.com", password="123test"
+        )
+        books = Book.objects.bulk_create(
+            Book(
+                title=f"Book {i}",
+                author="Author",
+                cover="SOFT",
+                inventory=0,
+                daily_fee=i + 2,
+            )
+            for i in range(200)
+        )
+        Borrowing.objects.bulk_create(
+            Borrowing(
+                expected_return_date=datetime.date.today(),
+                actual_return_date=datetime.date.today(),
+                is_active=False,
+                book=book,
+                user=cls.user if i % 10 == 0 else other_user,
+            )
+            for i, book in enumerate(books)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE library_book, library_borrowing, library_payment")
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+        self.assertNotIn("Seq Scan", plan)
+
+    def test_payment_by_session_id(self):
+        self.assertUsesIndex(
+            Payment.objects.filter(session_id="cs_test_1"), "payment_session_idx"
+        )
+
+    def test_overdue_borrowings(self):
+        self.assertUsesIndex(
+            Borrowing.objects.filter(
+                expected_return_date__lt=datetime.date.today()
+            ).filter(actual_return_date=None),
+            "borrowing_overdue_idx",
+        )
+
+    def test_active_borrowings_of_user(self):
+        self.assertUsesIndex(
+            Borrowing.objects.filter(is_active=True).filter(user_id=self.user.id),
+            "borrowing_user_active_idx",
+        )
+
+    def test_borrowing_history_of_user(self):
+        # A bitmap scan and a sort of a few rows costs about the same
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_bitmapscan = off")
+        self.assertUsesIndex(
+            Borrowing.objects.filter(user=self.user).order_by("-borrow_date", "-id")[
+                :10
+            ],
+            "borrowing_user_history_idx",
+        )
+
+    def test_borrowing_keyset_page(self):
+        pagination = BorrowingPagination().get_paginator("cursor")
+        cursor = pagination.encode_cursor(Borrowing.objects.get(is_active=True))
+        values = pagination.decode_cursor(cursor, Borrowing)
+
+        self.assertUsesIndex(
+            Borrowing.objects.filter(
+                LessThan(Row(F("borrow_date"), F("id")), Row(*map(Value, values)))
+            ).order_by("-borrow_date", "-id")[:10],
+            "borrowing_history_idx",
+        )
+
+    def test_book_search(self):
+        self.assertUsesIndex(
+            Book.objects.filter(search_vector=SearchQuery("boat", config="english")),
+            "book_search_idx",
+        )
+
+    def test_available_books(self):
+        self.assertUsesIndex(
+            Book.objects.filter(inventory__gt=0).order_by("id")[:10],
+            "book_available_idx",
+        )
+
+    def test_books_by_cover_and_fee(self):
+        self.assertUsesIndex(
+            Book.objects.filter(cover="HARD", daily_fee__lte=1),
+            "book_cover_fee_idx",
+        )
+
+    def test_books_by_fee(self):
+        self.assertUsesIndex(
+            Book.objects.filter(daily_fee__gte=1, daily_fee__lte=2),
+            "book_daily_fee_idx",
+        )
@@ -0,0 +1,62 @@
+import threading
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from library.models import Book
+from library.tests.utils import sample_book
+
+
+class BookReserveTest(TestCase):
+    def test_reserve_decrements_inventory(self):
+        book = sample_book(inventory=2)
+
+        with self.assertNumQueries(1):
+            self.assertTrue(Book.reserve(book.id))
+
+        book.refresh_from_db()
+        self.assertEqual(book.inventory, 1)
+
+    def test_reserve_out_of_stock(self):
+        book = sample_book(inventory=0)
+
+        self.assertFalse(Book.reserve(book.id))
+        book.refresh_from_db()
+        self.assertEqual(book.inventory, 0)
+
+    def test_reserve_missing_book(self):
+        self.assertFalse(Book.reserve(0))
+
+
+class BookReserveConcurrencyTest(TransactionTestCase):
+    threads = 16
+    attempts_per_thread = 5
+
+    def test_concurrent_reserve_never_oversells(self):
+        inventory = 30
+        book = sample_book(inventory=inventory)
+        results = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(self.threads)
+
+        def worker():
+            barrier.wait()
+            try:
+                for _ in range(self.attempts_per_thread):
+                    reserved = Book.reserve(book.id)
+                    with lock:
+                        results.append(reserved)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        book.refresh_from_db()
+        self.assertEqual(results.count(True), inventory)
+        self.assertEqual(
+            results.count(False), self.threads * self.attempts_per_thread - inventory
+        )
+        self.assertEqual(book.inventory, 0)
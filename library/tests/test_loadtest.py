@@ -0,0 +1,103 @@
+import httpx
+from django.contrib.auth import get_user_model
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections
+from django.test import SimpleTestCase, TestCase, override_settings
+from library.loadtest import LoadTest, compare, percentile
+from library.models import Book, Borrowing, Payment
+from library.outbox import OutboxRelay
+from library.stripe import WebhookProcessor
+
+FAKE_BACKENDS = {
+    "PAYMENT_GATEWAY": {"BACKEND": "library.payments.FakeGateway"},
+    "NOTIFICATION_TRANSPORT": {"BACKEND": "library.notifications.FakeTransport"},
+}
+
+
+class InProcessLoadTest(LoadTest):
+    """The relay runs right away instead of in Celery beat"""
+
+    def wait_for_session(self, user, payment_id):
+        OutboxRelay().relay()
+        return super().wait_for_session(user, payment_id)
+
+
+class StatisticsTest(SimpleTestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile([3], 99), 3)
+        self.assertIsNone(percentile([], 50))
+
+    def test_compare(self):
+        baseline = {
+            "rps": 100,
+            "scenarios": {"browse": {"p95_ms": 10, "errors": 0}},
+        }
+        report = {
+            "rps": 70,
+            "scenarios": {
+                "browse": {"p95_ms": 13, "errors": 1},
+                "token": {"p95_ms": 200, "errors": 0},
+            },
+        }
+
+        self.assertEqual(compare(baseline, baseline), [])
+        self.assertEqual(len(compare(report, baseline, tolerance=0.2)), 3)
+        self.assertEqual(len(compare(report, baseline, tolerance=0.5)), 1)
+
+
+@override_settings(**FAKE_BACKENDS, STRIPE_WEBHOOK_SECRET="whsec_test")
+class LoadTestRunTest(TestCase):
+    def setUp(self):
+        # Keep the test transaction open across the in-process requests
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        self.addCleanup(request_started.connect, close_old_connections)
+        self.addCleanup(request_finished.connect, close_old_connections)
+
+        get_user_model().objects.create_user(
+            email="loadtest@test.com", password="12345test"
+        )
+        Book.objects.create(
+            title="Three men in a boat",
+            author="Jerome K. Jerome",
+            cover="SOFT",
+            inventory=20,
+            daily_fee=0.15,
+        )
+
+    def test_loan_scenario(self):
+        load_test = InProcessLoadTest(
+            "http://testserver",
+            [("loadtest@test.com", "12345test")],
+            concurrency=1,
+            iterations=3,
+            mix={"loan": 1},
+            transport=httpx.WSGITransport(app=WSGIHandler()),
+            webhook_secret="whsec_test",
+        )
+
+        report = load_test.run()
+        WebhookProcessor().process()
+
+        self.assertEqual(report["errors"], 0)
+        self.assertEqual(
+            {name: stats["count"] for name, stats in report["scenarios"].items()},
+            {
+                "token": 1,
+                "browse": 3,
+                "checkout": 3,
+                "return": 3,
+                "payment": 3,
+                "webhook": 3,
+                "payment_success": 3,
+            },
+        )
+        self.assertEqual(Borrowing.objects.filter(is_active=False).count(), 3)
+        self.assertEqual(
+            Payment.objects.filter(status=Payment.StatusChoices.PAID).count(), 3
+        )
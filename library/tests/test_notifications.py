@@ -0,0 +1,195 @@
+from unittest.mock import Mock
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from library.models import Notification, RateLimit
+from library.notifications import (
+    FakeTransport,
+    NotificationDispatcher,
+    RateLimiter,
+    coalesce,
+    get_transport,
+    notify,
+    split_text,
+)
+from library.tasks import dispatch_notifications
+
+FAKE_TRANSPORT = {"BACKEND": "library.notifications.FakeTransport", "OPTIONS": {}}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class RateLimiterTest(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def limiter(self):
+        return RateLimiter(
+            "test", rate=2, capacity=3, clock=self.clock, sleep=self.clock.sleep
+        )
+
+    def test_burst_then_wait_for_each_token(self):
+        limiter = self.limiter()
+
+        for _ in range(5):
+            limiter.acquire()
+
+        self.assertEqual(self.clock.slept, [0.5, 0.5])
+
+    def test_limit_is_shared_between_instances(self):
+        for _ in range(3):
+            self.limiter().acquire()
+
+        self.limiter().acquire()
+
+        self.assertEqual(self.clock.slept, [0.5])
+
+    def test_refill_stops_at_capacity(self):
+        limiter = self.limiter()
+        for _ in range(3):
+            limiter.acquire()
+        self.clock.now += 60
+
+        for _ in range(4):
+            limiter.acquire()
+
+        self.assertEqual(self.clock.slept, [0.5])
+        self.assertEqual(RateLimit.objects.get(key="test").tokens, 0)
+
+    def test_no_second_burst_across_a_second(self):
+        limiter = self.limiter()
+        self.clock.now = 0.75
+
+        for _ in range(6):
+            limiter.acquire()
+
+        # 3 at once, then one every half second
+        self.assertEqual(self.clock.slept, [0.5, 0.5, 0.5])
+
+
+class CoalesceTest(TestCase):
+    def test_joins_messages_per_chat(self):
+        notifications = [
+            Mock(id=1, chat_id="1", parse_mode="", text="a"),
+            Mock(id=2, chat_id="2", parse_mode="", text="b"),
+            Mock(id=3, chat_id="1", parse_mode="", text="c"),
+            Mock(id=4, chat_id="1", parse_mode="html", text="d"),
+        ]
+
+        messages = coalesce(notifications)
+
+        self.assertEqual(
+            [(m["chat_id"], m["text"], m["ids"]) for m in messages],
+            [("1", "a\n\nc", [1, 3]), ("2", "b", [2]), ("1", "d", [4])],
+        )
+
+    def test_splits_long_notifications(self):
+        text = "a" * 6 + "\n" + "b" * 6 + "c" * 10
+        notifications = [Mock(id=1, chat_id="1", parse_mode="", text=text)]
+
+        messages = coalesce(notifications, limit=10)
+
+        self.assertEqual(
+            [(m["text"], m["sent"]) for m in messages],
+            [("aaaaaa", []), ("b" * 6 + "c" * 4, []), ("c" * 6, [1])],
+        )
+        self.assertEqual(split_text("short", limit=10), ["short"])
+
+    def test_respects_message_limit(self):
+        notifications = [
+            Mock(id=i, chat_id="1", parse_mode="", text="x" * 6) for i in range(3)
+        ]
+
+        messages = coalesce(notifications, limit=14)
+
+        self.assertEqual([m["ids"] for m in messages], [[0, 1], [2]])
+
+
+class NotificationDispatcherTest(TestCase):
+    def setUp(self):
+        self.transport = FakeTransport()
+        self.dispatcher = NotificationDispatcher(self.transport, batch_size=3)
+
+    def test_dispatch_coalesces_and_marks_sent(self):
+        for i in range(5):
+            notify(f"message {i}")
+
+        self.assertEqual(self.dispatcher.dispatch(), 5)
+
+        self.assertEqual(len(self.transport.sent), 2)
+        self.assertEqual(
+            self.transport.sent[0][1], "message 0\n\nmessage 1\n\nmessage 2"
+        )
+        self.assertFalse(Notification.objects.filter(sent_at=None).exists())
+        self.assertEqual(self.dispatcher.dispatch(), 0)
+
+    def test_sends_outside_the_claim_transaction(self):
+        notify("message")
+        atomic_blocks = len(connection.atomic_blocks)
+        states = []
+
+        def send(chat_id, text, parse_mode=""):
+            notification = Notification.objects.get()
+            states.append(
+                (len(connection.atomic_blocks), notification.claimed_at is not None)
+            )
+
+        self.transport.send = send
+        self.dispatcher.dispatch()
+
+        self.assertEqual(states, [(atomic_blocks, True)])
+        self.assertIsNone(Notification.objects.get().claimed_at)
+
+    def test_claimed_notifications_are_skipped_until_the_lease_ends(self):
+        notify("message")
+        self.dispatcher.claim()
+
+        self.assertEqual(self.dispatcher.dispatch(), 0)
+
+        self.dispatcher.lease = -self.dispatcher.lease
+        self.assertEqual(self.dispatcher.dispatch(), 1)
+
+    def test_long_notification_is_sent_in_parts(self):
+        notify("x" * 5000)
+
+        self.assertEqual(self.dispatcher.dispatch(), 1)
+
+        self.assertEqual([len(sent[1]) for sent in self.transport.sent], [4096, 904])
+        self.assertFalse(Notification.objects.filter(sent_at=None).exists())
+
+    def test_failed_message_stays_queued(self):
+        notify("message")
+        self.transport.send = Mock(side_effect=ConnectionError)
+
+        with self.assertRaises(ConnectionError):
+            self.dispatcher.dispatch()
+
+        notification = Notification.objects.get()
+        self.assertIsNone(notification.sent_at)
+        self.assertIsNone(notification.claimed_at)
+        self.assertEqual(notification.attempts, 1)
+
+    def test_gives_up_after_max_attempts(self):
+        notify("message")
+        Notification.objects.update(attempts=self.dispatcher.max_attempts)
+
+        self.assertEqual(self.dispatcher.dispatch(), 0)
+
+    @override_settings(NOTIFICATION_TRANSPORT=FAKE_TRANSPORT)
+    def test_dispatch_notifications_task(self):
+        notify("message", parse_mode="html")
+
+        self.assertEqual(dispatch_notifications(), 1)
+
+        self.assertEqual(get_transport().sent[0][1:], ("message", "html"))
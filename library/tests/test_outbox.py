@@ -0,0 +1,191 @@
+import asyncio
+import datetime
+import json
+import threading
+import time
+from unittest.mock import AsyncMock, Mock
+
+import httpx
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from library.models import Borrowing, Notification, Outbox, Payment
+from library.outbox import OutboxRelay, publish
+from library.payments import get_gateway
+from library.tasks import relay_outbox
+from library.tests.utils import sample_book
+
+
+class LoopBoundTransport(httpx.AsyncBaseTransport):
+    """Like a connection pool, usable only on the event loop that opened it"""
+
+    def __init__(self):
+        self.loop = None
+
+    async def handle_async_request(self, request):
+        loop = asyncio.get_running_loop()
+        if self.loop not in (None, loop):
+            raise RuntimeError("Event loop is closed")
+        self.loop = loop
+        session_id = f"cs_{request.headers['Idempotency-Key']}"
+        return httpx.Response(
+            200,
+            content=json.dumps({"id": session_id, "url": f"https://pay/{session_id}"}),
+        )
+
+    async def aclose(self):
+        self.loop = None
+
+
+class OutboxRelayTest(TestCase):
+    def test_borrowing_created_queues_notification(self):
+        user = get_user_model().objects.create_user(
+            email="123@test.com", password="123test"
+        )
+        book = sample_book()
+        borrowing = Borrowing.objects.create(
+            expected_return_date=datetime.date(2030, 1, 1), book=book, user=user
+        )
+        publish(
+            Outbox.TopicChoices.BORROWING_CREATED,
+            borrowing_id=borrowing.id,
+            user_id=user.id,
+            book_id=book.id,
+            title=book.title,
+            expected_return_date=borrowing.expected_return_date,
+        )
+
+        self.assertEqual(relay_outbox(), 1)
+
+        self.assertIn(
+            "expected_return_date - 2030-01-01", Notification.objects.get().text
+        )
+        self.assertIsNotNone(Outbox.objects.get().processed_at)
+        self.assertEqual(relay_outbox(), 0)
+
+    def test_failed_event_is_retried(self):
+        handler = Mock(side_effect=[ConnectionError, None])
+        relay = OutboxRelay(handlers={"test": handler})
+        Outbox.objects.create(topic="test", payload={})
+
+        self.assertEqual(relay.relay(), 0)
+        self.assertEqual(Outbox.objects.get().attempts, 1)
+        self.assertEqual(relay.relay(), 1)
+        self.assertEqual(handler.call_count, 2)
+
+    def test_gives_up_after_max_attempts(self):
+        handler = Mock()
+        Outbox.objects.create(topic="test", payload={}, attempts=3)
+
+        self.assertEqual(OutboxRelay({"test": handler}, max_attempts=3).relay(), 0)
+        handler.assert_not_called()
+
+    def test_failed_async_event_is_retried(self):
+        handler = AsyncMock(side_effect=[ConnectionError, None])
+        relay = OutboxRelay(handlers={"test": handler})
+        Outbox.objects.create(topic="test", payload={})
+
+        self.assertEqual(relay.relay(), 0)
+        self.assertEqual(Outbox.objects.get().attempts, 1)
+        self.assertEqual(relay.relay(), 1)
+
+    def request_payments(self, count):
+        user = get_user_model().objects.create_user(
+            email="123@test.com", password="123test"
+        )
+        borrowing = Borrowing.objects.create(
+            expected_return_date=datetime.date(2030, 1, 1),
+            book=sample_book(),
+            user=user,
+        )
+        for _ in range(count):
+            payment = Payment.objects.create(
+                status=Payment.StatusChoices.PENDING,
+                type=Payment.TypeChoices.PAYMENT,
+                borrowing=borrowing,
+            )
+            publish(
+                Outbox.TopicChoices.PAYMENT_REQUESTED,
+                payment_id=payment.id,
+                amount="1.50",
+                name="Three men in a boat",
+                success_url="http://testserver/success",
+                cancel_url="http://testserver/cancel",
+            )
+
+    @override_settings(
+        PAYMENT_GATEWAY={
+            "BACKEND": "library.payments.FakeGateway",
+            "OPTIONS": {"latency": 0.05},
+        }
+    )
+    def test_payment_sessions_are_created_concurrently(self):
+        self.request_payments(10)
+
+        start = time.perf_counter()
+        self.assertEqual(OutboxRelay(concurrency=10).relay(), 10)
+
+        self.assertLess(time.perf_counter() - start, 10 * 0.05)
+        self.assertEqual(
+            set(Payment.objects.values_list("session_id", flat=True)),
+            set(get_gateway().sessions),
+        )
+
+    @override_settings(PAYMENT_GATEWAY={"BACKEND": "library.payments.FakeGateway"})
+    def test_relaying_again_reuses_the_session(self):
+        self.request_payments(1)
+        OutboxRelay().relay()
+        session_id = Payment.objects.get().session_id
+        # As if the batch had rolled back after Stripe answered
+        Outbox.objects.update(processed_at=None)
+
+        self.assertEqual(OutboxRelay().relay(), 1)
+
+        self.assertEqual(Payment.objects.get().session_id, session_id)
+        self.assertEqual(len(get_gateway().sessions), 1)
+
+    @override_settings(
+        PAYMENT_GATEWAY={
+            "BACKEND": "library.payments.HttpxStripeGateway",
+            "OPTIONS": {"async_transport": LoopBoundTransport()},
+        }
+    )
+    def test_batches_in_a_row_with_pooled_gateway(self):
+        self.request_payments(3)
+
+        self.assertEqual(OutboxRelay(batch_size=2).relay(), 3)
+
+        self.assertFalse(Payment.objects.filter(session_id=None).exists())
+
+
+class ParallelOutboxRelayTest(TransactionTestCase):
+    def test_relays_skip_events_claimed_by_each_other(self):
+        for i in range(4):
+            Outbox.objects.create(topic="test", payload={"i": i})
+        claimed = threading.Event()
+        release = threading.Event()
+        handled = []
+
+        def slow_handler(payload):
+            handled.append(payload["i"])
+            claimed.set()
+            release.wait(5)
+
+        def run_slow_relay():
+            try:
+                OutboxRelay({"test": slow_handler}, batch_size=2).relay_batch()
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=run_slow_relay)
+        thread.start()
+        claimed.wait(5)
+
+        fast = OutboxRelay({"test": lambda payload: handled.append(payload["i"])})
+        self.assertEqual(fast.relay(), 2)
+
+        release.set()
+        thread.join()
+        self.assertEqual(sorted(handled), [0, 1, 2, 3])
+        self.assertFalse(Outbox.objects.filter(processed_at=None).exists())
@@ -0,0 +1,116 @@
+import datetime
+import unittest
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from library.models import Book, Borrowing, Payment
+from rest_framework import status
+from rest_framework.test import APIClient
+
+BORROWING_URL = reverse("library:borrowing-list")
+PAYMENT_URL = reverse("library:payment-list")
+
+
+class PaginationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            email="admin@test.com", password="12345test", is_staff=True
+        )
+        book = Book.objects.create(
+            title="Three men in a boat",
+            author="Jerome K. Jerome",
+            cover="SOFT",
+            inventory=20,
+            daily_fee=0.15,
+        )
+        today = datetime.date.today()
+        for i in range(25):
+            borrowing = Borrowing.objects.create(
+                expected_return_date=today + datetime.timedelta(days=7),
+                book=book,
+                user=cls.user,
+            )
+            Borrowing.objects.filter(pk=borrowing.pk).update(
+                borrow_date=today - datetime.timedelta(days=i % 4)
+            )
+            Payment.objects.create(
+                status=Payment.StatusChoices.PENDING,
+                type=Payment.TypeChoices.PAYMENT,
+                borrowing=borrowing,
+                session_id=f"cs_test_{i}",
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+
+class KeysetPaginationTest(PaginationTestCase):
+    def walk(self, url, params):
+        ids = []
+        res = self.client.get(url, params)
+        while True:
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertNotIn("count", res.data)
+            ids += [row["id"] for row in res.data["results"]]
+            if res.data["next"] is None:
+                return ids
+            with self.assertNumQueries(1):
+                res = self.client.get(res.data["next"])
+
+    def test_borrowings_by_borrow_date_and_id(self):
+        ids = self.walk(BORROWING_URL, {"pagination": "cursor", "page_size": 7})
+
+        expected = Borrowing.objects.order_by("-borrow_date", "-id")
+        self.assertEqual(ids, list(expected.values_list("id", flat=True)))
+
+    def test_payments_by_id(self):
+        ids = self.walk(PAYMENT_URL, {"pagination": "cursor"})
+
+        expected = Payment.objects.order_by("-id")
+        self.assertEqual(ids, list(expected.values_list("id", flat=True)))
+
+    def test_page_numbers_by_default(self):
+        res = self.client.get(BORROWING_URL)
+
+        self.assertEqual(res.data["count"], 25)
+        self.assertFalse(res.data["count_is_estimate"])
+
+    def test_invalid_cursor(self):
+        res = self.client.get(BORROWING_URL, {"cursor": "not a cursor"})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class EstimatedCountTest(PaginationTestCase):
+    def test_count_is_cached_per_filter_set(self):
+        self.client.get(BORROWING_URL)
+
+        with self.assertNumQueries(1):
+            res = self.client.get(BORROWING_URL, {"page": 2})
+        filtered = self.client.get(
+            BORROWING_URL, {"is_active": "true", "user_id": self.user.id}
+        )
+
+        self.assertEqual(res.data["count"], 25)
+        self.assertEqual(filtered.data["count"], 25)
+        self.assertFalse(res.data["count_is_estimate"])
+
+    @unittest.skipUnless(connection.vendor == "postgresql", "reltuples is PostgreSQL")
+    @override_settings(PAGINATION_ESTIMATE_THRESHOLD=10)
+    def test_large_unfiltered_table_is_estimated(self):
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE library_payment")
+
+        res = self.client.get(PAYMENT_URL)
+        filtered = self.client.get(BORROWING_URL, {"overdue": "true"})
+
+        self.assertEqual(res.data["count"], 25)
+        self.assertTrue(res.data["count_is_estimate"])
+        self.assertEqual(filtered.data["count"], 0)
+        self.assertFalse(filtered.data["count_is_estimate"])
@@ -0,0 +1,197 @@
+import asyncio
+from unittest.mock import patch, Mock
+
+import httpx
+from django.test import SimpleTestCase, override_settings
+from library.payments import (
+    FakeGateway,
+    HttpxStripeGateway,
+    StripeGateway,
+    encode_params,
+    get_gateway,
+)
+
+SUCCESS_URL = "http://testserver/api/library/payments/success?session_id=x"
+CANCEL_URL = "http://testserver/api/library/payments/cancel/"
+
+
+class FakeGatewayTest(SimpleTestCase):
+    def test_create_session(self):
+        gateway = FakeGateway()
+        session = gateway.create_session(2.5, "Book", SUCCESS_URL, CANCEL_URL)
+
+        self.assertTrue(session.id.startswith("cs_fake_"))
+        self.assertIn(session.id, session.url)
+        self.assertEqual(
+            gateway.sessions[session.id]["line_items"][0]["price_data"]["unit_amount"],
+            250,
+        )
+
+    def test_acreate_session(self):
+        gateway = FakeGateway()
+        session = asyncio.run(
+            gateway.acreate_session(1, "Book", SUCCESS_URL, CANCEL_URL)
+        )
+
+        self.assertIn(session.id, gateway.sessions)
+
+    def test_same_idempotency_key_same_session(self):
+        gateway = FakeGateway()
+
+        first = gateway.create_session(1, "Book", SUCCESS_URL, CANCEL_URL, "key-1")
+        again = asyncio.run(
+            gateway.acreate_session(1, "Book", SUCCESS_URL, CANCEL_URL, "key-1")
+        )
+
+        self.assertEqual(first, again)
+        self.assertEqual(len(gateway.sessions), 1)
+
+    def test_pay_and_expire_session(self):
+        gateway = FakeGateway()
+        paid = gateway.create_session(1, "Book", SUCCESS_URL, CANCEL_URL)
+        unpaid = gateway.create_session(1, "Book", SUCCESS_URL, CANCEL_URL)
+
+        gateway.pay(paid.id)
+
+        self.assertEqual(gateway.retrieve_session(paid.id).payment_status, "paid")
+        self.assertEqual(gateway.expire_session(unpaid.id).status, "expired")
+        with self.assertRaises(ValueError):
+            gateway.expire_session(paid.id)
+
+    @override_settings(
+        PAYMENT_GATEWAY={"BACKEND": "library.payments.FakeGateway", "OPTIONS": {}}
+    )
+    def test_get_gateway_from_settings(self):
+        self.assertIsInstance(get_gateway(), FakeGateway)
+        self.assertIs(get_gateway(), get_gateway())
+
+
+class StripeGatewayTest(SimpleTestCase):
+    @patch("library.payments.stripe.checkout.Session.create")
+    def test_create_session_passes_api_key(self, session_create_mock):
+        session_create_mock.return_value = Mock(id="cs_1", url="https://stripe/cs_1")
+
+        session = StripeGateway(api_key="sk_test").create_session(
+            5, "Book", SUCCESS_URL, CANCEL_URL
+        )
+
+        self.assertEqual(session.id, "cs_1")
+        self.assertEqual(session_create_mock.call_args.kwargs["api_key"], "sk_test")
+        self.assertIsNone(session_create_mock.call_args.kwargs["idempotency_key"])
+        self.assertEqual(
+            session_create_mock.call_args.kwargs["success_url"], SUCCESS_URL
+        )
+
+
+class HttpxStripeGatewayTest(SimpleTestCase):
+    def setUp(self):
+        self.requests = []
+
+    def handler(self, statuses):
+        statuses = iter(statuses)
+
+        def handle(request):
+            self.requests.append(request)
+            status_code = next(statuses)
+            if status_code != 200:
+                return httpx.Response(status_code, json={"error": {}})
+            return httpx.Response(
+                200,
+                json={
+                    "id": "cs_1",
+                    "url": "https://checkout.stripe.com/cs_1",
+                    "status": "expired" if request.method == "POST" else "open",
+                    "payment_status": "unpaid",
+                },
+            )
+
+        return handle
+
+    def async_handler(self, statuses):
+        handle = self.handler(statuses)
+
+        async def ahandle(request):
+            return handle(request)
+
+        return ahandle
+
+    def test_encode_params(self):
+        self.assertEqual(
+            encode_params({"a": [{"b": 1}], "c": "d"}),
+            [("a[0][b]", 1), ("c", "d")],
+        )
+
+    def test_create_session(self):
+        gateway = HttpxStripeGateway(
+            api_key="sk_test", transport=httpx.MockTransport(self.handler([200]))
+        )
+
+        session = gateway.create_session(5, "Book", SUCCESS_URL, CANCEL_URL)
+
+        self.assertEqual(session.id, "cs_1")
+        request = self.requests[0]
+        self.assertEqual(request.url.path, "/v1/checkout/sessions")
+        self.assertIn(
+            b"line_items%5B0%5D%5Bprice_data%5D%5Bunit_amount%5D=500", request.content
+        )
+
+    def test_retry_reuses_idempotency_key(self):
+        gateway = HttpxStripeGateway(
+            backoff=0, transport=httpx.MockTransport(self.handler([503, 200]))
+        )
+
+        session = gateway.create_session(5, "Book", SUCCESS_URL, CANCEL_URL)
+
+        self.assertEqual(session.id, "cs_1")
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(
+            self.requests[0].headers["Idempotency-Key"],
+            self.requests[1].headers["Idempotency-Key"],
+        )
+
+    def test_passes_idempotency_key(self):
+        gateway = HttpxStripeGateway(transport=httpx.MockTransport(self.handler([200])))
+
+        gateway.create_session(5, "Book", SUCCESS_URL, CANCEL_URL, "key-1")
+
+        self.assertEqual(self.requests[0].headers["Idempotency-Key"], "key-1")
+
+    def test_gives_up_after_retries(self):
+        gateway = HttpxStripeGateway(
+            retries=1,
+            backoff=0,
+            transport=httpx.MockTransport(self.handler([503, 503])),
+        )
+
+        with self.assertRaises(httpx.HTTPStatusError):
+            gateway.create_session(5, "Book", SUCCESS_URL, CANCEL_URL)
+        self.assertEqual(len(self.requests), 2)
+
+    def test_acreate_session(self):
+        gateway = HttpxStripeGateway(
+            backoff=0,
+            async_transport=httpx.MockTransport(self.async_handler([429, 200])),
+        )
+
+        session = asyncio.run(
+            gateway.acreate_session(5, "Book", SUCCESS_URL, CANCEL_URL)
+        )
+
+        self.assertEqual(session.id, "cs_1")
+        self.assertEqual(len(self.requests), 2)
+
+    def test_retrieve_and_expire_session(self):
+        gateway = HttpxStripeGateway(
+            backoff=0, transport=httpx.MockTransport(self.handler([200, 503, 200]))
+        )
+
+        self.assertEqual(gateway.retrieve_session("cs_1").status, "open")
+        self.assertEqual(gateway.expire_session("cs_1").status, "expired")
+        self.assertEqual(
+            [(request.method, request.url.path) for request in self.requests],
+            [
+                ("GET", "/v1/checkout/sessions/cs_1"),
+                ("POST", "/v1/checkout/sessions/cs_1/expire"),
+                ("POST", "/v1/checkout/sessions/cs_1/expire"),
+            ],
+        )
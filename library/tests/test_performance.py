@@ -0,0 +1,177 @@
+import datetime
+import json
+import os
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from library.models import Book, Borrowing, Payment
+from rest_framework import status
+from rest_framework.test import APIClient
+
+ROWS = 1000
+PAGE_SIZES = (1, 10, 100)
+REPEATS = 5
+PASSWORD = "12345test"
+
+
+class EndpointBudgetTest(TestCase):
+    """Query budgets per endpoint, independent of the page size.
+
+    A budget that only holds for small pages means a query per row. Set
+    PERF_REPORT to a file name to also write the timings as JSON, e.g.
+    ``PERF_REPORT=perf_report.json python manage.py test
+    library.tests.test_performance``, and diff the reports of two commits.
+    """
+
+    report = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = get_user_model().objects.create_user(
+            email="admin@test.com", password=PASSWORD, is_staff=True
+        )
+        cls.user = get_user_model().objects.create_user(
+            email="user@test.com", password=PASSWORD
+        )
+        books = Book.objects.bulk_create(
+            Book(
+                title=f"Book {i}",
+                author="Jerome K. Jerome",
+                cover="SOFT",
+                inventory=5,
+                daily_fee=0.15,
+            )
+            for i in range(ROWS)
+        )
+        expected_return_date = datetime.date.today() + datetime.timedelta(days=7)
+        borrowings = Borrowing.objects.bulk_create(
+            Borrowing(
+                book=book,
+                user=cls.user if i % 2 else cls.admin,
+                expected_return_date=expected_return_date,
+            )
+            for i, book in enumerate(books)
+        )
+        Payment.objects.bulk_create(
+            Payment(
+                borrowing=borrowing,
+                status=Payment.StatusChoices.PENDING,
+                type=Payment.TypeChoices.PAYMENT,
+                session_id=f"cs_test_{borrowing.id}",
+                money_to_pay=1,
+            )
+            for borrowing in borrowings
+        )
+        cls.book = books[0]
+        cls.borrowing = borrowings[0]
+        cls.payment = Payment.objects.get(borrowing=cls.borrowing)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        path = os.getenv("PERF_REPORT")
+        if path:
+            with open(path, "w") as report:
+                json.dump({"rows": ROWS, "endpoints": cls.report}, report, indent=2)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def measure(self, name, budget, request):
+        """Run a request REPEATS times against a cold cache and check that
+        none of them runs more than ``budget`` queries"""
+        timings = []
+        for _ in range(REPEATS):
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                res = request()
+                timings.append(time.perf_counter() - start)
+
+            self.assertLess(res.status_code, 300, res.data)
+            self.assertLessEqual(
+                len(queries),
+                budget,
+                "\n".join(query["sql"] for query in queries.captured_queries),
+            )
+
+        self.report[name] = {
+            "queries": len(queries),
+            "budget": budget,
+            "median_ms": round(statistics.median(timings) * 1000, 3),
+            "min_ms": round(min(timings) * 1000, 3),
+        }
+        return res
+
+    def measure_list(self, name, budget, url, **params):
+        for page_size in PAGE_SIZES:
+            with self.subTest(page_size=page_size):
+                res = self.measure(
+                    f"{name}?page_size={page_size}",
+                    budget,
+                    lambda: self.client.get(url, {"page_size": page_size, **params}),
+                )
+                self.assertEqual(len(res.data["results"]), page_size)
+
+    def test_books(self):
+        self.measure_list("books", 2, reverse("library:book-list"))
+        self.measure(
+            "book",
+            1,
+            lambda: self.client.get(
+                reverse("library:book-detail", args=[self.book.id])
+            ),
+        )
+
+    def test_borrowings(self):
+        url = reverse("library:borrowing-list")
+
+        self.measure_list("borrowings", 3, url)
+        self.measure_list("borrowings cursor", 1, url, pagination="cursor")
+        self.measure(
+            "borrowing",
+            1,
+            lambda: self.client.get(
+                reverse("library:borrowing-detail", args=[self.borrowing.id])
+            ),
+        )
+
+    def test_borrowings_of_user(self):
+        self.client.force_authenticate(self.user)
+
+        self.measure_list("borrowings of user", 2, reverse("library:borrowing-list"))
+
+    def test_payments(self):
+        self.measure_list("payments", 3, reverse("library:payment-list"))
+        self.measure(
+            "payment",
+            1,
+            lambda: self.client.get(
+                reverse("library:payment-detail", args=[self.payment.id])
+            ),
+        )
+
+    def test_me(self):
+        self.measure("users/me", 0, lambda: self.client.get(reverse("user:manage")))
+
+    def test_token(self):
+        client = APIClient()
+
+        res = self.measure(
+            "users/token",
+            1,
+            lambda: client.post(
+                reverse("user:token_obtain_pair"),
+                {"email": self.user.email, "password": PASSWORD},
+            ),
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn("access", res.data)
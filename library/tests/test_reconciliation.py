@@ -0,0 +1,101 @@
+import datetime
+import time
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from library.models import Book, Borrowing, Payment
+from library.payments import FakeGateway
+from library.reconciliation import PaymentReconciler
+from library.tasks import reconcile_payments
+
+
+class PaymentReconcilerTest(TestCase):
+    def setUp(self):
+        self.gateway = FakeGateway()
+        user = get_user_model().objects.create_user(
+            email="123@test.com", password="123test"
+        )
+        book = Book.objects.create(
+            title="Three men in a boat",
+            author="Jerome K. Jerome",
+            cover="SOFT",
+            inventory=20,
+            daily_fee=0.15,
+        )
+        self.borrowing = Borrowing.objects.create(
+            expected_return_date=datetime.date.today() + datetime.timedelta(days=7),
+            book=book,
+            user=user,
+        )
+
+    def payment(self, session_id=None, age=datetime.timedelta(0)):
+        if session_id is None:
+            session_id = self.gateway.create_session(
+                1, "Three men in a boat", "http://testserver/", "http://testserver/"
+            ).id
+        return Payment.objects.create(
+            status=Payment.StatusChoices.PENDING,
+            type=Payment.TypeChoices.PAYMENT,
+            borrowing=self.borrowing,
+            session_id=session_id,
+            created_at=timezone.now() - age,
+        )
+
+    def status(self, payment):
+        payment.refresh_from_db()
+        return payment.status
+
+    def test_reconcile(self):
+        paid = self.payment()
+        self.gateway.pay(paid.session_id)
+        shared = self.payment(paid.session_id)
+        fresh = self.payment()
+        stale = self.payment(age=datetime.timedelta(hours=25))
+        unknown = self.payment("cs_unknown")
+
+        report = PaymentReconciler(self.gateway, chunk_size=2).run()
+
+        self.assertEqual(self.status(paid), Payment.StatusChoices.PAID)
+        self.assertEqual(self.status(shared), Payment.StatusChoices.PAID)
+        self.assertEqual(self.status(fresh), Payment.StatusChoices.PENDING)
+        self.assertEqual(self.status(stale), Payment.StatusChoices.EXPIRED)
+        self.assertEqual(self.status(unknown), Payment.StatusChoices.PENDING)
+        self.assertEqual(self.gateway.sessions[stale.session_id]["status"], "expired")
+        self.assertEqual(
+            {key: report[key] for key in ("checked", "paid", "expired", "errors")},
+            {"checked": 5, "paid": 2, "expired": 1, "errors": 1},
+        )
+
+    def test_session_expired_at_stripe(self):
+        payment = self.payment()
+        self.gateway.sessions[payment.session_id]["status"] = "expired"
+
+        report = PaymentReconciler(self.gateway).run()
+
+        self.assertEqual(self.status(payment), Payment.StatusChoices.EXPIRED)
+        self.assertEqual(report["sessions_expired"], 0)
+
+    def test_settled_payments_are_left_alone(self):
+        payment = self.payment()
+        self.gateway.pay(payment.session_id)
+        Payment.objects.filter(pk=payment.pk).update(status=Payment.StatusChoices.PAID)
+
+        report = PaymentReconciler(self.gateway).run()
+
+        self.assertEqual(report["checked"], 0)
+
+    def test_sessions_are_looked_up_concurrently(self):
+        self.gateway.latency = 0.05
+        for _ in range(8):
+            self.payment()
+
+        start = time.perf_counter()
+        report = PaymentReconciler(self.gateway, workers=8).run()
+
+        self.assertEqual(report["checked"], 8)
+        self.assertLess(time.perf_counter() - start, 8 * 0.05)
+
+    @override_settings(PAYMENT_GATEWAY={"BACKEND": "library.payments.FakeGateway"})
+    def test_task(self):
+        self.assertEqual(reconcile_payments()["checked"], 0)
@@ -0,0 +1,150 @@
+import datetime
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from library.models import Book, Borrowing, OverdueReport
+from library.tasks import overdue_chunks, notify_overdue_range, run_sync_with_api
+
+
+class OverdueScanTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = get_user_model().objects.create_user(
+            email="123@test.com", password="123test"
+        )
+        cls.book = Book.objects.create(
+            title="Three men in a boat",
+            author="Jerome K. Jerome",
+            cover="SOFT",
+            inventory=20,
+            daily_fee=0.15,
+        )
+        cls.today = datetime.date.today()
+        Borrowing.objects.bulk_create(
+            [
+                Borrowing(
+                    expected_return_date=cls.today - datetime.timedelta(days=1),
+                    book=cls.book,
+                    user=user,
+                )
+                for _ in range(7)
+            ]
+            + [
+                Borrowing(
+                    expected_return_date=cls.today - datetime.timedelta(days=1),
+                    actual_return_date=cls.today,
+                    book=cls.book,
+                    user=user,
+                ),
+                Borrowing(
+                    expected_return_date=cls.today + datetime.timedelta(days=1),
+                    book=cls.book,
+                    user=user,
+                ),
+            ]
+        )
+
+    def test_overdue_chunks(self):
+        with self.assertNumQueries(3):
+            chunks = list(overdue_chunks(self.today, chunk_size=4))
+
+        self.assertEqual([len(chunk) for chunk in chunks], [4, 3])
+        self.assertEqual(chunks[0][0]["book__title"], self.book.title)
+
+    def test_overdue_chunks_within_range(self):
+        ids = list(
+            Borrowing.objects.filter(actual_return_date=None)
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+
+        chunks = list(overdue_chunks(self.today, 10, after_id=ids[1], last_id=ids[4]))
+
+        self.assertEqual([row["id"] for row in chunks[0]], ids[2:5])
+
+    @override_settings(
+        OVERDUE_RANGE_SIZE=3, OVERDUE_CHUNK_SIZE=4, OVERDUE_DIGEST_SIZE=2
+    )
+    @patch("library.tasks.metrics.emit")
+    @patch("library.tasks.not_overdue")
+    @patch("library.tasks.overdue_digest")
+    def test_run_sync_with_api_fans_out(self, digest_mock, not_overdue_mock, emit_mock):
+        ids = Borrowing.objects.filter(
+            actual_return_date=None, expected_return_date__lt=self.today
+        ).order_by("id")
+        first_id, last_id = ids.first().id, ids.last().id
+        ranges = last_id // 3 - first_id // 3 + 1
+
+        self.assertEqual(run_sync_with_api(), ranges)
+
+        self.assertEqual(
+            sum(len(call.args[0]) for call in digest_mock.call_args_list), 7
+        )
+        self.assertEqual(OverdueReport.objects.filter(finished=True).count(), ranges)
+        self.assertTrue(
+            all(
+                report.first_id % 3 == 0 and report.last_id == report.first_id + 2
+                for report in OverdueReport.objects.all()
+            )
+        )
+        emit_mock.assert_called_once_with(
+            "overdue.summary", day=str(self.today), overdue=7, ranges=ranges
+        )
+        not_overdue_mock.assert_not_called()
+
+    @override_settings(OVERDUE_RANGE_SIZE=3, OVERDUE_DIGEST_SIZE=2)
+    @patch("library.tasks.metrics.emit")
+    @patch("library.tasks.overdue_digest")
+    def test_run_sync_with_api_again_after_a_return(self, digest_mock, emit_mock):
+        run_sync_with_api()
+        first = Borrowing.objects.filter(actual_return_date=None).earliest("id")
+        Borrowing.objects.filter(pk=first.pk).update(actual_return_date=self.today)
+
+        run_sync_with_api()
+
+        sent = [
+            row["id"] for call in digest_mock.call_args_list for row in call.args[0]
+        ]
+        self.assertEqual(len(sent), 7)
+        self.assertEqual(len(set(sent)), 7)
+
+    @override_settings(OVERDUE_DIGEST_SIZE=2)
+    @patch("library.tasks.overdue_digest")
+    def test_notify_overdue_range_is_idempotent_per_day(self, digest_mock):
+        first_id = Borrowing.objects.order_by("id").first().id
+        day = str(self.today)
+
+        self.assertEqual(notify_overdue_range(first_id, first_id + 8, day), 7)
+        self.assertEqual(notify_overdue_range(first_id, first_id + 8, day), 7)
+
+        self.assertEqual(digest_mock.call_count, 4)
+
+    @override_settings(OVERDUE_DIGEST_SIZE=2)
+    @patch("library.tasks.overdue_digest")
+    def test_notify_overdue_range_resumes_after_failure(self, digest_mock):
+        first_id = Borrowing.objects.order_by("id").first().id
+        day = str(self.today)
+        digest_mock.side_effect = [None, ConnectionError, None, None, None]
+
+        with self.assertRaises(ConnectionError):
+            notify_overdue_range.run(first_id, first_id + 8, day)
+        self.assertEqual(notify_overdue_range(first_id, first_id + 8, day), 7)
+
+        sent = [
+            row["id"] for call in digest_mock.call_args_list for row in call.args[0]
+        ]
+        self.assertEqual(len(sent), 9)
+        self.assertEqual(len(set(sent)), 7)
+        self.assertEqual(sent.count(sent[0]), 1)
+        self.assertEqual(sent[2:4], sent[4:6])
+
+    @patch("library.tasks.not_overdue")
+    @patch("library.tasks.overdue_digest")
+    def test_run_sync_with_api_nothing_overdue(self, digest_mock, not_overdue_mock):
+        Borrowing.objects.update(actual_return_date=self.today)
+
+        self.assertEqual(run_sync_with_api(), 0)
+
+        digest_mock.assert_not_called()
+        not_overdue_mock.assert_called_once()
@@ -0,0 +1,166 @@
+import datetime
+import json
+import time
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from library.loadtest import sign_payload
+from library.models import Book, Borrowing, Payment, WebhookEvent
+from library.stripe import WebhookProcessor
+from library.tasks import process_webhook_events
+from rest_framework import status
+from rest_framework.test import APIClient
+
+WEBHOOK_URL = reverse("library:stripe-webhook")
+PAYMENT_SUCCESS_URL = reverse("library:payment-success")
+SECRET = "whsec_test"
+
+
+def event(session_id, event_id="evt_1", type="checkout.session.completed", **data):
+    return json.dumps(
+        {
+            "id": event_id,
+            "object": "event",
+            "type": type,
+            "data": {
+                "object": {
+                    "id": session_id,
+                    "object": "checkout.session",
+                    "payment_status": "paid",
+                    **data,
+                }
+            },
+        }
+    )
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET=SECRET)
+class StripeWebhookTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email="123@test.com", password="123test"
+        )
+        book = Book.objects.create(
+            title="Three men in a boat",
+            author="Jerome K. Jerome",
+            cover="SOFT",
+            inventory=20,
+            daily_fee=0.15,
+        )
+        borrowing = Borrowing.objects.create(
+            expected_return_date=datetime.date.today() + datetime.timedelta(days=7),
+            book=book,
+            user=self.user,
+        )
+        self.payments = [
+            Payment.objects.create(
+                status=Payment.StatusChoices.PENDING,
+                type=Payment.TypeChoices.PAYMENT,
+                borrowing=borrowing,
+                session_id=session_id,
+            )
+            for session_id in ("cs_test_1", "cs_test_1", "cs_test_2")
+        ]
+
+    def post(self, payload, signature=None):
+        return self.client.post(
+            WEBHOOK_URL,
+            payload,
+            content_type="application/json",
+            HTTP_STRIPE_SIGNATURE=signature or sign_payload(payload, SECRET),
+        )
+
+    def paid(self):
+        return set(
+            Payment.objects.filter(status=Payment.StatusChoices.PAID).values_list(
+                "id", flat=True
+            )
+        )
+
+    def test_acknowledges_without_touching_payments(self):
+        with self.assertNumQueries(1):
+            res = self.post(event("cs_test_1"))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(WebhookEvent.objects.get().payload["id"], "cs_test_1")
+        self.assertEqual(self.paid(), set())
+
+    def test_rejects_bad_signatures(self):
+        payload = event("cs_test_1")
+
+        for signature in (
+            sign_payload(payload, "whsec_other"),
+            sign_payload(payload, SECRET, timestamp=int(time.time()) - 3600),
+            "t=1,v1=0",
+        ):
+            res = self.post(payload, signature)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_redelivery_is_ignored(self):
+        self.post(event("cs_test_1"))
+        self.post(event("cs_test_1"))
+
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+
+    def test_other_events_are_not_stored(self):
+        res = self.post(event("cs_test_1", type="customer.created"))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_processes_in_bulk(self):
+        self.post(event("cs_test_1", "evt_1"))
+        self.post(event("cs_test_2", "evt_2"))
+        self.post(event("cs_unknown", "evt_3"))
+
+        # Savepoints around a claim, an update of the payments and one of
+        # the events
+        with self.assertNumQueries(5):
+            self.assertEqual(WebhookProcessor().process_batch(), 3)
+
+        self.assertEqual(self.paid(), {payment.id for payment in self.payments})
+        self.assertEqual(process_webhook_events(), 0)
+
+    def test_unpaid_session_waits_for_async_payment(self):
+        self.post(event("cs_test_2", "evt_1", payment_status="unpaid"))
+        WebhookProcessor().process()
+
+        self.assertEqual(self.paid(), set())
+
+        self.post(
+            event("cs_test_2", "evt_2", type="checkout.session.async_payment_succeeded")
+        )
+        WebhookProcessor().process()
+
+        self.assertEqual(self.paid(), {self.payments[2].id})
+
+    def test_success_page_does_not_confirm(self):
+        self.client.force_authenticate(self.user)
+
+        res = self.client.get(PAYMENT_SUCCESS_URL, {"session_id": "cs_test_1"})
+
+        self.assertEqual(res.json(), "Your payment is being confirmed")
+        self.assertEqual(self.paid(), set())
+
+        self.post(event("cs_test_1"))
+        WebhookProcessor().process()
+        res = self.client.get(PAYMENT_SUCCESS_URL, {"session_id": "cs_test_1"})
+
+        self.assertEqual(res.json(), "Your payment is successful")
+
+    def test_success_page_requires_authentication(self):
+        res = self.client.get(PAYMENT_SUCCESS_URL, {"session_id": "cs_test_1"})
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        res = self.client.get(
+            PAYMENT_SUCCESS_URL,
+            {"session_id": "cs_test_1"},
+            HTTP_AUTHORIZATION="Bearer invalid",
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -0,0 +1,13 @@
+from library.models import Book
+
+
+def sample_book(**kwargs):
+    defaults = {
+        "author": "Jerome K. Jerome",
+        "title": "Three men in a boat",
+        "cover": "SOFT",
+        "daily_fee": 0.15,
+        "inventory": 20,
+    }
+    defaults.update(kwargs)
+    return Book.objects.create(**defaults)
@@ -1,9 +1,12 @@
 from django.urls import path, include
-from library.stripe import order_success
+from library.stripe import stripe_webhook
 from library.views import (
+    BookDebtViewSet,
     BookViewSet,
     BorrowingViewSet,
     PaymentViewSet,
+    UserDebtViewSet,
+    payment_success,
 )
 from rest_framework import routers
 
@@ -11,10 +14,13 @@ router = routers.DefaultRouter()
 router.register("books", BookViewSet)
 router.register("borrowings", BorrowingViewSet)
 router.register("payments", PaymentViewSet)
+router.register("debts/users", UserDebtViewSet)
+router.register("debts/books", BookDebtViewSet)
 
 urlpatterns = [
+    path("payments/success/", payment_success, name="payment-success"),
     path("", include(router.urls)),
-    path("order/success", order_success, name="order_success"),
+    path("stripe/webhook/", stripe_webhook, name="stripe-webhook"),
 ]
 
 app_name = "library"
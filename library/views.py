@@ -1,35 +1,60 @@
 import datetime
+import io
+from collections import Counter, defaultdict
+from decimal import Decimal, InvalidOperation
 
-import stripe
-from django.conf import settings
+from asgiref.sync import sync_to_async
+from django.contrib.postgres.search import SearchQuery, SearchRank
 from django.db import transaction
-from django.http import HttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import F
+from django.http import (
+    FileResponse,
+    HttpResponseNotAllowed,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
 from drf_spectacular.utils import extend_schema, OpenApiParameter
-from flask import redirect
-from library.models import Book, Borrowing, Payment
-from library.notifications import new_borrowing
-from library.pagination import LibraryListPagination
+from library import bookio
+from library.cache import cached_catalog_response
+from library.models import Book, BookDebt, Borrowing, Outbox, Payment, UserDebt
+from library.outbox import publish
+from library.pagination import (
+    BorrowingPagination,
+    LibraryListPagination,
+    PaymentPagination,
+)
 from library.permissions import IsAdminOrReadOnly
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import (
+    AuthenticationFailed,
+    NotAuthenticated,
+    ValidationError,
+)
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
+from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
 from .serializers import (
     BookSerializer,
     BorrowingListSerializer,
     BorrowingUpdateSerializer,
     BorrowingCreateSerializer,
+    BulkBorrowingSerializer,
+    BulkReturnSerializer,
     PaymentSerializer,
+    UserDebtSerializer,
+    BookDebtSerializer,
 )
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
-
 
 class BookViewSet(viewsets.ModelViewSet):
-    queryset = Book.objects.all()
+    queryset = Book.objects.defer("search_vector").order_by("id")
     serializer_class = BookSerializer
     pagination_class = LibraryListPagination
     permission_classes = (AllowAny,)
@@ -39,42 +64,223 @@ class BookViewSet(viewsets.ModelViewSet):
             return [IsAdminOrReadOnly()]
         return super().get_permissions()
 
+    @staticmethod
+    def _decimal_param(params, name):
+        try:
+            return Decimal(params[name])
+        except InvalidOperation:
+            raise ValidationError({name: ["A valid number is required."]})
 
-def create_session(request, amount, name):
-    """Convert the amount from dollars to cents"""
-    amount_cents = int(amount * 100)
-    url = reverse("library:payment-success")
-    success_url = (
-        request.build_absolute_uri(url)[:-1] + "?session_id={CHECKOUT_SESSION_ID}"
+    def get_queryset(self):
+        queryset = self.queryset
+        if self.action != "list":
+            return queryset
+
+        params = self.request.query_params
+        search = params.get("search")
+        cover = params.get("cover")
+        available = params.get("available")
+
+        if search:
+            query = SearchQuery(search, config="english", search_type="websearch")
+            queryset = (
+                queryset.filter(search_vector=query)
+                .annotate(rank=SearchRank(F("search_vector"), query))
+                .order_by("-rank", "id")
+            )
+        if cover:
+            queryset = queryset.filter(cover=cover.upper())
+        if available is not None:
+            if available.lower() == "true":
+                queryset = queryset.filter(inventory__gt=0)
+            elif available.lower() == "false":
+                queryset = queryset.filter(inventory=0)
+        if "min_fee" in params:
+            queryset = queryset.filter(
+                daily_fee__gte=self._decimal_param(params, "min_fee")
+            )
+        if "max_fee" in params:
+            queryset = queryset.filter(
+                daily_fee__lte=self._decimal_param(params, "max_fee")
+            )
+
+        return queryset
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name="search",
+                type={"type": "string"},
+                description="Full-text search in title and author "
+                '(ex. ?search=three men, ?search="idle thoughts" -fellow)',
+                required=False,
+            ),
+            OpenApiParameter(
+                name="cover",
+                type={"type": "string"},
+                description="HARD or SOFT",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="available",
+                type={"type": "Boolean"},
+                description="(ex. ?available=true   return books with copies in stock)",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="min_fee",
+                type={"type": "number"},
+                description="Lowest daily fee",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="max_fee",
+                type={"type": "number"},
+                description="Highest daily fee",
+                required=False,
+            ),
+        ],
     )
-    cancel_url = request.build_absolute_uri(reverse("library:payment-cancel"))
+    def list(self, request, *args, **kwargs):
+        return cached_catalog_response(request, "list", super().list, *args, **kwargs)
 
-    """ Create a new session in Stripe """
-    session = stripe.checkout.Session.create(
-        payment_method_types=["card"],
-        line_items=[
-            {
-                "price_data": {
-                    "currency": "usd",
-                    "product_data": {
-                        "name": name,
-                    },
-                    "unit_amount": amount_cents,
-                },
-                "quantity": 1,
-            }
+    def retrieve(self, request, *args, **kwargs):
+        return cached_catalog_response(
+            request, "retrieve", super().retrieve, *args, **kwargs
+        )
+
+    @staticmethod
+    def _file_format(request, name=None):
+        file_format = request.query_params.get("file_format")
+        if file_format is None and name:
+            file_format = name.rsplit(".", 1)[-1].lower()
+        if file_format not in bookio.FORMATS:
+            raise ValidationError(
+                {"file_format": [f"One of: {', '.join(bookio.FORMATS)}"]}
+            )
+        return file_format
+
+    """ Upsert books from an uploaded CSV or NDJSON file, validated and
+    written in chunks; invalid rows are reported by line and skipped """
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name="file_format",
+                type={"type": "string"},
+                description="csv or ndjson, taken from the file name by default",
+                required=False,
+            ),
         ],
-        mode="payment",
-        success_url=success_url,
-        cancel_url=cancel_url,
     )
+    @action(
+        detail=False,
+        methods=["POST"],
+        url_path="import",
+        permission_classes=[IsAdminUser],
+        parser_classes=[MultiPartParser],
+    )
+    def import_books(self, request):
+        upload = request.FILES.get("file")
+        if upload is None:
+            raise ValidationError({"file": ["No file was submitted."]})
+        file_format = self._file_format(request, upload.name)
+        lines = io.TextIOWrapper(upload.file, encoding="utf-8-sig", newline="")
+        report = bookio.BookImporter().run(lines, file_format)
+        return Response(report, status=status.HTTP_200_OK)
 
-    return session
+    """ Stream the whole catalog as CSV or NDJSON without loading it """
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name="file_format",
+                type={"type": "string"},
+                description="csv (default) or ndjson",
+                required=False,
+            ),
+        ],
+    )
+    @action(
+        detail=False,
+        methods=["GET"],
+        url_path="export",
+        permission_classes=[IsAdminUser],
+    )
+    def export_books(self, request):
+        file_format = self._file_format(request, "books.csv")
+        if isinstance(request._request, ASGIRequest):
+            # Django 4.1 iterates a streamed body on the event loop, where the
+            # ORM cannot run, so spool the export to a file in this thread
+            return FileResponse(
+                bookio.export_file(file_format),
+                as_attachment=True,
+                filename=f"books.{file_format}",
+                content_type=bookio.CONTENT_TYPES[file_format],
+            )
+        response = StreamingHttpResponse(
+            bookio.export_rows(file_format),
+            content_type=bookio.CONTENT_TYPES[file_format],
+        )
+        response["Content-Disposition"] = f'attachment; filename="books.{file_format}"'
+        return response
+
+
+async def authenticate(request):
+    """The user DRF's authentication classes find on a plain Django request"""
+    request = Request(
+        request,
+        authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+    )
+    return await sync_to_async(lambda: request.user)()
+
+
+async def payment_success(request):
+    """Landing page after checkout, polled until the Stripe webhook
+    (library.stripe) has confirmed the payment. Async, so that under ASGI
+    waiting on the database does not hold a thread"""
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+    try:
+        user = await authenticate(request)
+    except AuthenticationFailed as exc:
+        return JsonResponse({"detail": exc.detail}, status=exc.status_code)
+    if not user.is_authenticated:
+        return JsonResponse(
+            {"detail": NotAuthenticated.default_detail},
+            status=status.HTTP_401_UNAUTHORIZED,
+        )
+
+    session_id = request.GET.get("session_id")
+    # A bulk return checks out all of a user's payments in one session
+    statuses = {
+        payment_status
+        async for payment_status in Payment.objects.filter(
+            session_id=session_id
+        ).values_list("status", flat=True)
+    }
+    if not session_id or not statuses:
+        return JsonResponse(
+            "Payment not found", safe=False, status=status.HTTP_400_BAD_REQUEST
+        )
+    if statuses == {Payment.StatusChoices.PAID}:
+        return JsonResponse("Your payment is successful", safe=False)
+
+    return JsonResponse("Your payment is being confirmed", safe=False)
+
+
+def checkout_urls(request):
+    url = reverse("library:payment-success")
+    success_url = (
+        request.build_absolute_uri(url)[:-1] + "?session_id={CHECKOUT_SESSION_ID}"
+    )
+    cancel_url = request.build_absolute_uri(reverse("library:payment-cancel"))
+    return success_url, cancel_url
 
 
 class BorrowingViewSet(viewsets.ModelViewSet):
     queryset = Borrowing.objects.all().select_related("book")
-    pagination_class = LibraryListPagination
+    pagination_class = BorrowingPagination
     permission_classes = (IsAuthenticated,)
 
     def get_permissions(self):
@@ -87,6 +293,10 @@ class BorrowingViewSet(viewsets.ModelViewSet):
             return BorrowingUpdateSerializer
         elif self.action == "create":
             return BorrowingCreateSerializer
+        elif self.action == "bulk_borrow":
+            return BulkBorrowingSerializer
+        elif self.action == "bulk_return":
+            return BulkReturnSerializer
         return BorrowingListSerializer
 
     def get_queryset(self):
@@ -118,82 +328,184 @@ class BorrowingViewSet(viewsets.ModelViewSet):
 
         return queryset
 
-    """ Create Payment session, change Borrowing object, create Payment object """
+    """ Return Borrowing and create Payment in one short transaction.
+    The Payment session is created by the outbox relay after commit,
+    poll the returned Payment for its session_url """
 
-    @transaction.atomic
     def update(self, request, pk=None):
-        borrowing = Borrowing.objects.get(pk=pk)
+        with transaction.atomic():
+            queryset = self.get_queryset().select_for_update(of=("self",))
+            borrowing = get_object_or_404(queryset, pk=pk)
+            self.check_object_permissions(request, borrowing)
 
-        if borrowing.actual_return_date is None:
-            borrowing = self.return_borrowing()
-            borrowing.is_active = False
-            book = borrowing.book
-            book.inventory += 1
-
-            serializer = BorrowingUpdateSerializer(
-                borrowing,
-                many=False,
-                partial=True,
-                data={"actual_return_date": datetime.date.today()},
-            )
+            if borrowing.actual_return_date is not None:
+                serializer = BorrowingUpdateSerializer(borrowing)
+                return Response(serializer.data)
 
-            serializer.is_valid()
-            borrowing.save()
-            book.save()
             money = borrowing.pay_money()
-            session = create_session(request, money, book.title)
-
-            request.session["session_id"] = session.id
-            request.session["session_url"] = session.url
-            SESSION_URL = session.url
-
+            borrowing.is_active = False
+            Borrowing.objects.filter(pk=borrowing.pk).update(
+                actual_return_date=borrowing.actual_return_date,
+                is_active=False,
+            )
+            Book.release(
+                borrowing.book_id,
+                overdue=int(
+                    borrowing.expected_return_date < borrowing.actual_return_date
+                ),
+            )
             payment = Payment.objects.create(
                 money_to_pay=money,
                 borrowing=borrowing,
-                status="PAID",
-                type="PAYMENT",
-                session_id=session.id,
-                session_url=session.url,
+                status=Payment.StatusChoices.PENDING,
+                type=Payment.TypeChoices.PAYMENT,
+            )
+            success_url, cancel_url = checkout_urls(request)
+            publish(
+                Outbox.TopicChoices.PAYMENT_REQUESTED,
+                payment_id=payment.id,
+                amount=money,
+                name=borrowing.book.title,
+                success_url=success_url,
+                cancel_url=cancel_url,
             )
-            payment.save()
 
-            instance = self.get_object()
-            request.session["borrowing_pk"] = instance.pk
+        serializer = PaymentSerializer(payment)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
 
-            response = redirect(SESSION_URL)
-            return HttpResponse(response.get_data(), content_type=response.content_type)
-        else:
-            serializer = BorrowingUpdateSerializer(borrowing)
-        return Response(serializer.data)
+    @transaction.atomic
+    def perform_create(self, serializer, **kwargs):
+        book = serializer.validated_data["book"]
+        if not Book.reserve(book.id):
+            raise ValidationError({"book": ["This book is unavailable"]})
+
+        borrowing = serializer.save(user=self.request.user)
+        publish(
+            Outbox.TopicChoices.BORROWING_CREATED,
+            borrowing_id=borrowing.id,
+            user_id=self.request.user.id,
+            book_id=book.id,
+            title=book.title,
+            expected_return_date=borrowing.expected_return_date,
+        )
+
+    """ Borrow a batch of books for several users at once (front desk).
+    The batch is checked as a whole and applied in one transaction,
+    with one notification for all of it """
 
     @action(
         detail=False,
-        methods=["PUT"],
-        url_path="<int:pk>/return",
-        permission_classes=[IsAuthenticated],
+        methods=["POST"],
+        url_path="bulk",
+        permission_classes=[IsAdminUser],
     )
-    def return_borrowing(self):
-        instance = self.get_object()
-        instance.actual_return_date = datetime.date.today()
-        return instance
+    def bulk_borrow(self, request):
+        serializer = BulkBorrowingSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data["borrowings"]
+
+        with transaction.atomic():
+            copies = Counter(item["book"].id for item in items)
+            # Lock books in id order, so overlapping batches cannot deadlock
+            for book_id, count in sorted(copies.items()):
+                if not Book.reserve(book_id, count):
+                    raise ValidationError(
+                        {"borrowings": [f"Book {book_id} is unavailable"]}
+                    )
+
+            borrowings = Borrowing.objects.bulk_create(
+                Borrowing(
+                    user=item["user"],
+                    book=item["book"],
+                    expected_return_date=item["expected_return_date"],
+                )
+                for item in items
+            )
+            publish(
+                Outbox.TopicChoices.BORROWINGS_CREATED,
+                borrowings=[
+                    {
+                        "borrowing_id": borrowing.id,
+                        "user_id": borrowing.user_id,
+                        "book_id": borrowing.book_id,
+                        "title": borrowing.book.title,
+                        "expected_return_date": borrowing.expected_return_date,
+                    }
+                    for borrowing in borrowings
+                ],
+            )
 
-    def perform_create(self, serializer, **kwargs):
-        serializer.save(user=self.request.user)
-        borrowing_id = serializer.instance.id
-        id = self.request.data["book"]
-        book = get_object_or_404(Book, pk=id)
-        expected_return_date = self.request.data["expected_return_date"]
-        new_borrowing(
-            borrowing_id, self.request.user.id, id, book, expected_return_date
-        )
+        serializer = BorrowingCreateSerializer(borrowings, many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-        self.change_inventory_create()
+    """ Return a batch of borrowings at once. Every user gets one Payment
+    per borrowing, all sharing one checkout session; borrowings that are
+    already returned or do not exist are listed as skipped """
 
-    def change_inventory_create(self):
-        book_id = self.request.data["book"]
-        book = get_object_or_404(Book, pk=book_id)
-        book.inventory -= 1
-        book.save()
+    @action(
+        detail=False,
+        methods=["POST"],
+        url_path="bulk_return",
+        permission_classes=[IsAdminUser],
+    )
+    def bulk_return(self, request):
+        serializer = BulkReturnSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = set(serializer.validated_data["borrowings"])
+
+        with transaction.atomic():
+            borrowings = list(
+                Borrowing.objects.filter(id__in=ids, actual_return_date=None)
+                .select_related("book")
+                .select_for_update(of=("self",))
+                .order_by("id")
+            )
+            money = {borrowing.id: borrowing.pay_money() for borrowing in borrowings}
+            copies, overdue = Counter(), Counter()
+            for borrowing in borrowings:
+                borrowing.is_active = False
+                copies[borrowing.book_id] += 1
+                if borrowing.expected_return_date < borrowing.actual_return_date:
+                    overdue[borrowing.book_id] += 1
+            Borrowing.objects.bulk_update(
+                borrowings, ["actual_return_date", "is_active"]
+            )
+            for book_id, count in sorted(copies.items()):
+                Book.release(book_id, count, overdue[book_id])
+
+            payments = Payment.objects.bulk_create(
+                Payment(
+                    money_to_pay=money[borrowing.id],
+                    borrowing=borrowing,
+                    status=Payment.StatusChoices.PENDING,
+                    type=Payment.TypeChoices.PAYMENT,
+                )
+                for borrowing in borrowings
+            )
+            payments_of_user = defaultdict(list)
+            for payment in payments:
+                payments_of_user[payment.borrowing.user_id].append(payment)
+            success_url, cancel_url = checkout_urls(request)
+            for user_payments in payments_of_user.values():
+                publish(
+                    Outbox.TopicChoices.PAYMENT_REQUESTED,
+                    payment_ids=[payment.id for payment in user_payments],
+                    amount=sum(payment.money_to_pay for payment in user_payments),
+                    name=", ".join(
+                        payment.borrowing.book.title for payment in user_payments
+                    ),
+                    success_url=success_url,
+                    cancel_url=cancel_url,
+                )
+
+        returned = {borrowing.id for borrowing in borrowings}
+        return Response(
+            {
+                "payments": PaymentSerializer(payments, many=True).data,
+                "skipped": sorted(ids - returned),
+            },
+            status=status.HTTP_202_ACCEPTED,
+        )
 
     """Calculate money to pay for borrowing"""
 
@@ -231,7 +543,7 @@ class BorrowingViewSet(viewsets.ModelViewSet):
 class PaymentViewSet(viewsets.ModelViewSet):
     serializer_class = PaymentSerializer
     permission_classes = (IsAuthenticated,)
-    pagination_class = LibraryListPagination
+    pagination_class = PaymentPagination
     queryset = Payment.objects.all().select_related("borrowing")
 
     def get_permissions(self):
@@ -248,23 +560,6 @@ class PaymentViewSet(viewsets.ModelViewSet):
 
         return queryset
 
-    """Endpoint, if payment success"""
-
-    @action(
-        detail=False,
-        methods=["GET"],
-        url_path="success",
-        permission_classes=[IsAuthenticated],
-    )
-    def success(self, request) -> Response:
-        stripe.api_key = settings.STRIPE_SECRET_KEY
-        session_id = request.GET.get("session_id")
-        payment = Payment.objects.get(session_id=session_id)
-        payment.status = "PAID"
-        payment.save()
-
-        return Response(data=f"Your payment is successful", status=status.HTTP_200_OK)
-
     """Endpoint, if payment cancel"""
 
     @action(
@@ -275,12 +570,8 @@ class PaymentViewSet(viewsets.ModelViewSet):
     )
     def cancel(self, request) -> Response:
         session_id = request.GET.get("session_id")
-        payment = Payment.objects.filter(session_id=session_id).first()
 
-        if payment:
-            payment.status = "PENDING"
-            payment.money_to_pay = 0
-            payment.save()
+        if session_id and Payment.objects.filter(session_id=session_id).exists():
             return Response(
                 data="Try to pay later within 24 hours session is available",
                 status=status.HTTP_200_OK,
@@ -290,3 +581,23 @@ class PaymentViewSet(viewsets.ModelViewSet):
                 data="Payment not found",
                 status=status.HTTP_400_BAD_REQUEST,
             )
+
+
+class UserDebtViewSet(viewsets.ReadOnlyModelViewSet):
+    """What each user's open loans have accrued so far, read from a
+    materialized view that library.tasks.refresh_debts refreshes every ten
+    minutes (see refreshed_at). A user who owes nothing has no row."""
+
+    queryset = UserDebt.objects.order_by("-accrued", "user_id")
+    serializer_class = UserDebtSerializer
+    pagination_class = LibraryListPagination
+    permission_classes = (IsAdminUser,)
+
+
+class BookDebtViewSet(viewsets.ReadOnlyModelViewSet):
+    """The same per book"""
+
+    queryset = BookDebt.objects.order_by("-accrued", "book_id")
+    serializer_class = BookDebtSerializer
+    pagination_class = LibraryListPagination
+    permission_classes = (IsAdminUser,)
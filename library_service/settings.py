@@ -13,8 +13,10 @@ import mimetypes
 import os
 from datetime import timedelta
 from pathlib import Path
+from zoneinfo import ZoneInfo
 
-import debug_toolbar
+from celery.schedules import crontab
+from django_celery_beat.tzcrontab import TzAwareCrontab
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -29,9 +31,9 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = os.getenv("SECRET_KEY")
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.getenv("DEBUG", "True").lower() in ("1", "true", "yes")
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = [host for host in os.getenv("ALLOWED_HOSTS", "").split(",") if host]
 
 INTERNAL_IPS = [
     "127.0.0.1",
@@ -46,18 +48,17 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "django_extensions",
     "drf_spectacular",
     "rest_framework",
     "django_celery_beat",
-    "debug_toolbar",
     "library",
     "user",
 ]
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -66,6 +67,12 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# The toolbar middleware is sync only: under ASGI it would hand every
+# request, async views included, to a worker thread
+if DEBUG:
+    INSTALLED_APPS.append("debug_toolbar")
+    MIDDLEWARE.insert(1, "debug_toolbar.middleware.DebugToolbarMiddleware")
+
 ROOT_URLCONF = "library_service.urls"
 
 TEMPLATES = [
@@ -85,6 +92,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "library_service.wsgi.application"
+ASGI_APPLICATION = "library_service.asgi.application"
 import sys
 
 if "test" in sys.argv:
@@ -103,9 +111,49 @@ DATABASES = {
     }
 }
 
+# Shared by every web and Celery process, so cached pages and throttle
+# counters agree across workers; tests and setups without REDIS_URL fall
+# back to a per-process cache
+REDIS_URL = os.getenv("REDIS_URL")
+
+if REDIS_URL and "test" not in sys.argv:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+            "KEY_PREFIX": "library",
+            "VERSION": int(os.getenv("CACHE_VERSION", 1)),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "library",
+            "KEY_PREFIX": "library",
+        }
+    }
+
 API_KEY = os.environ.get("API_KEY")
 BOT_NUMBER = os.environ.get("BOT_NUMBER")
 
+# library.notifications.TelegramTransport or FakeTransport
+NOTIFICATION_TRANSPORT = {
+    "BACKEND": os.getenv(
+        "NOTIFICATION_TRANSPORT_BACKEND", "library.notifications.TelegramTransport"
+    ),
+    "OPTIONS": {"token": API_KEY},
+}
+# Telegram allows ~30 messages/second per bot and ~1/second per chat. A
+# token bucket lets through at most burst + rate * t messages in t seconds
+NOTIFICATION_DISPATCHER = {
+    "batch_size": 100,
+    "rate": 25,
+    "burst": 5,
+    "chat_rate": 1,
+    "chat_burst": 1,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -149,6 +197,17 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 mimetypes.add_type("application/javascript", ".js", True)
 
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "library": {"handlers": ["console"], "level": "INFO"},
+    },
+}
+
 REST_FRAMEWORK = {
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
     "DEFAULT_THROTTLE_CLASSES": [
@@ -182,12 +241,77 @@ SIMPLE_JWT = {
 
 STRIPE_PUBLIC_KEY = os.getenv("STRIPE_TEST_PUBLIC")
 STRIPE_SECRET_KEY = os.getenv("STRIPE_TEST_SECRET")
+# Signing secret of the webhook endpoint, and how old (seconds) a signed
+# event may be before it is rejected as a replay
+STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "")
+STRIPE_WEBHOOK_TOLERANCE = 300
+
+# library.payments.StripeGateway, HttpxStripeGateway or FakeGateway
+PAYMENT_GATEWAY = {
+    "BACKEND": os.getenv("PAYMENT_GATEWAY_BACKEND", "library.payments.StripeGateway"),
+    "OPTIONS": {"api_key": STRIPE_SECRET_KEY},
+}
+# Checkout sessions the outbox relay keeps in flight at once
+OUTBOX_CONCURRENCY = 20
 
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL")
 CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND")
 CELERY_TIMEZONE = "Europe/Kiev"
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60
+CELERY_TASK_ALWAYS_EAGER = "test" in sys.argv
+CELERY_BEAT_SCHEDULE = {
+    "relay-outbox": {
+        "task": "library.tasks.relay_outbox",
+        "schedule": 1.0,
+    },
+    "process-webhook-events": {
+        "task": "library.tasks.process_webhook_events",
+        "schedule": 1.0,
+    },
+    "dispatch-notifications": {
+        "task": "library.tasks.dispatch_notifications",
+        "schedule": 5.0,
+    },
+    # Just after midnight in TIME_ZONE, the day loans are counted overdue
+    # by, rather than in CELERY_TIMEZONE
+    "refresh-overdue-loans": {
+        "task": "library.tasks.refresh_overdue_loans",
+        "schedule": TzAwareCrontab(hour=0, minute=5, tz=ZoneInfo(TIME_ZONE)),
+    },
+    "reconcile-payments": {
+        "task": "library.tasks.reconcile_payments",
+        "schedule": crontab(minute="*/30"),
+    },
+    "refresh-debts": {
+        "task": "library.tasks.refresh_debts",
+        "schedule": crontab(minute="*/10"),
+    },
+}
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
 FINE_MULTIPLIER = 2
+
+# Seconds a cached catalog page or book detail is kept; any Book change
+# invalidates all of them at once
+CATALOG_CACHE_TIMEOUT = 5 * 60
+
+# Borrowing and payment listings count an unfiltered table from planner
+# statistics once it holds more rows than this; other counts are cached
+# per filter set for PAGINATION_COUNT_CACHE_TIMEOUT seconds
+PAGINATION_ESTIMATE_THRESHOLD = 100_000
+PAGINATION_COUNT_CACHE_TIMEOUT = 30
+
+# The nightly overdue job fans out one Celery task per OVERDUE_RANGE_SIZE
+# borrowing ids; each task scans OVERDUE_CHUNK_SIZE rows at a time and
+# reports OVERDUE_DIGEST_SIZE borrowings per Telegram message
+OVERDUE_RANGE_SIZE = 50000
+OVERDUE_CHUNK_SIZE = 1000
+OVERDUE_DIGEST_SIZE = 20
+
+# Pending payments are checked against Stripe PAYMENT_RECONCILE_CHUNK_SIZE
+# at a time, PAYMENT_RECONCILE_WORKERS sessions in parallel; sessions still
+# open after PAYMENT_SESSION_MAX_AGE seconds are expired
+PAYMENT_RECONCILE_WORKERS = 8
+PAYMENT_RECONCILE_CHUNK_SIZE = 200
+PAYMENT_SESSION_MAX_AGE = 24 * 60 * 60